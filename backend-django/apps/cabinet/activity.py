@@ -0,0 +1,61 @@
+"""
+Company activity feed, written as things happen (fan-out on write).
+
+The cabinet signals call record() in the transaction of the change, so
+reading the feed is one range scan of a company's ActivityEvent rows
+instead of a union of requests, documents, messages and invoices. Each
+timeline is capped: after every CABINET_ACTIVITY['trim_every'] events of a
+company, once the transaction commits, the events beyond the newest
+'timeline_size' are deleted, 'trim_batch_size' rows per statement.
+"""
+import logging
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Q
+from django.utils.text import Truncator
+
+from .models import ActivityEvent
+
+logger = logging.getLogger(__name__)
+
+
+def record(company_id, verb, target_type, target_id, title, actor=None, detail=''):
+    event = ActivityEvent.objects.create(
+        company_id=company_id, actor=actor, verb=verb, target_type=target_type, target_id=target_id,
+        title=Truncator(title).chars(255), detail=detail,
+    )
+    if _count_write(company_id) % settings.CABINET_ACTIVITY['trim_every'] == 0:
+        transaction.on_commit(lambda: trim(company_id))
+    return event
+
+
+def trim(company_id):
+    """Deletes the company's events beyond the newest timeline_size; returns how many."""
+    options = settings.CABINET_ACTIVITY
+    events = ActivityEvent.objects.filter(company_id=company_id)
+    size = options['timeline_size']
+    boundary = list(events.order_by('-created_at', '-id').values_list('created_at', 'id')[size:size + 1])
+    if not boundary:
+        return 0
+    created_at, pk = boundary[0]
+    older = events.filter(Q(created_at__lt=created_at) | Q(created_at=created_at, id__lte=pk)).order_by('created_at', 'id')
+    deleted = 0
+    while True:
+        batch = list(older.values_list('pk', flat=True)[:options['trim_batch_size']])
+        if not batch:
+            break
+        deleted += ActivityEvent.objects.filter(pk__in=batch).delete()[0]
+    logger.debug('Trimmed %s activity events of company %s', deleted, company_id)
+    return deleted
+
+
+def _count_write(company_id):
+    # Per-company write counter; losing it only delays a trim
+    key = f'cabinet:activity:{company_id}:writes'
+    cache.add(key, 0, None)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        return 0
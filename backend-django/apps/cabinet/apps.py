@@ -3,3 +3,6 @@ from django.apps import AppConfig
 class CabinetConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'apps.cabinet'
+
+    def ready(self):
+        import apps.cabinet.signals
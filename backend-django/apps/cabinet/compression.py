@@ -0,0 +1,113 @@
+"""
+Compression at rest for stored blobs (see storage.ContentAddressedStorage)
+and binary deltas between document versions (see versioning).
+
+Django-free, because the process pool workers read compressed blobs too.
+zstd needs the optional `zstandard` package; without it gzip is used and
+versions are all stored whole.
+"""
+import gzip
+import shutil
+
+try:
+    import zstandard
+except ImportError:  # optional dependency
+    zstandard = None
+
+GZIP = 'gzip'
+ZSTD = 'zstd'
+COPY_CHUNK_SIZE = 256 * 1024
+
+# Leading bytes of formats that are compressed already
+COMPRESSED_SIGNATURES = (
+    b'%PDF',                  # PDF: streams are deflated
+    b'\xff\xd8\xff',          # JPEG
+    b'\x89PNG',               # PNG
+    b'GIF8',                  # GIF
+    b'PK\x03\x04',            # ZIP, DOCX, XLSX, ODT
+    b'\x1f\x8b',              # gzip
+    b'\x28\xb5\x2f\xfd',      # zstd
+    b'BZh',                   # bzip2
+    b'\xfd7zXZ\x00',          # xz
+    b'7z\xbc\xaf\x27\x1c',    # 7-Zip
+    b'Rar!',                  # RAR
+    b'OggS',                  # Ogg
+    b'ID3',                   # MP3
+    b'\x00\x00\x00\x18ftyp',  # MP4 / HEIC
+    b'\x00\x00\x00\x1cftyp',
+    b'\x00\x00\x00\x20ftyp',
+)
+
+
+def available_codec(preferred):
+    if preferred == ZSTD and zstandard is None:
+        return GZIP
+    return preferred
+
+
+def looks_compressed(head):
+    if head.startswith(b'RIFF') and head[8:12] == b'WEBP':
+        return True
+    return head.startswith(COMPRESSED_SIGNATURES)
+
+
+def compress_bytes(data, codec):
+    if codec == ZSTD:
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    return gzip.compress(data, compresslevel=6, mtime=0)
+
+
+def sample_ratio(path, codec, sample_size):
+    """Compressed/original size of the first `sample_size` bytes of a file."""
+    with open(path, 'rb') as f:
+        sample = f.read(sample_size)
+    if not sample:
+        return 1.0
+    return len(compress_bytes(sample, codec)) / len(sample)
+
+
+def compress_file(source_path, target_path, codec):
+    with open(source_path, 'rb') as source, open(target_path, 'wb') as target:
+        if codec == ZSTD:
+            zstandard.ZstdCompressor(level=3).copy_stream(source, target, read_size=COPY_CHUNK_SIZE)
+        else:
+            with gzip.GzipFile(fileobj=target, mode='wb', compresslevel=6, mtime=0) as compressed:
+                shutil.copyfileobj(source, compressed, COPY_CHUNK_SIZE)
+
+
+def open_decompressed(path, codec):
+    """Readable (forward-seekable) stream of the original bytes of a compressed file."""
+    if codec == ZSTD:
+        if zstandard is None:
+            raise RuntimeError('zstandard is required to read zstd-compressed files')
+        return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True)
+    return gzip.open(path, 'rb')
+
+
+def read_decompressed(path, codec):
+    with open_decompressed(path, codec) as f:
+        return f.read()
+
+
+def make_delta(base, target):
+    """
+    zstd patch that turns `base` into `target` (both bytes), the way
+    `zstd --patch-from` does: `base` is loaded as a raw-content dictionary
+    the whole window can reference, so unchanged runs cost a few bytes.
+    Needs zstandard.
+    """
+    bits = min(31, max(10, (len(base) + len(target)).bit_length()))
+    params = zstandard.ZstdCompressionParameters.from_level(
+        1, window_log=bits, enable_ldm=True,
+        # Only this much of a dictionary is indexed: 1 << max(hash_log + 3, chain_log + 1)
+        hash_log=min(30, max(17, bits - 3)), chain_log=min(30, max(16, bits - 2)),
+    )
+    dictionary = zstandard.ZstdCompressionDict(base, dict_type=zstandard.DICT_TYPE_RAWCONTENT)
+    return zstandard.ZstdCompressor(dict_data=dictionary, compression_params=params).compress(target)
+
+
+def apply_delta(base, delta):
+    if zstandard is None:
+        raise RuntimeError('zstandard is required to apply version deltas')
+    dictionary = zstandard.ZstdCompressionDict(base, dict_type=zstandard.DICT_TYPE_RAWCONTENT)
+    return zstandard.ZstdDecompressor(dict_data=dictionary, max_window_size=1 << 31).decompress(delta)
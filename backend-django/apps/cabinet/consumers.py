@@ -0,0 +1,43 @@
+from asgiref.sync import async_to_sync
+from channels.generic.websocket import JsonWebsocketConsumer
+
+from .models import Thread
+from .realtime import thread_group
+
+
+class ThreadConsumer(JsonWebsocketConsumer):
+    """
+    Live feed of a single thread: new messages, read receipts and status
+    changes, as published by realtime.broadcast. Receive-only; messages
+    are still sent through the REST add_message action.
+    """
+
+    def connect(self):
+        self.group_name = None
+        user = self.scope.get('user')
+        if user is None or not user.is_authenticated:
+            self.close(code=4401)
+            return
+
+        thread_id = self.scope['url_route']['kwargs']['thread_id']
+        if not self.can_join(user, thread_id):
+            self.close(code=4403)
+            return
+
+        self.group_name = thread_group(thread_id)
+        async_to_sync(self.channel_layer.group_add)(self.group_name, self.channel_name)
+        self.accept()
+
+    def disconnect(self, code):
+        if self.group_name:
+            async_to_sync(self.channel_layer.group_discard)(self.group_name, self.channel_name)
+
+    def can_join(self, user, thread_id):
+        # Same rule as BaseCabinetViewSet / IsOwnerOrCompany
+        threads = Thread.objects.filter(id=thread_id)
+        if not user.is_superuser:
+            threads = threads.filter(company__owner=user)
+        return threads.exists()
+
+    def cabinet_event(self, event):
+        self.send_json({'type': event['event'], 'data': event['data']})
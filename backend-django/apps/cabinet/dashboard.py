@@ -0,0 +1,124 @@
+"""
+The client dashboard payload, cached per company.
+
+The payload is built from the company's CompanyStats row, joined with the
+company for its balance, and one query each for the quota counters, the
+recent requests and the newest activity, then kept in the shared cache.
+Saving or deleting a request, document, invoice or ledger entry, saving a
+subscription, and every activity event mark the company's payload stale
+(see signals). A stale payload is still served while one background
+thread rebuilds it, so only a company's very first visit waits for the
+queries.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+from apps.core import quotas
+from .models import ActivityEvent, ServiceRequest
+from .serializers import ActivityEventSerializer, ServiceRequestSerializer
+from .services import StatsService
+
+logger = logging.getLogger(__name__)
+
+RECENT_ACTIVITY = 5
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def payload(company_id):
+    """The dashboard of a company, fresh or slightly stale."""
+    entry = cache.get(_key(company_id))
+    if entry is None:
+        return refresh(company_id)
+    changed_at = cache.get(_changed_key(company_id)) or 0
+    if changed_at >= entry['built_at'] or time.time() - entry['built_at'] > settings.CABINET_DASHBOARD['max_age']:
+        schedule_refresh(company_id)
+    return entry['data']
+
+
+def invalidate(company_id):
+    """Marks the company's payload stale; the next visit triggers a rebuild."""
+    cache.set(_changed_key(company_id), time.time(), settings.CABINET_DASHBOARD['timeout'])
+
+
+def refresh(company_id):
+    # Taken before querying: changes made meanwhile leave the result stale
+    built_at = time.time()
+    data = build(company_id)
+    cache.set(_key(company_id), {'data': data, 'built_at': built_at}, settings.CABINET_DASHBOARD['timeout'])
+    return data
+
+
+def schedule_refresh(company_id):
+    """Rebuilds the payload in the background, unless a rebuild is already running."""
+    lock = _lock_key(company_id)
+    if not cache.add(lock, True, settings.CABINET_DASHBOARD['refresh_timeout']):
+        return None
+    return _submit(_refresh_in_background, company_id)
+
+
+def build(company_id):
+    stats = StatsService.get(company_id)
+    remaining = quotas.remaining(company_id)
+    recent = ServiceRequest.objects.filter(company_id=company_id).order_by('-updated_at')[:3]
+    activity = (
+        ActivityEvent.objects.filter(company_id=company_id).select_related('actor')
+        .order_by('-created_at', '-id')[:RECENT_ACTIVITY]
+    )
+    return {
+        'stats': {
+            'activeRequests': stats.active_requests,
+            'documentsCount': stats.documents_total,
+            'consultationsAvailable': remaining.get('consultations'),
+            'requestsAvailable': remaining.get('requests'),
+            'balance': stats.company.balance,
+        },
+        'recentRequests': ServiceRequestSerializer(recent, many=True).data,
+        'recentActivity': ActivityEventSerializer(activity, many=True).data,
+    }
+
+
+def _refresh_in_background(company_id):
+    try:
+        refresh(company_id)
+    except Exception:
+        logger.exception('Dashboard refresh of company %s failed', company_id)
+    finally:
+        cache.delete(_lock_key(company_id))
+
+
+def _submit(func, *args):
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.CABINET_DASHBOARD['refresh_threads'], thread_name_prefix='dashboard',
+            )
+    return _executor.submit(_in_thread, func, *args)
+
+
+def _in_thread(func, *args):
+    try:
+        return func(*args)
+    finally:
+        # Each pool thread has a database connection of its own
+        connection.close()
+
+
+def _key(company_id):
+    return f'cabinet:dashboard:{company_id}'
+
+
+def _changed_key(company_id):
+    return f'cabinet:dashboard:{company_id}:changed'
+
+
+def _lock_key(company_id):
+    return f'cabinet:dashboard:{company_id}:refresh'
@@ -0,0 +1,172 @@
+import hashlib
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified, HttpResponseRedirect, StreamingHttpResponse
+from django.utils.http import content_disposition_header
+from rest_framework.negotiation import BaseContentNegotiation
+
+from .storage import ContentAddressedStorage
+
+STREAM_CHUNK_SIZE = 64 * 1024
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+FULL_RANGE = object()
+
+
+class ChunkedStreamingResponse(StreamingHttpResponse):
+    """
+    StreamingHttpResponse over a sync iterator that streams under ASGI too.
+    Django's own __aiter__ collects a sync iterator into a list before
+    sending anything; this one runs next() through sync_to_async once per
+    chunk, in the request's sync thread (database cursors and open files
+    stay in one thread). Under WSGI the iterator is consumed as usual.
+    """
+
+    async def __aiter__(self):
+        chunks = iter(self.streaming_content)
+        end = object()
+        next_chunk = sync_to_async(next, thread_sensitive=True)
+        while (chunk := await next_chunk(chunks, end)) is not end:
+            yield chunk
+
+
+class DownloadNegotiation(BaseContentNegotiation):
+    """
+    Download actions answer with the file itself, whatever the client put in
+    Accept (PDF viewers ask for application/pdf). Errors are still JSON.
+    """
+
+    def select_parser(self, request, parsers):
+        return parsers[0]
+
+    def select_renderer(self, request, renderers, format_suffix=None):
+        return renderers[0], renderers[0].media_type
+
+
+def file_response(request, storage, name, filename=None, as_attachment=True):
+    """
+    Response for an already authorized file `name` in `storage`.
+
+    Objects in the object store (ObjectStorage) get a redirect to a
+    short-lived presigned URL. With CABINET_DOWNLOAD_ACCEL_PREFIX set, the
+    transfer is handed to nginx through X-Accel-Redirect (an `internal`
+    location aliased to MEDIA_ROOT, see nginx-depalaw.ru.conf), which also
+    takes care of Range and conditional requests. Otherwise, and for blobs
+    compressed at rest, the file is streamed from storage here, with ETag /
+    If-None-Match and single-range Range / If-Range support.
+    """
+    filename = filename or os.path.basename(name)
+
+    direct_url = getattr(storage, 'direct_url', None)
+    url = direct_url(name, filename, as_attachment) if direct_url else None
+    if url:
+        response = HttpResponseRedirect(url)
+        response['Cache-Control'] = 'private, no-store'
+        return response
+
+    content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    disposition = content_disposition_header(as_attachment, filename)
+
+    prefix = settings.CABINET_DOWNLOAD_ACCEL_PREFIX
+    # nginx would send compressed-at-rest blobs as stored; those are
+    # decompressed on the fly below instead
+    compressed = getattr(storage, 'is_compressed', None)
+    if prefix and not (compressed and compressed(name)):
+        response = HttpResponse(content_type=content_type)
+        response['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + quote(name)
+        response['Content-Disposition'] = disposition
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+    size = storage.size(name)
+    etag = file_etag(name, size)
+
+    if etag_matches(request.META.get('HTTP_IF_NONE_MATCH'), etag):
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        return response
+
+    start, end, partial = 0, size - 1, False
+    byte_range = request.META.get('HTTP_RANGE')
+    if_range = request.META.get('HTTP_IF_RANGE')
+    if byte_range and (not if_range or if_range == etag):
+        parsed = parse_range(byte_range, size)
+        if parsed is None:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+        if parsed is not FULL_RANGE:
+            start, end = parsed
+            partial = True
+
+    response = ChunkedStreamingResponse(
+        stream_file(storage, name, start, end - start + 1),
+        content_type=content_type,
+        status=206 if partial else 200,
+    )
+    if partial:
+        response['Content-Range'] = f'bytes {start}-{end}/{size}'
+    response['Content-Length'] = str(max(end - start + 1, 0))
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Content-Disposition'] = disposition
+    response['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def file_etag(name, size):
+    # Blob names are the SHA-256 of the content; legacy files are never
+    # rewritten in place, so their name and size identify the content
+    digest = ContentAddressedStorage.content_hash(name)
+    if digest is None:
+        digest = hashlib.sha1(f'{name}:{size}'.encode()).hexdigest()
+    return f'"{digest}"'
+
+
+def etag_matches(header, etag):
+    if not header:
+        return False
+    if header.strip() == '*':
+        return True
+    candidates = [tag.strip() for tag in header.split(',')]
+    return etag in candidates or f'W/{etag}' in candidates
+
+
+def parse_range(header, size):
+    """
+    (start, end) for a single `bytes=` range, inclusive and clamped to the
+    file; FULL_RANGE for anything this doesn't handle (multiple ranges,
+    other units), which means "send it all"; None when unsatisfiable.
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match:
+        return FULL_RANGE
+    first, last = match.groups()
+    if not first and not last:
+        return FULL_RANGE
+    if not first:
+        # Suffix range: the last N bytes
+        length = int(last)
+        if length == 0 or size == 0:
+            return None
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = int(last) if last else size - 1
+    if start >= size or end < start:
+        return None
+    return start, min(end, size - 1)
+
+
+def stream_file(storage, name, start, length):
+    with storage.open(name, 'rb') as f:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(STREAM_CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
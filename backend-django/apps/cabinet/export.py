@@ -0,0 +1,158 @@
+import json
+import os
+import tempfile
+import zipfile
+
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.serializers.json import DjangoJSONEncoder
+from django.utils.text import get_valid_filename
+
+from .models import Document, Invoice
+
+READ_CHUNK_SIZE = 256 * 1024
+# Manifest size past which it is spooled to a temporary file until written
+MANIFEST_MEMORY_SIZE = 1024 * 1024
+# Already compressed; deflating them again only burns CPU
+COMPRESSED_EXTENSIONS = {'.pdf', '.jpg', '.jpeg', '.png', '.gif', '.webp', '.docx', '.xlsx', '.pptx', '.zip', '.7z', '.rar'}
+
+
+class _ZipStream:
+    """Write-only file object for ZipFile that hands written bytes back out."""
+
+    def __init__(self):
+        self.buffer = []
+
+    def write(self, data):
+        self.buffer.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self):
+        data = b''.join(self.buffer)
+        self.buffer = []
+        return data
+
+
+def export_querysets(company, category=None, date_from=None, date_to=None, invoices=True):
+    documents = Document.objects.filter(company=company).exclude(file='').order_by('pk')
+    if category:
+        documents = documents.filter(category=category)
+    if date_from:
+        documents = documents.filter(created_at__date__gte=date_from)
+    if date_to:
+        documents = documents.filter(created_at__date__lte=date_to)
+
+    invoice_queryset = Invoice.objects.none()
+    if invoices:
+        invoice_queryset = Invoice.objects.filter(company=company).exclude(file='').exclude(file=None).order_by('pk')
+        if date_from:
+            invoice_queryset = invoice_queryset.filter(date__gte=date_from)
+        if date_to:
+            invoice_queryset = invoice_queryset.filter(date__lte=date_to)
+    return documents, invoice_queryset
+
+
+def stream_export(documents, invoices):
+    """
+    Yields a ZIP archive of the documents' and invoices' files, with a
+    manifest.json describing them last. Each queryset is read once, and a
+    row whose file is gone from storage is kept in the manifest with
+    "missing": true and no path. Nothing is buffered beyond one read chunk
+    (and the manifest, spooled to disk when large): the archive is written
+    to a non-seekable stream, so entry sizes and checksums go into data
+    descriptors after each file.
+    """
+    return (chunk for chunk in _generate(documents, invoices) if chunk)
+
+
+def _generate(documents, invoices):
+    stream = _ZipStream()
+    with zipfile.ZipFile(stream, 'w', zipfile.ZIP_DEFLATED, allowZip64=True) as archive, \
+            tempfile.SpooledTemporaryFile(max_size=MANIFEST_MEMORY_SIZE) as manifest:
+        manifest.write(b'{"documents": [')
+        for i, document in enumerate(documents.iterator(chunk_size=500)):
+            entry = _document_entry(document)
+            yield from _write_file(archive, stream, document.file, entry)
+            manifest.write((',' if i else '').encode() + _json(entry))
+        manifest.write(b'], "invoices": [')
+        for i, invoice in enumerate(invoices.iterator(chunk_size=500)):
+            entry = _invoice_entry(invoice)
+            yield from _write_file(archive, stream, invoice.file, entry)
+            manifest.write((',' if i else '').encode() + _json(entry))
+        manifest.write(b']}')
+
+        manifest.seek(0)
+        with archive.open('manifest.json', 'w', force_zip64=True) as target:
+            for chunk in iter(lambda: manifest.read(READ_CHUNK_SIZE), b''):
+                target.write(chunk)
+                yield stream.take()
+        yield stream.take()
+    yield stream.take()
+
+
+def _write_file(archive, stream, field_file, entry):
+    """Archives the file at entry['path'], or marks the entry missing if storage no longer has it."""
+    storage = field_file.storage
+    if not storage.exists(field_file.name):
+        entry.update(path=None, missing=True)
+        return
+    path = entry['path']
+    info = zipfile.ZipInfo(path)
+    if os.path.splitext(path)[1].lower() in COMPRESSED_EXTENSIONS:
+        info.compress_type = zipfile.ZIP_STORED
+    else:
+        info.compress_type = zipfile.ZIP_DEFLATED
+    with storage.open(field_file.name, 'rb') as source, archive.open(info, 'w', force_zip64=True) as target:
+        for chunk in iter(lambda: source.read(READ_CHUNK_SIZE), b''):
+            target.write(chunk)
+            yield stream.take()
+    yield stream.take()
+
+
+def _json(data):
+    return json.dumps(data, cls=DjangoJSONEncoder, ensure_ascii=False).encode('utf-8')
+
+
+def _document_path(document):
+    extension = os.path.splitext(document.file.name)[1]
+    title = _filename(document.title, 'document')
+    if not title.lower().endswith(extension.lower()):
+        title += extension
+    return f'documents/{document.category}/{document.pk}-{title}'
+
+
+def _invoice_path(invoice):
+    extension = os.path.splitext(invoice.file.name)[1]
+    return f'invoices/{invoice.pk}-{_filename(invoice.number, "invoice")}{extension}'
+
+
+def _filename(value, default):
+    try:
+        return get_valid_filename(value)
+    except SuspiciousFileOperation:
+        return default
+
+
+def _document_entry(document):
+    return {
+        'id': document.pk,
+        'title': document.title,
+        'category': document.category,
+        'size': document.size,
+        'created_at': document.created_at,
+        'path': _document_path(document),
+    }
+
+
+def _invoice_entry(invoice):
+    return {
+        'id': invoice.pk,
+        'number': invoice.number,
+        'description': invoice.description,
+        'amount': invoice.amount,
+        'status': invoice.status,
+        'date': invoice.date,
+        'path': _invoice_path(invoice),
+    }
@@ -0,0 +1,95 @@
+import logging
+import os
+
+from django.conf import settings
+from django.utils import timezone
+
+from . import jobs
+from .models import Document, DocumentText
+from .search import document_index
+from .workers import can_extract_text, extract_text
+
+logger = logging.getLogger(__name__)
+
+
+def schedule(document):
+    """
+    Extracts the text of a newly stored or replaced document file in the
+    process pool and indexes it for search. If a document with the same
+    content has already been extracted, its text is reused. Call after commit.
+    """
+    name = document.file.name
+    supported = can_extract_text(name)
+    DocumentText.objects.update_or_create(
+        document_id=document.pk,
+        defaults={'status': 'pending' if supported else 'unsupported', 'text': '', 'error': '', 'extracted_at': None},
+    )
+    if not supported:
+        document_index.remove(document.pk)
+        return
+
+    known = DocumentText.objects.filter(
+        document__file=name, status='ready'
+    ).exclude(document_id=document.pk).values_list('text', flat=True).first()
+    if known is not None:
+        store(document.pk, document.company_id, name, known)
+        return
+
+    jobs.submit(
+        extract_text, extract_args(name, document.file.storage),
+        on_success=lambda text: store(document.pk, document.company_id, name, text),
+        on_failure=lambda error: failed(document.pk, error),
+    )
+
+
+def extract_args(name, storage):
+    return jobs.source_of(storage, name), os.path.splitext(name)[1], settings.CABINET_DOCUMENT_TEXT_MAX_CHARS
+
+
+def store(document_id, company_id, name, text):
+    # Skipped if the document was deleted or got another file meanwhile
+    updated = DocumentText.objects.filter(document_id=document_id, document__file=name).update(
+        status='ready', text=text, error='', extracted_at=timezone.now(),
+    )
+    if updated:
+        document_index.index(document_id, text, company_id)
+
+
+def failed(document_id, error):
+    logger.warning('Text extraction of document %s failed: %s', document_id, error)
+    DocumentText.objects.filter(document_id=document_id).update(status='failed', error=str(error)[:255])
+
+
+def queue_missing():
+    """Pending rows for documents that have none (uploaded before extraction existed)."""
+    missing = Document.objects.filter(extracted_text__isnull=True).exclude(file='')
+    DocumentText.objects.bulk_create([
+        DocumentText(document_id=pk, status='pending' if can_extract_text(name) else 'unsupported')
+        for pk, name in missing.values_list('pk', 'file').iterator()
+    ], batch_size=500, ignore_conflicts=True)
+
+
+def extract_pending(batch_size=50, retry_failed=False):
+    """
+    Extracts every pending (and optionally failed) document in the pool,
+    one batch at a time. Yields the number extracted so far.
+    """
+    queue_missing()
+    statuses = ['pending', 'failed'] if retry_failed else ['pending']
+    queryset = DocumentText.objects.filter(status__in=statuses).order_by('pk')
+    storage = Document._meta.get_field('file').storage
+    done = 0
+    last_pk = 0
+    while True:
+        batch = list(queryset.filter(pk__gt=last_pk).values_list('pk', 'document__company_id', 'document__file')[:batch_size])
+        if not batch:
+            break
+        batch_jobs = [((pk, company_id, name), extract_args(name, storage)) for pk, company_id, name in batch]
+        for (pk, company_id, name), text, error in jobs.run_batch(extract_text, batch_jobs):
+            if error is not None:
+                failed(pk, error)
+            else:
+                store(pk, company_id, name, text)
+                done += 1
+        last_pk = batch[-1][0]
+        yield done
@@ -0,0 +1,83 @@
+import threading
+
+from django.conf import settings
+from django.db import connection
+
+from .workers import URL, pool
+
+
+def submit(func, args, on_success, on_failure):
+    """
+    Runs `func(*args)` (a function from .workers) in the cabinet process
+    pool and hands the result to `on_success(result)`, or the exception to
+    `on_failure(error)`. The callbacks run in the pool's result thread, so
+    they must only do database and storage bookkeeping. With
+    CABINET_WORKERS set to 0 everything runs inline instead.
+    """
+    workers = settings.CABINET_WORKERS
+    if workers <= 0:
+        try:
+            result = func(*args)
+        except Exception as e:
+            on_failure(e)
+        else:
+            on_success(result)
+        return
+
+    submitter = threading.get_ident()
+
+    def done(future):
+        try:
+            on_success(future.result())
+        except Exception as e:
+            on_failure(e)
+        finally:
+            # The result thread has a database connection of its own
+            if threading.get_ident() != submitter:
+                connection.close()
+
+    pool(workers, settings.CABINET_WORKER_MEMORY_LIMIT).submit(func, *args).add_done_callback(done)
+
+
+def run_batch(func, jobs):
+    """
+    Runs `func(*args)` for each (key, args) of `jobs` in the pool and waits
+    for all of them. Yields (key, result, error) in submission order.
+    """
+    workers = settings.CABINET_WORKERS
+    if workers <= 0:
+        for key, args in jobs:
+            try:
+                yield key, func(*args), None
+            except Exception as e:
+                yield key, None, e
+        return
+
+    executor = pool(workers, settings.CABINET_WORKER_MEMORY_LIMIT)
+    futures = [(key, executor.submit(func, *args)) for key, args in jobs]
+    for key, future in futures:
+        try:
+            yield key, future.result(), None
+        except Exception as e:
+            yield key, None, e
+
+
+def source_of(storage, name):
+    """
+    What workers read a stored file from: its path, (codec, path) if it is
+    compressed at rest, (URL, presigned GET) for an object in the object
+    store, which the worker fetches itself, or its bytes for other remote
+    storage.
+    """
+    fetch_url = getattr(storage, 'fetch_url', None)
+    url = fetch_url(name) if fetch_url else None
+    if url:
+        return URL, url
+    try:
+        path = storage.path(name)
+    except NotImplementedError:
+        # Remote storage: ship the bytes to the worker
+        with storage.open(name, 'rb') as f:
+            return f.read()
+    encoding = storage.encoding(name) if hasattr(storage, 'encoding') else ''
+    return (encoding, path) if encoding else path
@@ -0,0 +1,51 @@
+from datetime import datetime, time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from apps.cabinet.models import BalanceCheckpoint, Transaction
+from apps.cabinet.services import LedgerService
+from apps.core.models import Company
+
+
+class Command(BaseCommand):
+    help = (
+        'Writes a BalanceCheckpoint for every company with ledger entries, as of '
+        'midnight of --at (default today); run it periodically, e.g. nightly'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--at', help='YYYY-MM-DD, default today')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        day = parse_date(options['at']) if options['at'] else timezone.localdate()
+        if day is None:
+            raise CommandError('--at must be YYYY-MM-DD')
+        at = timezone.make_aware(datetime.combine(day, time.min))
+        batch_size = options['batch_size']
+
+        companies = Company.objects.filter(pk__in=Transaction.objects.values('company_id')).order_by('pk')
+        written = 0
+        last_pk = 0
+        while True:
+            with transaction.atomic():
+                # Holds back ledger entries of these companies until their
+                # checkpoints are written (LedgerService moves the company first)
+                company_ids = list(
+                    companies.select_for_update().filter(pk__gt=last_pk).values_list('pk', flat=True)[:batch_size]
+                )
+                if not company_ids:
+                    break
+                done = set(
+                    BalanceCheckpoint.objects.filter(company_id__in=company_ids, at=at).values_list('company_id', flat=True)
+                )
+                BalanceCheckpoint.objects.bulk_create([
+                    BalanceCheckpoint(company_id=pk, at=at, balance=LedgerService.balance_as_of(pk, at, inclusive=False))
+                    for pk in company_ids if pk not in done
+                ])
+                written += len(company_ids) - len(done)
+            last_pk = company_ids[-1]
+
+        self.stdout.write(self.style.SUCCESS(f'Done: {written} checkpoints written as of {at:%Y-%m-%d %H:%M %Z}.'))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from apps.cabinet.models import UploadSession
+
+
+class Command(BaseCommand):
+    help = 'Deletes expired document upload sessions and their part files'
+
+    def handle(self, *args, **options):
+        expired = UploadSession.objects.filter(expires_at__lte=timezone.now())
+        count = 0
+        for session in expired.iterator():
+            session.discard()
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f'Removed {count} expired upload sessions.'))
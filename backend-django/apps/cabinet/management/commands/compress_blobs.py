@@ -0,0 +1,62 @@
+import os
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from apps.cabinet.models import Blob, Document
+from apps.cabinet.storage import ContentAddressedStorage
+
+
+class Command(BaseCommand):
+    help = (
+        'Compresses stored document blobs that were saved as is, where it pays '
+        'off (see CABINET_COMPRESSION), and reports the bytes saved. Files are '
+        'swapped in place, so run it when uploads are quiet.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=200)
+        parser.add_argument('--stats', action='store_true', help='Only report, do not compress anything')
+
+    def handle(self, *args, **options):
+        storage = Document._meta.get_field('file').storage
+        if not options['stats']:
+            self.compress_existing(storage, options['batch_size'])
+        self.report()
+
+    def compress_existing(self, storage, batch_size):
+        compressed = 0
+        last_pk = 0
+        while True:
+            batch = list(Blob.objects.filter(encoding='', pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:batch_size])
+            if not batch:
+                break
+            for pk in batch:
+                with transaction.atomic():
+                    blob = Blob.objects.select_for_update().filter(pk=pk, encoding='').first()
+                    if blob is None:
+                        continue
+                    path = storage.path(blob.name)
+                    if not os.path.exists(path):
+                        self.stderr.write(f'{blob.name} is missing, skipped')
+                        continue
+                    encoding, compressed_path = storage._compress(path, blob.size)
+                    if not encoding:
+                        continue
+                    stored_size = os.path.getsize(compressed_path)
+                    Blob.objects.filter(pk=pk).update(encoding=encoding, stored_size=stored_size)
+                    os.replace(compressed_path, path)
+                    compressed += 1
+            last_pk = batch[-1]
+            self.stdout.write(f'Compressed {compressed} blobs...')
+        self.stdout.write(f'{compressed} blobs compressed.')
+
+    def report(self):
+        stats = ContentAddressedStorage.stats()
+        for encoding, row in stats['by_encoding'].items():
+            self.stdout.write(
+                f"{encoding}: {row['blobs']} blobs, {row['size']} bytes uploaded, "
+                f"{row['stored']} bytes stored, {row['saved']} bytes saved"
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f"Total: {stats['size']} bytes uploaded, {stats['stored']} bytes stored, {stats['saved']} bytes saved."
+        ))
@@ -0,0 +1,91 @@
+from collections import Counter
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count, Sum
+from django.utils import timezone
+from apps.cabinet.models import Blob, Document, DocumentVersion
+from apps.cabinet.storage import BLOB_PREFIX, OBJECT_PREFIX
+
+
+class Command(BaseCommand):
+    help = (
+        'Moves existing document files into content-addressed storage, '
+        'removing duplicates, and recomputes blob reference counts'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        started = timezone.now()
+        storage = Document._meta.get_field('file').storage
+        legacy_names = set()
+        moved = 0
+
+        # Objects in the object store (direct uploads) stay where they are
+        documents = (
+            Document.objects.exclude(file='').exclude(file__startswith=BLOB_PREFIX)
+            .exclude(file__startswith=OBJECT_PREFIX).order_by('pk')
+        )
+        last_pk = 0
+        while True:
+            batch = list(documents.filter(pk__gt=last_pk).values_list('pk', 'file')[:options['batch_size']])
+            if not batch:
+                break
+            for pk, name in batch:
+                if not storage.exists(name):
+                    self.stderr.write(f'Document {pk}: {name} is missing, skipped')
+                    continue
+                with storage.open(name) as content:
+                    blob_name = storage.save(name, content)
+                Document.objects.filter(pk=pk).update(file=blob_name)
+                legacy_names.add(name)
+                moved += 1
+            last_pk = batch[-1][0]
+            self.stdout.write(f'Moved {moved} documents...')
+
+        freed = 0
+        still_used = set(Document.objects.filter(file__in=legacy_names).values_list('file', flat=True))
+        still_used |= set(DocumentVersion.objects.filter(data__in=legacy_names).values_list('data', flat=True))
+        for name in legacy_names - still_used:
+            freed += storage.size(name)
+            storage.delete(name)
+
+        # Reference counts are whatever the documents and versions say they are
+        references = Counter(dict(
+            Document.objects.filter(file__startswith=BLOB_PREFIX)
+            .values_list('file').annotate(count=Count('pk')).order_by()
+        ))
+        references.update(dict(
+            DocumentVersion.objects.filter(data__startswith=BLOB_PREFIX)
+            .values_list('data').annotate(count=Count('pk')).order_by()
+        ))
+        orphans = 0
+        for blob in Blob.objects.filter(created_at__lt=started).iterator():
+            if references.get(blob.name, 0) == blob.ref_count:
+                continue
+            with transaction.atomic():
+                # Uploads change ref_count under this lock. One that did since
+                # the count above may have a document not committed yet: the
+                # blob is left for the next run
+                if not Blob.objects.select_for_update().filter(pk=blob.pk, ref_count=blob.ref_count).exists():
+                    continue
+                count = (
+                    Document.objects.filter(file=blob.name).count()
+                    + DocumentVersion.objects.filter(data=blob.name).count()
+                )
+                if count == 0:
+                    # Down to a single reference, so delete() drops the row and the file
+                    Blob.objects.filter(pk=blob.pk).update(ref_count=1)
+                    storage.delete(blob.name)
+                    orphans += 1
+                elif count != blob.ref_count:
+                    Blob.objects.filter(pk=blob.pk).update(ref_count=count)
+
+        stored = Blob.objects.aggregate(total=Sum('size'), count=Count('pk'))
+        self.stdout.write(self.style.SUCCESS(
+            f"Done: {moved} documents moved, {len(legacy_names - still_used)} legacy files removed "
+            f"({freed} bytes), {orphans} orphan blobs removed, "
+            f"{stored['total'] or 0} bytes stored in {stored['count']} blobs."
+        ))
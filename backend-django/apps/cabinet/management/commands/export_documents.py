@@ -0,0 +1,50 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+from apps.cabinet.export import export_querysets, stream_export
+from apps.cabinet.models import Document
+from apps.core.models import Company
+
+
+def date(value):
+    parsed = parse_date(value)
+    if parsed is None:
+        raise ValueError(value)
+    return parsed
+
+
+class Command(BaseCommand):
+    help = "Writes a ZIP of a company's document and invoice files plus manifest.json (offboarding, audits)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('company', type=int, help='Company id')
+        parser.add_argument('--output', '-o', default='-', help='File to write, - for stdout')
+        parser.add_argument('--category', choices=[code for code, _ in Document.CATEGORY_CHOICES])
+        parser.add_argument('--date-from', type=date)
+        parser.add_argument('--date-to', type=date)
+        parser.add_argument('--no-invoices', action='store_true')
+
+    def handle(self, *args, **options):
+        try:
+            company = Company.objects.get(pk=options['company'])
+        except Company.DoesNotExist:
+            raise CommandError(f"Company {options['company']} does not exist")
+
+        documents, invoices = export_querysets(
+            company,
+            category=options['category'],
+            date_from=options['date_from'],
+            date_to=options['date_to'],
+            invoices=not options['no_invoices'],
+        )
+        output = sys.stdout.buffer if options['output'] == '-' else open(options['output'], 'wb')
+        written = 0
+        try:
+            for chunk in stream_export(documents, invoices):
+                output.write(chunk)
+                written += len(chunk)
+        finally:
+            if output is not sys.stdout.buffer:
+                output.close()
+        self.stderr.write(self.style.SUCCESS(f'Done: {written} bytes written.'))
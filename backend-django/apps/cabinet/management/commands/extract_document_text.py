@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from apps.cabinet.extraction import extract_pending
+from apps.cabinet.models import DocumentText
+from apps.cabinet.search import document_index
+
+
+class Command(BaseCommand):
+    help = (
+        'Extracts the text of documents that are still pending (and failed ones '
+        'with --retry-failed); --reindex rebuilds the SQLite search index'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--retry-failed', action='store_true')
+        parser.add_argument('--reindex', action='store_true')
+
+    def handle(self, *args, **options):
+        done = 0
+        for done in extract_pending(batch_size=options['batch_size'], retry_failed=options['retry_failed']):
+            self.stdout.write(f'Extracted {done} documents...')
+        self.stdout.write(self.style.SUCCESS(f'Done: {done} documents extracted.'))
+
+        if options['reindex'] and document_index.is_sqlite:
+            indexed = 0
+            for indexed in document_index.rebuild(queryset=DocumentText.objects.filter(status='ready')):
+                self.stdout.write(f'Indexed {indexed} documents...')
+            self.stdout.write(self.style.SUCCESS(f'Done: {indexed} documents indexed.'))
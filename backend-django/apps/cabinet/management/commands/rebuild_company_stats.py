@@ -0,0 +1,67 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from apps.cabinet.models import CompanyStats
+from apps.cabinet.services import StatsService
+from apps.core.models import Company
+
+
+class Command(BaseCommand):
+    help = (
+        'Recounts the CompanyStats of every company from its requests, documents '
+        'and threads and fixes the counters that are off, in batches'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Only report companies whose counters are off, and fail if there are any',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        check = options['check']
+
+        checked = off = 0
+        last_pk = 0
+        while True:
+            with transaction.atomic():
+                company_ids = list(
+                    Company.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', flat=True)[:batch_size]
+                )
+                if not company_ids:
+                    break
+                # Locked so that changes made meanwhile are added to the
+                # recounted values instead of being overwritten by them
+                stored = {
+                    stats.company_id: stats
+                    for stats in CompanyStats.objects.select_for_update().filter(company_id__in=company_ids)
+                }
+                actual = StatsService.compute(company_ids)
+                created, updated = [], []
+                for pk in company_ids:
+                    counts = actual[pk]
+                    stats = stored.get(pk)
+                    if stats is None:
+                        self.stdout.write(f'Company {pk}: no stats')
+                        created.append(CompanyStats(company_id=pk, **counts))
+                        continue
+                    wrong = {name: n for name, n in counts.items() if getattr(stats, name) != n}
+                    if wrong:
+                        self.stdout.write(f'Company {pk}: ' + ', '.join(
+                            f'{name} {getattr(stats, name)} -> {n}' for name, n in wrong.items()
+                        ))
+                        for name, n in wrong.items():
+                            setattr(stats, name, n)
+                        updated.append(stats)
+                if not check:
+                    CompanyStats.objects.bulk_create(created)
+                    CompanyStats.objects.bulk_update(updated, StatsService.counters())
+                off += len(created) + len(updated)
+            checked += len(company_ids)
+            last_pk = company_ids[-1]
+
+        if check and off:
+            raise CommandError(f'{off} of {checked} companies have wrong stats.')
+        verb = 'are off' if check else 'fixed'
+        self.stdout.write(self.style.SUCCESS(f'Done: {checked} companies checked, {off} {verb}.'))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from apps.cabinet.search import message_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the full-text index of thread messages (SQLite FTS5; PostgreSQL maintains its own)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        if not message_index.is_sqlite:
+            self.stdout.write('The database maintains the message index itself, nothing to do.')
+            return
+
+        done = 0
+        for done in message_index.rebuild(batch_size=options['batch_size']):
+            self.stdout.write(f'Indexed {done} messages...')
+        self.stdout.write(self.style.SUCCESS(f'Done: {done} messages indexed.'))
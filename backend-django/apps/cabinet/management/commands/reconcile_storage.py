@@ -0,0 +1,75 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Sum
+from apps.cabinet.models import Document
+from apps.core.models import Company
+
+
+class Command(BaseCommand):
+    help = (
+        'Fills in missing document sizes and recomputes Company.storage_used '
+        'from the documents, in batches'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--dry-run', action='store_true', help='Only report companies whose counter is off')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        dry_run = options['dry_run']
+
+        sized = self.fill_document_sizes(batch_size, dry_run)
+
+        checked = fixed = 0
+        last_pk = 0
+        while True:
+            with transaction.atomic():
+                # Locking the counters holds back uploads and deletes of these
+                # companies until their totals are recomputed
+                companies = list(
+                    Company.objects.select_for_update().filter(pk__gt=last_pk)
+                    .order_by('pk').values_list('pk', 'storage_used')[:batch_size]
+                )
+                if not companies:
+                    break
+                totals = dict(
+                    Document.objects.filter(company_id__in=[pk for pk, _ in companies])
+                    .values('company_id').annotate(total=Sum('size')).values_list('company_id', 'total')
+                )
+                for pk, used in companies:
+                    actual = totals.get(pk) or 0
+                    if actual != used:
+                        self.stdout.write(f'Company {pk}: counter {used}, documents {actual}')
+                        if not dry_run:
+                            Company.objects.filter(pk=pk).update(storage_used=actual)
+                        fixed += 1
+            checked += len(companies)
+            last_pk = companies[-1][0]
+
+        verb = 'would be fixed' if dry_run else 'fixed'
+        self.stdout.write(self.style.SUCCESS(
+            f'Done: {sized} document sizes filled in, {checked} companies checked, {fixed} {verb}.'
+        ))
+
+    def fill_document_sizes(self, batch_size, dry_run):
+        """Documents uploaded before sizes were recorded: stat their files once."""
+        storage = Document._meta.get_field('file').storage
+        documents = Document.objects.filter(size=0).exclude(file='').order_by('pk')
+        filled = 0
+        last_pk = 0
+        while True:
+            batch = list(documents.filter(pk__gt=last_pk).only('pk', 'file')[:batch_size])
+            if not batch:
+                break
+            for document in batch:
+                try:
+                    document.size = storage.size(document.file.name)
+                except OSError:
+                    self.stderr.write(f'Document {document.pk}: {document.file.name} is missing, skipped')
+            sized = [document for document in batch if document.size]
+            if not dry_run:
+                Document.objects.bulk_update(sized, ['size'])
+            filled += len(sized)
+            last_pk = batch[-1].pk
+        return filled
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+from apps.cabinet.previews import render_pending
+
+
+class Command(BaseCommand):
+    help = 'Renders document previews that are still pending (and failed ones with --retry-failed)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50)
+        parser.add_argument('--retry-failed', action='store_true')
+
+    def handle(self, *args, **options):
+        done = 0
+        for done in render_pending(batch_size=options['batch_size'], retry_failed=options['retry_failed']):
+            self.stdout.write(f'Rendered {done} previews...')
+        self.stdout.write(self.style.SUCCESS(f'Done: {done} previews rendered.'))
@@ -0,0 +1,31 @@
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from apps.cabinet.s3double import S3Double
+
+
+class Command(BaseCommand):
+    help = 'Serves a local S3-compatible stand-in for direct document uploads (development only)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=9000)
+        parser.add_argument('--root', default=str(settings.BASE_DIR / 's3double'), help='Directory the objects are kept in')
+
+    def handle(self, *args, **options):
+        config = settings.CABINET_OBJECT_STORE
+        double = S3Double(
+            options['root'], config['bucket'], config['access_key'], config['secret_key'], config['region'],
+        )
+        endpoint = double.start(options['host'], options['port'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Serving bucket {config['bucket']} at {endpoint}; set CABINET_S3_ENDPOINT={endpoint} "
+            f"(with the same access and secret key) for the backend. Ctrl-C to stop."
+        ))
+        try:
+            threading.Event().wait()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            double.stop()
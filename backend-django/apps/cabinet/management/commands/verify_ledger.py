@@ -0,0 +1,86 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+from apps.cabinet.models import BalanceCheckpoint, Transaction
+from apps.core.models import Company
+
+
+class Command(BaseCommand):
+    help = (
+        'Recomputes every company balance and balance checkpoint from the raw ledger, '
+        'read in chunks, and reports drift'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help='Companies per pass')
+        parser.add_argument('--chunk-size', type=int, default=2000, help='Ledger entries fetched at a time')
+        parser.add_argument('--fix', action='store_true', help='Overwrite the values that drifted')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        self.chunk_size = options['chunk_size']
+        self.fix = options['fix']
+
+        checked = drifted = 0
+        last_pk = 0
+        while True:
+            with transaction.atomic():
+                companies = Company.objects.filter(pk__gt=last_pk).order_by('pk')
+                if self.fix:
+                    # Ledger entries of these companies wait until they are fixed
+                    companies = companies.select_for_update()
+                balances = dict(companies.values_list('pk', 'balance')[:batch_size])
+                if not balances:
+                    break
+                drifted += self.verify(balances)
+            checked += len(balances)
+            last_pk = max(balances)
+
+        if drifted and not self.fix:
+            raise CommandError(f'{drifted} balances or checkpoints of {checked} companies drifted.')
+        verb = 'fixed' if self.fix else 'drifted'
+        self.stdout.write(self.style.SUCCESS(f'Done: {checked} companies checked, {drifted} values {verb}.'))
+
+    def verify(self, balances):
+        """Replays the companies' ledger in date order, settling each checkpoint on the way."""
+        checkpoints = defaultdict(list)
+        for checkpoint in BalanceCheckpoint.objects.filter(company_id__in=list(balances)).order_by('at'):
+            checkpoints[checkpoint.company_id].append(checkpoint)
+        running = defaultdict(Decimal)
+        wrong = []
+
+        def settle(company_id, date=None):
+            # Checkpoints up to `date` hold the entries dated before them
+            pending = checkpoints[company_id]
+            while pending and (date is None or pending[0].at <= date):
+                checkpoint = pending.pop(0)
+                if checkpoint.balance != running[company_id]:
+                    self.stdout.write(
+                        f'Company {company_id}: checkpoint at {timezone.localtime(checkpoint.at):%Y-%m-%d %H:%M}: '
+                        f'{checkpoint.balance} -> {running[company_id]}'
+                    )
+                    checkpoint.balance = running[company_id]
+                    wrong.append(checkpoint)
+
+        entries = (
+            Transaction.objects.filter(company_id__in=list(balances)).order_by('company_id', 'date', 'id')
+            .values_list('company_id', 'type', 'amount', 'date').iterator(chunk_size=self.chunk_size)
+        )
+        for company_id, type, amount, date in entries:
+            settle(company_id, date)
+            running[company_id] += -amount if type == 'write_off' else amount
+
+        drifted = 0
+        for company_id, balance in balances.items():
+            settle(company_id)
+            if balance != running[company_id]:
+                self.stdout.write(f'Company {company_id}: balance {balance} -> {running[company_id]}')
+                if self.fix:
+                    Company.objects.filter(pk=company_id).update(balance=running[company_id])
+                drifted += 1
+        if self.fix:
+            BalanceCheckpoint.objects.bulk_update(wrong, ['balance'])
+        return drifted + len(wrong)
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.27 on 2026-10-18 15:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cabinet', '0002_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['thread', 'created_at', 'id'], name='cabinet_msg_thread_created_idx'),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 4.2.27 on 2026-10-18 15:32
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def backfill_read_states(apps, schema_editor):
+    """Seed a read state for each thread creator from the legacy is_read flags."""
+    Thread = apps.get_model('cabinet', 'Thread')
+    Message = apps.get_model('cabinet', 'Message')
+    ThreadReadState = apps.get_model('cabinet', 'ThreadReadState')
+
+    states = []
+    for thread in Thread.objects.exclude(created_by=None).iterator():
+        unread = Message.objects.filter(thread=thread, is_read=False).exclude(author_id=thread.created_by_id)
+        states.append(ThreadReadState(
+            thread=thread,
+            user_id=thread.created_by_id,
+            unread_count=unread.count(),
+        ))
+    ThreadReadState.objects.bulk_create(states, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('cabinet', '0003_message_thread_created_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ThreadReadState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('unread_count', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('last_read_message', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='cabinet.message')),
+                ('thread', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='read_states', to='cabinet.thread')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='thread_read_states', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['user', 'thread'], name='cabinet_readstate_user_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='threadreadstate',
+            constraint=models.UniqueConstraint(fields=('thread', 'user'), name='cabinet_unique_thread_read_state'),
+        ),
+        migrations.RunPython(backfill_read_states, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 4.2.27 on 2026-10-18 15:37
+
+from django.db import migrations, models
+from django.utils.text import Truncator
+
+
+def backfill_previews(apps, schema_editor):
+    Thread = apps.get_model('cabinet', 'Thread')
+    Message = apps.get_model('cabinet', 'Message')
+
+    for thread in Thread.objects.iterator():
+        message = Message.objects.filter(thread=thread).select_related('author').order_by('-created_at', '-id').first()
+        if message is None:
+            continue
+        author = ''
+        if message.author is not None:
+            author = f"{message.author.first_name} {message.author.last_name}".strip() or message.author.email
+        Thread.objects.filter(pk=thread.pk).update(
+            last_message_author=author,
+            last_message_preview=Truncator(message.text).chars(140),
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cabinet', '0004_threadreadstate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='thread',
+            name='last_message_author',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='thread',
+            name='last_message_preview',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.RunPython(backfill_previews, migrations.RunPython.noop),
+    ]
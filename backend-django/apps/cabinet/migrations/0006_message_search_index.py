@@ -0,0 +1,30 @@
+from django.db import migrations
+
+from apps.core.search import FullTextIndex
+
+
+def message_index(apps):
+    Message = apps.get_model('cabinet', 'Message')
+    return FullTextIndex(Message, 'text', 'thread__company_id', 'cabinet_message_fts')
+
+
+def create_index(apps, schema_editor):
+    index = message_index(apps)
+    index.create(schema_editor)
+    for _ in index.rebuild():
+        pass
+
+
+def drop_index(apps, schema_editor):
+    message_index(apps).drop(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cabinet', '0005_thread_last_message_preview'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_index, drop_index),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.27 on 2026-10-18 15:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cabinet', '0009_document_size'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentPreview',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sha256', models.CharField(max_length=64, unique=True)),
+                ('status', models.CharField(choices=[('pending', 'В очереди'), ('ready', 'Готово'), ('failed', 'Ошибка'), ('unsupported', 'Не поддерживается')], default='pending', max_length=20)),
+                ('error', models.CharField(blank=True, max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('rendered_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+    ]
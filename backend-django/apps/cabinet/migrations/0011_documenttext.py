@@ -0,0 +1,40 @@
+# Generated by Django 4.2.27 on 2026-10-18 15:53
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+from apps.core.search import FullTextIndex
+
+
+def document_index(apps):
+    DocumentText = apps.get_model('cabinet', 'DocumentText')
+    return FullTextIndex(DocumentText, 'text', 'document__company_id', 'cabinet_document_fts')
+
+
+def create_index(apps, schema_editor):
+    document_index(apps).create(schema_editor)
+
+
+def drop_index(apps, schema_editor):
+    document_index(apps).drop(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cabinet', '0010_documentpreview'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentText',
+            fields=[
+                ('document', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='extracted_text', serialize=False, to='cabinet.document')),
+                ('status', models.CharField(choices=[('pending', 'В очереди'), ('ready', 'Готово'), ('failed', 'Ошибка'), ('unsupported', 'Не поддерживается')], default='pending', max_length=20)),
+                ('text', models.TextField(blank=True)),
+                ('error', models.CharField(blank=True, max_length=255)),
+                ('extracted_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.RunPython(create_index, drop_index),
+    ]
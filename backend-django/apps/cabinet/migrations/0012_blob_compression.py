@@ -0,0 +1,31 @@
+# Generated by Django 4.2.27 on 2026-10-18 15:58
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def set_stored_size(apps, schema_editor):
+    # Everything stored so far is stored as is
+    Blob = apps.get_model('cabinet', 'Blob')
+    Blob.objects.update(stored_size=F('size'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cabinet', '0011_documenttext'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blob',
+            name='encoding',
+            field=models.CharField(blank=True, max_length=10),
+        ),
+        migrations.AddField(
+            model_name='blob',
+            name='stored_size',
+            field=models.BigIntegerField(default=0),
+        ),
+        migrations.RunPython(set_stored_size, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.27 on 2026-10-18 16:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cabinet', '0012_blob_compression'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadsession',
+            name='object_key',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+    ]
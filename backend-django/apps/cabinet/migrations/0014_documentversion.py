@@ -0,0 +1,37 @@
+# Generated by Django 4.2.27 on 2026-10-18 16:17
+
+import apps.cabinet.storage
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cabinet', '0013_uploadsession_object_key'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.PositiveIntegerField()),
+                ('kind', models.CharField(choices=[('snapshot', 'Snapshot'), ('delta', 'Delta')], max_length=10)),
+                ('data', models.FileField(blank=True, storage=apps.cabinet.storage.document_storage, upload_to='versions/%Y/%m/')),
+                ('extension', models.CharField(blank=True, max_length=16)),
+                ('size', models.BigIntegerField()),
+                ('stored_size', models.BigIntegerField()),
+                ('sha256', models.CharField(max_length=64)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('document', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='versions', to='cabinet.document')),
+            ],
+            options={
+                'ordering': ['-number'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='documentversion',
+            constraint=models.UniqueConstraint(fields=('document', 'number'), name='cabinet_unique_document_version'),
+        ),
+    ]
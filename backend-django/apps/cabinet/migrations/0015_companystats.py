@@ -0,0 +1,33 @@
+# Generated by Django 4.2.27 on 2026-10-18 16:27
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_profile_avatar_hash'),
+        ('cabinet', '0014_documentversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CompanyStats',
+            fields=[
+                ('company', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='stats', serialize=False, to='core.company')),
+                ('requests_pending', models.IntegerField(default=0)),
+                ('requests_in_progress', models.IntegerField(default=0)),
+                ('requests_done', models.IntegerField(default=0)),
+                ('requests_canceled', models.IntegerField(default=0)),
+                ('requests_waiting_user', models.IntegerField(default=0)),
+                ('documents_statutory', models.IntegerField(default=0)),
+                ('documents_contract', models.IntegerField(default=0)),
+                ('documents_accounting', models.IntegerField(default=0)),
+                ('documents_personnel', models.IntegerField(default=0)),
+                ('documents_judicial', models.IntegerField(default=0)),
+                ('documents_other', models.IntegerField(default=0)),
+                ('threads_open', models.IntegerField(default=0)),
+            ],
+        ),
+    ]
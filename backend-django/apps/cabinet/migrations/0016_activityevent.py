@@ -0,0 +1,35 @@
+# Generated by Django 4.2.27 on 2026-10-18 16:31
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('core', '0003_profile_avatar_hash'),
+        ('cabinet', '0015_companystats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ActivityEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('verb', models.CharField(choices=[('request_created', 'Новая заявка'), ('request_status', 'Статус заявки изменён'), ('document_uploaded', 'Загружен документ'), ('document_deleted', 'Удалён документ'), ('message_posted', 'Новое сообщение'), ('invoice_issued', 'Выставлен счёт'), ('invoice_paid', 'Счёт оплачен')], max_length=30)),
+                ('target_type', models.CharField(max_length=20)),
+                ('target_id', models.BigIntegerField()),
+                ('title', models.CharField(max_length=255)),
+                ('detail', models.CharField(blank=True, max_length=100)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('actor', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL)),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='activity', to='core.company')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['company', 'created_at', 'id'], name='cabinet_activity_company_idx')],
+            },
+        ),
+    ]
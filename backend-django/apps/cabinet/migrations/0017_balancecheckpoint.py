@@ -0,0 +1,54 @@
+# Generated by Django 4.2.27 on 2026-10-18 16:35
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Case, F, Sum, When
+
+
+def set_balances(apps, schema_editor):
+    # Company.balance starts out as the sum of the ledger so far
+    Company = apps.get_model('core', 'Company')
+    Transaction = apps.get_model('cabinet', 'Transaction')
+    totals = (
+        Transaction.objects.order_by().values('company_id')
+        .annotate(total=Sum(Case(When(type='write_off', then=-F('amount')), default=F('amount'))))
+    )
+    for row in totals:
+        Company.objects.filter(pk=row['company_id']).update(balance=row['total'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_company_balance'),
+        ('cabinet', '0016_activityevent'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BalanceCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('at', models.DateTimeField()),
+                ('balance', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['-at'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(fields=['company', 'date', 'id'], name='cabinet_txn_company_date_idx'),
+        ),
+        migrations.AddField(
+            model_name='balancecheckpoint',
+            name='company',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='balance_checkpoints', to='core.company'),
+        ),
+        migrations.AddConstraint(
+            model_name='balancecheckpoint',
+            constraint=models.UniqueConstraint(fields=('company', 'at'), name='cabinet_unique_balance_checkpoint'),
+        ),
+        migrations.RunPython(set_balances, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.27 on 2026-10-18 17:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cabinet', '0017_balancecheckpoint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentpreview',
+            name='object_name',
+            field=models.CharField(blank=True, max_length=255),
+        ),
+    ]
@@ -1,6 +1,12 @@
+import uuid
+from pathlib import Path
+
 from django.db import models
+from django.conf import settings
+from django.utils import timezone
 from django.contrib.auth import get_user_model
 from apps.core.models import Company
+from .storage import document_storage
 
 User = get_user_model()
 
@@ -45,14 +51,148 @@ class Document(models.Model):
     
     title = models.CharField(max_length=255)
     category = models.CharField(max_length=20, choices=CATEGORY_CHOICES, default='other')
-    file = models.FileField(upload_to='documents/%Y/%m/')
+    file = models.FileField(upload_to='documents/%Y/%m/', storage=document_storage)
     file_size = models.CharField(max_length=20, blank=True) # e.g. "2.4 MB"
+    size = models.BigIntegerField(default=0) # bytes, counted in Company.storage_used
     
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
         return self.title
 
+    @staticmethod
+    def format_size(num_bytes):
+        return f"{num_bytes / 1024 / 1024:.2f} MB"
+
+
+class Blob(models.Model):
+    """A stored file content, shared by every Document that has the same bytes."""
+    name = models.CharField(max_length=255, unique=True)
+    sha256 = models.CharField(max_length=64, db_index=True)
+    size = models.BigIntegerField()
+    # Compression at rest: codec ('' if stored as is) and bytes on disk
+    encoding = models.CharField(max_length=10, blank=True)
+    stored_size = models.BigIntegerField(default=0)
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.name} ({self.ref_count} refs)"
+
+
+class DocumentPreview(models.Model):
+    """
+    Rendered previews of one file content, shared by every Document with
+    that content (see apps.cabinet.previews). Images are stored under
+    image_name(), one per size in CABINET_PREVIEW_SIZES. Objects in the
+    object store are filed under the SHA-256 of their key instead.
+    """
+    STATUS_CHOICES = (
+        ('pending', 'В очереди'),
+        ('ready', 'Готово'),
+        ('failed', 'Ошибка'),
+        ('unsupported', 'Не поддерживается'),
+    )
+
+    sha256 = models.CharField(max_length=64, unique=True)
+    # The object rendered, for objects; blobs are found by sha256
+    object_name = models.CharField(max_length=255, blank=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    error = models.CharField(max_length=255, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    rendered_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Preview {self.sha256[:12]} ({self.status})"
+
+    def image_name(self, size):
+        extension = settings.CABINET_PREVIEW_FORMAT.lower()
+        return f"previews/{self.sha256[:2]}/{self.sha256[2:4]}/{self.sha256}-{size}.{extension}"
+
+
+class DocumentText(models.Model):
+    """
+    Text extracted from a Document's file, fed to the company-scoped
+    document search index (see apps.cabinet.extraction).
+    """
+    STATUS_CHOICES = DocumentPreview.STATUS_CHOICES
+
+    document = models.OneToOneField(Document, on_delete=models.CASCADE, primary_key=True, related_name='extracted_text')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    text = models.TextField(blank=True)
+    error = models.CharField(max_length=255, blank=True)
+    extracted_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Text of document {self.document_id} ({self.status})"
+
+
+class DocumentVersion(models.Model):
+    """
+    One file a Document has had (see apps.cabinet.versioning). A snapshot
+    is the whole file: `data`, or the document's current file while `data`
+    is empty. A delta is a zstd patch against the version before it.
+    """
+    KIND_CHOICES = (
+        ('snapshot', 'Snapshot'),
+        ('delta', 'Delta'),
+    )
+
+    document = models.ForeignKey(Document, on_delete=models.CASCADE, related_name='versions')
+    number = models.PositiveIntegerField()
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    data = models.FileField(upload_to='versions/%Y/%m/', storage=document_storage, blank=True)
+    extension = models.CharField(max_length=16, blank=True)
+    size = models.BigIntegerField() # bytes of the version
+    stored_size = models.BigIntegerField() # bytes of its data
+    sha256 = models.CharField(max_length=64)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-number']
+        constraints = [
+            models.UniqueConstraint(fields=['document', 'number'], name='cabinet_unique_document_version'),
+        ]
+
+    def __str__(self):
+        return f"Version {self.number} of document {self.document_id} ({self.kind})"
+
+
+class UploadSession(models.Model):
+    """
+    A resumable document upload. Chunks are written straight into a part
+    file at their offset; `offset` is how many leading bytes have arrived.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name='upload_sessions')
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True)
+
+    filename = models.CharField(max_length=255)
+    title = models.CharField(max_length=255, blank=True)
+    category = models.CharField(max_length=20, choices=Document.CATEGORY_CHOICES, default='other')
+    size = models.BigIntegerField()
+    offset = models.BigIntegerField(default=0)
+    # Direct uploads (DocumentViewSet.direct_upload) go to this object
+    # store key instead of the part file
+    object_key = models.CharField(max_length=255, blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    @property
+    def part_path(self):
+        return Path(settings.CABINET_UPLOAD_SESSION_DIR) / f"{self.id}.part"
+
+    def discard(self):
+        """Delete the session together with its part file or uploaded object."""
+        self.part_path.unlink(missing_ok=True)
+        if self.object_key:
+            Document._meta.get_field('file').storage.delete(self.object_key)
+        self.delete()
+
+    def __str__(self):
+        return f"Upload {self.filename} ({self.offset}/{self.size})"
+
 
 class Thread(models.Model):
     STATUS_CHOICES = (
@@ -67,6 +207,10 @@ class Thread(models.Model):
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='active')
     created_at = models.DateTimeField(auto_now_add=True)
     last_message_at = models.DateTimeField(auto_now_add=True)
+
+    # Denormalized preview of the latest message, maintained by ThreadService.message_posted
+    last_message_author = models.CharField(max_length=255, blank=True)
+    last_message_preview = models.CharField(max_length=255, blank=True)
     
     def __str__(self):
         return self.subject
@@ -79,11 +223,39 @@ class Message(models.Model):
     text = models.TextField()
     is_read = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of thread history (see pagination.MessageCursorPagination)
+            models.Index(fields=['thread', 'created_at', 'id'], name='cabinet_msg_thread_created_idx'),
+        ]
     
     def __str__(self):
         return f"Message by {self.author} in {self.thread}"
 
 
+class ThreadReadState(models.Model):
+    """Per-participant read position in a thread."""
+    thread = models.ForeignKey(Thread, on_delete=models.CASCADE, related_name='read_states')
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='thread_read_states')
+
+    # Watermark: everything up to and including this message has been read
+    last_read_message = models.ForeignKey(Message, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    unread_count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['thread', 'user'], name='cabinet_unique_thread_read_state'),
+        ]
+        indexes = [
+            models.Index(fields=['user', 'thread'], name='cabinet_readstate_user_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user} in {self.thread}: {self.unread_count} unread"
+
+
 class Invoice(models.Model):
     STATUS_CHOICES = (
         ('unpaid', 'Не оплачено'),
@@ -118,6 +290,113 @@ class Transaction(models.Model):
     type = models.CharField(max_length=20, choices=TYPE_CHOICES)
     description = models.CharField(max_length=255)
     date = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            # Balance as of a date scans from the nearest BalanceCheckpoint
+            models.Index(fields=['company', 'date', 'id'], name='cabinet_txn_company_date_idx'),
+        ]
     
     def __str__(self):
-        return f"{self.getType_display()} {self.amount}"
+        return f"{self.get_type_display()} {self.amount}"
+
+
+class BalanceCheckpoint(models.Model):
+    """
+    Balance of a company's ledger before `at`: the sum of its transactions
+    dated earlier. Written by checkpoint_balances; backdated transactions
+    move the checkpoints after them (see LedgerService).
+    """
+    company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name='balance_checkpoints')
+    at = models.DateTimeField()
+    balance = models.DecimalField(max_digits=12, decimal_places=2)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-at']
+        constraints = [
+            models.UniqueConstraint(fields=['company', 'at'], name='cabinet_unique_balance_checkpoint'),
+        ]
+
+    def __str__(self):
+        return f"Balance of company {self.company_id} before {self.at}: {self.balance}"
+
+
+class CompanyStats(models.Model):
+    """
+    Counters the dashboard reads as a single row: requests per status,
+    documents per category and open threads. Maintained by
+    apps.cabinet.services.StatsService; rebuild_company_stats checks and
+    repairs them.
+    """
+    company = models.OneToOneField(Company, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+
+    # ServiceRequest.status
+    requests_pending = models.IntegerField(default=0)
+    requests_in_progress = models.IntegerField(default=0)
+    requests_done = models.IntegerField(default=0)
+    requests_canceled = models.IntegerField(default=0)
+    requests_waiting_user = models.IntegerField(default=0)
+
+    # Document.category
+    documents_statutory = models.IntegerField(default=0)
+    documents_contract = models.IntegerField(default=0)
+    documents_accounting = models.IntegerField(default=0)
+    documents_personnel = models.IntegerField(default=0)
+    documents_judicial = models.IntegerField(default=0)
+    documents_other = models.IntegerField(default=0)
+
+    # Threads with status 'active'
+    threads_open = models.IntegerField(default=0)
+
+    @property
+    def active_requests(self):
+        return self.requests_total - self.requests_done
+
+    @property
+    def requests_total(self):
+        return sum(getattr(self, f'requests_{value}') for value, _ in ServiceRequest.STATUS_CHOICES)
+
+    @property
+    def documents_total(self):
+        return sum(getattr(self, f'documents_{value}') for value, _ in Document.CATEGORY_CHOICES)
+
+    def __str__(self):
+        return f"Stats of company {self.company_id}"
+
+
+class ActivityEvent(models.Model):
+    """
+    Append-only entry of a company's activity feed, written by the cabinet
+    signals (see apps.cabinet.activity). Only the newest
+    CABINET_ACTIVITY['timeline_size'] events of a company are kept.
+    """
+    VERB_CHOICES = (
+        ('request_created', 'Новая заявка'),
+        ('request_status', 'Статус заявки изменён'),
+        ('document_uploaded', 'Загружен документ'),
+        ('document_deleted', 'Удалён документ'),
+        ('message_posted', 'Новое сообщение'),
+        ('invoice_issued', 'Выставлен счёт'),
+        ('invoice_paid', 'Счёт оплачен'),
+    )
+
+    company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name='activity')
+    actor = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+
+    verb = models.CharField(max_length=30, choices=VERB_CHOICES)
+    # What the event is about; not a foreign key, so events outlive it
+    target_type = models.CharField(max_length=20)
+    target_id = models.BigIntegerField()
+    title = models.CharField(max_length=255)
+    detail = models.CharField(max_length=100, blank=True) # e.g. the new status
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # The feed and trimming are range scans of one company's timeline
+            models.Index(fields=['company', 'created_at', 'id'], name='cabinet_activity_company_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_verb_display()}: {self.title}"
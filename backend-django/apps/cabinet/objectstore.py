@@ -0,0 +1,113 @@
+"""
+Minimal S3-compatible object store client: AWS Signature V4 presigned URLs
+(query-string authentication) and the few calls ObjectStorage needs.
+
+`config` is settings.CABINET_OBJECT_STORE. Objects are addressed
+path-style ({endpoint}/{bucket}/{key}), which S3, MinIO, Ceph and the
+bundled s3double all accept. Every request made here is a presigned one
+too, so there is a single signing code path.
+"""
+import hashlib
+import hmac
+from datetime import datetime, timezone
+from urllib.parse import quote, urlsplit
+
+import requests
+
+ALGORITHM = 'AWS4-HMAC-SHA256'
+UNSIGNED_PAYLOAD = 'UNSIGNED-PAYLOAD'
+TIMEOUT = 30
+
+
+class ObjectStoreError(Exception):
+    pass
+
+
+def object_path(bucket, key):
+    return '/' + quote(f'{bucket}/{key}', safe='/-_.~')
+
+
+def _query_string(params):
+    return '&'.join(
+        f"{quote(k, safe='-_.~')}={quote(str(v), safe='-_.~')}" for k, v in sorted(params.items())
+    )
+
+
+def _signing_key(secret_key, date, region):
+    key = f'AWS4{secret_key}'.encode()
+    for part in (date, region, 's3', 'aws4_request'):
+        key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+    return key
+
+
+def signature(secret_key, region, method, path, params, headers):
+    """
+    SigV4 signature of a presigned request. `params` are the query
+    parameters without X-Amz-Signature; `headers` are the signed headers,
+    lower-case name -> value.
+    """
+    canonical_headers = ''.join(f'{name}:{" ".join(str(value).split())}\n' for name, value in sorted(headers.items()))
+    canonical_request = '\n'.join([
+        method, path, _query_string(params), canonical_headers, ';'.join(sorted(headers)), UNSIGNED_PAYLOAD,
+    ])
+    amz_date = params['X-Amz-Date']
+    scope = params['X-Amz-Credential'].split('/', 1)[1]
+    string_to_sign = '\n'.join([ALGORITHM, amz_date, scope, hashlib.sha256(canonical_request.encode()).hexdigest()])
+    return hmac.new(_signing_key(secret_key, amz_date[:8], region), string_to_sign.encode(), hashlib.sha256).hexdigest()
+
+
+def presign(config, method, key, expires, headers=None, params=None, now=None):
+    """
+    URL that allows `method` on `key` for `expires` seconds without further
+    credentials. The request must carry exactly the given `headers` (e.g.
+    Content-Length for a PUT of a known size); `params` go into the query,
+    e.g. response-content-disposition.
+    """
+    endpoint = config['endpoint'].rstrip('/')
+    host = urlsplit(endpoint).netloc
+    now = now or datetime.now(timezone.utc)
+    amz_date = now.strftime('%Y%m%dT%H%M%SZ')
+    signed_headers = {'host': host, **{name.lower(): value for name, value in (headers or {}).items()}}
+    query = {
+        **(params or {}),
+        'X-Amz-Algorithm': ALGORITHM,
+        'X-Amz-Credential': f"{config['access_key']}/{amz_date[:8]}/{config['region']}/s3/aws4_request",
+        'X-Amz-Date': amz_date,
+        'X-Amz-Expires': str(int(expires)),
+        'X-Amz-SignedHeaders': ';'.join(sorted(signed_headers)),
+    }
+    path = object_path(config['bucket'], key)
+    query['X-Amz-Signature'] = signature(config['secret_key'], config['region'], method, path, query, signed_headers)
+    return f'{endpoint}{path}?{_query_string(query)}'
+
+
+def head(config, key):
+    """{'size', 'etag', 'content_type'} of an object, or None if there is none."""
+    response = requests.head(presign(config, 'HEAD', key, 60), timeout=TIMEOUT)
+    if response.status_code == 404:
+        return None
+    _check(response, 'HEAD', key)
+    return {
+        'size': int(response.headers['Content-Length']),
+        'etag': response.headers.get('ETag', '').strip('"'),
+        'content_type': response.headers.get('Content-Type', ''),
+    }
+
+
+def open_stream(config, key):
+    """Readable stream of an object's bytes."""
+    response = requests.get(presign(config, 'GET', key, 60), stream=True, timeout=TIMEOUT)
+    _check(response, 'GET', key)
+    response.raw.decode_content = True
+    return response.raw
+
+
+def delete(config, key):
+    response = requests.delete(presign(config, 'DELETE', key, 60), timeout=TIMEOUT)
+    if response.status_code != 404:
+        _check(response, 'DELETE', key)
+
+
+def _check(response, method, key):
+    if response.status_code >= 300:
+        raise ObjectStoreError(f'{method} {key}: HTTP {response.status_code} {response.text[:200]}')
@@ -0,0 +1,126 @@
+import base64
+from datetime import datetime
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, CursorPagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class MessageCursorPagination(BasePagination):
+    """
+    Keyset pagination over (created_at, id) for thread history.
+
+    Without a cursor the newest page is returned. `?before=<cursor>` walks
+    back into older history, `?after=<cursor>` fetches what came later.
+    Results are always ordered oldest first so the chat can render them
+    as-is. Every page is a single index range scan on
+    Message(thread, created_at, id), independent of the thread length.
+    """
+    page_size = 50
+    max_page_size = 200
+    page_size_query_param = 'page_size'
+    before_query_param = 'before'
+    after_query_param = 'after'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+
+        before = request.query_params.get(self.before_query_param)
+        after = request.query_params.get(self.after_query_param)
+
+        if after:
+            created_at, pk = self.decode_cursor(after)
+            queryset = queryset.filter(
+                Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk)
+            ).order_by('created_at', 'id')
+            rows = list(queryset[:self.page_size + 1])
+            self.has_newer = len(rows) > self.page_size
+            self.has_older = True
+            self.page = rows[:self.page_size]
+        else:
+            if before:
+                created_at, pk = self.decode_cursor(before)
+                queryset = queryset.filter(
+                    Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk)
+                )
+            queryset = queryset.order_by('-created_at', '-id')
+            rows = list(queryset[:self.page_size + 1])
+            self.has_older = len(rows) > self.page_size
+            self.has_newer = bool(before)
+            self.page = rows[:self.page_size][::-1]
+
+        return self.page
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        if size <= 0:
+            return self.page_size
+        return min(size, self.max_page_size)
+
+    def get_next_link(self):
+        """Link to newer messages, if any are known to exist."""
+        if not self.has_newer or not self.page:
+            return None
+        url = remove_query_param(self.base_url, self.before_query_param)
+        return replace_query_param(url, self.after_query_param, self.encode_cursor(self.page[-1]))
+
+    def get_previous_link(self):
+        """Link to older history, if any is left."""
+        if not self.has_older or not self.page:
+            return None
+        url = remove_query_param(self.base_url, self.after_query_param)
+        return replace_query_param(url, self.before_query_param, self.encode_cursor(self.page[0]))
+
+    def encode_cursor(self, message):
+        raw = f"{message.created_at.isoformat()}|{message.pk}"
+        return base64.urlsafe_b64encode(raw.encode('ascii')).decode('ascii')
+
+    def decode_cursor(self, cursor):
+        try:
+            raw = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('ascii')
+            created_at, pk = raw.rsplit('|', 1)
+            return datetime.fromisoformat(created_at), int(pk)
+        except (TypeError, ValueError, UnicodeError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_schema_operation_parameters(self, view):
+        return [
+            {'name': self.before_query_param, 'required': False, 'in': 'query',
+             'description': 'Cursor: return messages older than this one.',
+             'schema': {'type': 'string'}},
+            {'name': self.after_query_param, 'required': False, 'in': 'query',
+             'description': 'Cursor: return messages newer than this one.',
+             'schema': {'type': 'string'}},
+            {'name': self.page_size_query_param, 'required': False, 'in': 'query',
+             'description': 'Number of messages per page.',
+             'schema': {'type': 'integer'}},
+        ]
+
+
+class SearchPagination(PageNumberPagination):
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class ActivityCursorPagination(CursorPagination):
+    """Newest first; each page is a range scan of the company's timeline index."""
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    ordering = ('-created_at', '-id')
@@ -14,16 +14,16 @@ class IsOwnerOrCompany(permissions.BasePermission):
         if request.user.is_superuser:
             return True
             
-        # Check if obj has company
-        if hasattr(obj, 'company'):
-            return obj.company == request.user.company
+        # Check if obj has company (compared by id: neither side is loaded)
+        if hasattr(obj, 'company_id'):
+            return obj.company_id == request.user.company_id
             
         # Check if obj has user/created_by/uploaded_by
-        if hasattr(obj, 'user'):
-            return obj.user == request.user
-        if hasattr(obj, 'created_by'):
-             return obj.created_by == request.user
-        if hasattr(obj, 'uploaded_by'):
-             return obj.uploaded_by == request.user
+        if hasattr(obj, 'user_id'):
+            return obj.user_id == request.user.pk
+        if hasattr(obj, 'created_by_id'):
+             return obj.created_by_id == request.user.pk
+        if hasattr(obj, 'uploaded_by_id'):
+             return obj.uploaded_by_id == request.user.pk
              
         return False
@@ -0,0 +1,134 @@
+import hashlib
+import logging
+import os
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.utils import timezone
+
+from . import jobs
+from .models import Blob, Document, DocumentPreview
+from .storage import OBJECT_PREFIX, ContentAddressedStorage
+from .workers import can_render_preview, render_preview
+
+logger = logging.getLogger(__name__)
+
+
+def key_of(name):
+    """
+    What the previews of a stored file are filed under: its content hash,
+    or the SHA-256 of an object's key (objects are never rewritten, so a
+    key stands for one content). None for files stored before blobs.
+    """
+    digest = ContentAddressedStorage.content_hash(name)
+    if digest is None and name and name.startswith(OBJECT_PREFIX):
+        digest = hashlib.sha256(name.encode()).hexdigest()
+    return digest
+
+
+def schedule(name, storage):
+    """
+    Makes sure the content stored under `name` gets previews. Renders in the
+    process pool, unless that content already has previews (or is queued),
+    so re-uploading a file never renders it again. Call after commit.
+    Files stored before blobs get no previews.
+    """
+    digest = key_of(name)
+    if digest is None:
+        return None
+    supported = can_render_preview(name)
+    preview, created = DocumentPreview.objects.get_or_create(
+        sha256=digest, defaults={
+            'status': 'pending' if supported else 'unsupported',
+            'object_name': name if name.startswith(OBJECT_PREFIX) else '',
+        },
+    )
+    if created and supported:
+        submit(preview, name, storage)
+    return preview
+
+
+def submit(preview, name, storage):
+    jobs.submit(
+        render_preview, render_args(name, storage),
+        on_success=lambda renditions: store(preview, renditions),
+        on_failure=lambda error: failed(preview, error),
+    )
+
+
+def render_args(name, storage):
+    return (
+        jobs.source_of(storage, name), os.path.splitext(name)[1],
+        settings.CABINET_PREVIEW_SIZES, settings.CABINET_PREVIEW_FORMAT,
+    )
+
+
+def store(preview, renditions):
+    for size, data in renditions.items():
+        image_name = preview.image_name(size)
+        default_storage.delete(image_name)
+        default_storage.save(image_name, ContentFile(data))
+    DocumentPreview.objects.filter(pk=preview.pk).update(status='ready', error='', rendered_at=timezone.now())
+
+
+def failed(preview, error):
+    logger.warning('Preview of %s failed: %s', preview.sha256, error)
+    DocumentPreview.objects.filter(pk=preview.pk).update(status='failed', error=str(error)[:255])
+
+
+def queue_missing():
+    """Pending previews for stored contents that have none (e.g. moved in by dedupe_documents)."""
+    known = DocumentPreview.objects.values('sha256')
+    missing = Blob.objects.exclude(sha256__in=known).values_list('sha256', 'name')
+    DocumentPreview.objects.bulk_create([
+        DocumentPreview(sha256=digest, status='pending' if can_render_preview(name) else 'unsupported')
+        for digest, name in missing.iterator()
+    ], batch_size=500, ignore_conflicts=True)
+
+
+def render_pending(batch_size=50, retry_failed=False):
+    """
+    Renders previews left pending (the server stopped before they were done,
+    or the content was never queued) and, optionally, failed ones. Waits for
+    each batch; yields the number rendered so far.
+    """
+    queue_missing()
+    statuses = ['pending', 'failed'] if retry_failed else ['pending']
+    queryset = DocumentPreview.objects.filter(status__in=statuses).order_by('pk')
+    storage = Document._meta.get_field('file').storage
+    done = 0
+    last_pk = 0
+    while True:
+        batch = list(queryset.filter(pk__gt=last_pk)[:batch_size])
+        if not batch:
+            break
+        names = dict(Blob.objects.filter(sha256__in=[p.sha256 for p in batch]).values_list('sha256', 'name'))
+        names.update({p.sha256: p.object_name for p in batch if p.object_name})
+        batch_jobs = []
+        for preview in batch:
+            if preview.sha256 not in names:
+                failed(preview, 'Content is no longer stored')
+                continue
+            batch_jobs.append((preview, render_args(names[preview.sha256], storage)))
+        for preview, renditions, error in jobs.run_batch(render_preview, batch_jobs):
+            if error is not None:
+                failed(preview, error)
+            else:
+                store(preview, renditions)
+                done += 1
+        last_pk = batch[-1].pk
+        yield done
+
+
+def discard(digest):
+    """Drops the previews of a content (or object) that is no longer stored."""
+    if Blob.objects.filter(sha256=digest).exists():
+        # Still stored under another extension
+        return
+    preview = DocumentPreview.objects.filter(sha256=digest).first()
+    if preview is None:
+        return
+    for size in settings.CABINET_PREVIEW_SIZES:
+        default_storage.delete(preview.image_name(size))
+    preview.delete()
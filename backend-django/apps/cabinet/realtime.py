@@ -0,0 +1,64 @@
+import threading
+import time
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.cache import cache
+
+# Latest message id per thread, written on every new message. With a shared
+# cache (REDIS_URL) this is visible to all workers; waiters only ever read
+# this key, never the database.
+LATEST_MESSAGE_KEY = 'cabinet:thread:{}:latest'
+LATEST_MESSAGE_TTL = 60 * 60 * 24
+
+# Wakes up long-poll waiters in this process as soon as a message is posted
+# here. Messages posted by other workers are picked up on the next recheck.
+_new_message = threading.Condition()
+
+
+def notify_new_message(thread_id, message_id):
+    cache.set(LATEST_MESSAGE_KEY.format(thread_id), message_id, LATEST_MESSAGE_TTL)
+    with _new_message:
+        _new_message.notify_all()
+
+
+def wait_for_new_message(thread_id, since_id, timeout):
+    """
+    Blocks until a message newer than `since_id` is announced for the thread
+    or `timeout` seconds pass. Returns True if there is something to fetch.
+    """
+    key = LATEST_MESSAGE_KEY.format(thread_id)
+    interval = settings.CABINET_LONG_POLL_RECHECK_INTERVAL
+    deadline = time.monotonic() + timeout
+
+    while True:
+        latest = cache.get(key)
+        if latest is not None and latest > since_id:
+            return True
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        with _new_message:
+            _new_message.wait(min(interval, remaining))
+
+
+def thread_group(thread_id):
+    return f'cabinet.thread.{thread_id}'
+
+
+def broadcast(thread_id, event, data):
+    """
+    Pushes an event to every WebSocket joined to the thread (see
+    consumers.ThreadConsumer). With the Redis channel layer this fans out
+    across all workers.
+    """
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    async_to_sync(channel_layer.group_send)(thread_group(thread_id), {
+        'type': 'cabinet.event',
+        'event': event,
+        'data': data,
+    })
@@ -0,0 +1,6 @@
+from django.urls import path
+from .consumers import ThreadConsumer
+
+websocket_urlpatterns = [
+    path('ws/cabinet/threads/<int:thread_id>/', ThreadConsumer.as_asgi()),
+]
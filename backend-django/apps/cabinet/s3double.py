@@ -0,0 +1,213 @@
+"""
+Local stand-in for an S3-compatible object store, for offline development
+(`manage.py run_s3double`) and the tests of direct uploads.
+
+Serves path-style PUT / GET / HEAD / DELETE of presigned URLs for one
+bucket and checks them the way S3 does: the SigV4 signature over the
+signed headers (so a PUT must carry the signed Content-Length), the
+credential, and the expiry. Objects are plain files under `root`. CORS is
+wide open so a browser on the dev server can PUT directly.
+"""
+import hashlib
+import os
+import re
+import shutil
+import tempfile
+import threading
+from datetime import datetime, timedelta, timezone
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, unquote, urlsplit
+from xml.sax.saxutils import escape
+
+from .objectstore import object_path, signature
+
+COPY_CHUNK_SIZE = 256 * 1024
+
+
+class S3Double:
+    def __init__(self, root, bucket, access_key, secret_key, region='us-east-1'):
+        self.root = root
+        self.bucket = bucket
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self.server = None
+
+    def start(self, host='127.0.0.1', port=0):
+        """Serves in a background thread; returns the endpoint URL."""
+        handler = type('Handler', (_Handler,), {'double': self})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return f'http://{host}:{self.server.server_address[1]}'
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+    def path(self, key):
+        path = os.path.normpath(os.path.join(self.root, key))
+        if not path.startswith(os.path.normpath(self.root) + os.sep):
+            raise ValueError(key)
+        return path
+
+    def config(self, endpoint):
+        """settings.CABINET_OBJECT_STORE pointing at this double."""
+        return {
+            'endpoint': endpoint, 'bucket': self.bucket, 'region': self.region,
+            'access_key': self.access_key, 'secret_key': self.secret_key,
+        }
+
+
+class _Handler(BaseHTTPRequestHandler):
+    double = None
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_OPTIONS(self):
+        self.send_response(200)
+        self._cors()
+        self.send_header('Access-Control-Allow-Methods', 'GET, HEAD, PUT, DELETE')
+        self.send_header('Access-Control-Allow-Headers', self.headers.get('Access-Control-Request-Headers', '*'))
+        self.send_header('Access-Control-Max-Age', '3600')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_PUT(self):
+        key, params = self._authorize()
+        if key is None:
+            return
+        length = int(self.headers.get('Content-Length') or 0)
+        path = self.double.path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        md5 = hashlib.md5()
+        with os.fdopen(fd, 'wb') as f:
+            while length:
+                chunk = self.rfile.read(min(length, COPY_CHUNK_SIZE))
+                if not chunk:
+                    break
+                md5.update(chunk)
+                f.write(chunk)
+                length -= len(chunk)
+        if length:
+            os.unlink(temp_path)
+            return self._error(400, 'IncompleteBody', 'The request body is shorter than Content-Length')
+        os.replace(temp_path, path)
+        self.send_response(200)
+        self._cors()
+        self.send_header('ETag', f'"{md5.hexdigest()}"')
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def do_GET(self):
+        self._get(body=True)
+
+    def do_HEAD(self):
+        self._get(body=False)
+
+    def _get(self, body):
+        key, params = self._authorize()
+        if key is None:
+            return
+        path = self.double.path(key)
+        if not os.path.isfile(path):
+            return self._error(404, 'NoSuchKey', 'The specified key does not exist.', body=body)
+        stat = os.stat(path)
+        # Only the form workers send: bytes=0-<last>
+        match = re.fullmatch(r'bytes=0-(\d+)', self.headers.get('Range', ''))
+        length = min(stat.st_size, int(match.group(1)) + 1) if match else stat.st_size
+        self.send_response(206 if match else 200)
+        self._cors()
+        self.send_header('Content-Length', str(length))
+        if match:
+            self.send_header('Content-Range', f'bytes 0-{length - 1}/{stat.st_size}')
+        self.send_header('Content-Type', params.get('response-content-type', 'application/octet-stream'))
+        self.send_header('ETag', f'"{_etag(path)}"')
+        self.send_header('Last-Modified', formatdate(stat.st_mtime, usegmt=True))
+        if 'response-content-disposition' in params:
+            self.send_header('Content-Disposition', params['response-content-disposition'])
+        self.end_headers()
+        if body:
+            with open(path, 'rb') as f:
+                if match:
+                    self.wfile.write(f.read(length))
+                else:
+                    shutil.copyfileobj(f, self.wfile, COPY_CHUNK_SIZE)
+
+    def do_DELETE(self):
+        key, params = self._authorize()
+        if key is None:
+            return
+        path = self.double.path(key)
+        if os.path.isfile(path):
+            os.unlink(path)
+        self.send_response(204)
+        self._cors()
+        self.end_headers()
+
+    def _authorize(self):
+        """(key, query params) of a valid presigned request, or (None, None) after an error response."""
+        double = self.double
+        split = urlsplit(self.path)
+        params = dict(parse_qsl(split.query, keep_blank_values=True))
+        bucket, _, key = unquote(split.path).lstrip('/').partition('/')
+        body = self.command != 'HEAD'
+        if bucket != double.bucket:
+            self._error(404, 'NoSuchBucket', 'The specified bucket does not exist.', body=body)
+            return None, None
+        try:
+            double.path(key)
+            given = params.pop('X-Amz-Signature')
+            access_key = params['X-Amz-Credential'].split('/', 1)[0]
+            signed = params['X-Amz-SignedHeaders'].split(';')
+            issued = datetime.strptime(params['X-Amz-Date'], '%Y%m%dT%H%M%SZ').replace(tzinfo=timezone.utc)
+            expires = timedelta(seconds=int(params['X-Amz-Expires']))
+        except (KeyError, ValueError):
+            self._error(403, 'AccessDenied', 'Query-string authentication is required.', body=body)
+            return None, None
+        if access_key != double.access_key:
+            self._error(403, 'InvalidAccessKeyId', 'The access key does not exist.', body=body)
+            return None, None
+        if datetime.now(timezone.utc) > issued + expires:
+            self._error(403, 'AccessDenied', 'Request has expired', body=body)
+            return None, None
+        headers = {name: self.headers.get(name, '') for name in signed}
+        expected = signature(double.secret_key, double.region, self.command, object_path(bucket, key), params, headers)
+        if expected != given:
+            self._error(403, 'SignatureDoesNotMatch', 'The request signature does not match.', body=body)
+            return None, None
+        return key, params
+
+    def _cors(self):
+        self.send_header('Access-Control-Allow-Origin', self.headers.get('Origin') or '*')
+        self.send_header('Access-Control-Expose-Headers', 'ETag')
+
+    def _error(self, code, error, message, body=True):
+        data = (
+            f'<?xml version="1.0" encoding="UTF-8"?>\n'
+            f'<Error><Code>{error}</Code><Message>{escape(message)}</Message></Error>'
+        ).encode()
+        if self.command == 'PUT':
+            # Whatever is left of the body would be read as the next request
+            self.close_connection = True
+        self.send_response(code)
+        self._cors()
+        self.send_header('Content-Type', 'application/xml')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        if body:
+            self.wfile.write(data)
+
+
+def _etag(path):
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(COPY_CHUNK_SIZE), b''):
+            md5.update(chunk)
+    return md5.hexdigest()
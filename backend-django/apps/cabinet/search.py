@@ -0,0 +1,22 @@
+from apps.core.search import FullTextIndex
+
+from .models import DocumentText, Message
+
+MESSAGE_INDEX_TABLE = 'cabinet_message_fts'
+DOCUMENT_INDEX_TABLE = 'cabinet_document_fts'
+
+message_index = FullTextIndex(
+    Message,
+    text_field='text',
+    company_field='thread__company_id',
+    table=MESSAGE_INDEX_TABLE,
+    select_related=('thread', 'author'),
+)
+
+document_index = FullTextIndex(
+    DocumentText,
+    text_field='text',
+    company_field='document__company_id',
+    table=DOCUMENT_INDEX_TABLE,
+    select_related=('document',),
+)
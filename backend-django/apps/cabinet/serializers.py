@@ -1,6 +1,10 @@
 from rest_framework import serializers
-from .models import ServiceRequest, Document, Thread, Message, Invoice, Transaction
+from rest_framework.reverse import reverse
+from django.conf import settings
+from .models import ActivityEvent, ServiceRequest, Document, DocumentPreview, DocumentVersion, UploadSession, Thread, Message, Invoice, Transaction
 from apps.core.serializers import UserSerializer
+from apps.core.search import highlight
+from .previews import key_of
 
 class ServiceRequestSerializer(serializers.ModelSerializer):
     class Meta:
@@ -8,11 +12,84 @@ class ServiceRequestSerializer(serializers.ModelSerializer):
         fields = '__all__'
         read_only_fields = ('company', 'created_by', 'created_at', 'updated_at')
 
-class DocumentSerializer(serializers.ModelSerializer):
+class DownloadUrlMixin:
+    """`download_url`: the access-checked download action of the object's viewset."""
+    download_view_name = None
+
+    def get_download_url(self, obj):
+        if not obj.file:
+            return None
+        return reverse(self.download_view_name, args=[obj.pk], request=self.context.get('request'))
+
+class DocumentListSerializer(serializers.ListSerializer):
+    """Loads the previews of the whole page in one query."""
+
+    def to_representation(self, data):
+        documents = list(data.all() if hasattr(data, 'all') else data)
+        digests = {key_of(document.file.name) for document in documents}
+        digests.discard(None)
+        self.context['previews'] = DocumentPreview.objects.in_bulk(digests, field_name='sha256')
+        return super().to_representation(documents)
+
+class DocumentSerializer(DownloadUrlMixin, serializers.ModelSerializer):
+    download_url = serializers.SerializerMethodField()
+    download_view_name = 'document-download'
+    preview = serializers.SerializerMethodField()
+
     class Meta:
         model = Document
         fields = '__all__'
-        read_only_fields = ('company', 'uploaded_by', 'created_at', 'file_size')
+        read_only_fields = ('company', 'uploaded_by', 'created_at', 'file_size', 'size')
+        list_serializer_class = DocumentListSerializer
+
+    def get_preview(self, obj):
+        """
+        {status, urls}: status is pending, ready, failed or unsupported;
+        urls maps each preview size to its URL once ready. None for files
+        stored before previews existed.
+        """
+        digest = key_of(obj.file.name)
+        if digest is None:
+            return None
+        previews = self.context.get('previews')
+        if previews is not None:
+            preview = previews.get(digest)
+        else:
+            preview = DocumentPreview.objects.filter(sha256=digest).first()
+        if preview is None:
+            return None
+
+        urls = {}
+        if preview.status == 'ready':
+            base = reverse('document-preview', args=[obj.pk], request=self.context.get('request'))
+            urls = {size: f'{base}?size={size}' for size in settings.CABINET_PREVIEW_SIZES}
+        return {'status': preview.status, 'urls': urls}
+
+class DocumentVersionSerializer(serializers.ModelSerializer):
+    download_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = DocumentVersion
+        fields = ('number', 'kind', 'size', 'stored_size', 'sha256', 'created_at', 'download_url')
+
+    def get_download_url(self, obj):
+        return reverse(
+            'document-download-version', kwargs={'pk': obj.document_id, 'number': obj.number},
+            request=self.context.get('request'),
+        )
+
+class UploadSessionSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = UploadSession
+        fields = ('id', 'filename', 'title', 'category', 'size', 'offset', 'created_at', 'expires_at')
+        read_only_fields = ('offset', 'created_at', 'expires_at')
+
+    def validate_size(self, value):
+        if value <= 0:
+            raise serializers.ValidationError('File is empty')
+        if value > settings.CABINET_UPLOAD_MAX_SIZE:
+            raise serializers.ValidationError('File is too large')
+        return value
 
 class MessageSerializer(serializers.ModelSerializer):
     author = UserSerializer(read_only=True)
@@ -23,19 +100,68 @@ class MessageSerializer(serializers.ModelSerializer):
         read_only_fields = ('thread', 'author', 'created_at')
 
 class ThreadSerializer(serializers.ModelSerializer):
-    messages = MessageSerializer(many=True, read_only=True)
+    # Messages are served by the paginated ThreadViewSet.messages action
     unread_count = serializers.SerializerMethodField()
     
     class Meta:
         model = Thread
         fields = '__all__'
-        read_only_fields = ('company', 'created_by', 'created_at', 'last_message_at')
+        read_only_fields = (
+            'company', 'created_by', 'created_at',
+            'last_message_at', 'last_message_author', 'last_message_preview',
+        )
         
     def get_unread_count(self, obj):
-        user = self.context['request'].user
-        return obj.messages.filter(is_read=False).exclude(author=user).count()
+        # Annotated by ThreadViewSet.get_queryset from ThreadReadState
+        return getattr(obj, 'unread_count', 0)
+
+class ThreadListSerializer(ThreadSerializer):
+    """Thread list row: reads nothing but the thread itself and its read state."""
+    last_message = serializers.SerializerMethodField()
+
+    class Meta(ThreadSerializer.Meta):
+        fields = ('id', 'subject', 'status', 'created_at', 'last_message_at', 'unread_count', 'last_message')
+
+    def get_last_message(self, obj):
+        if not obj.last_message_preview:
+            return None
+        return {'author': obj.last_message_author, 'text': obj.last_message_preview}
+
+class MessageSearchResultSerializer(serializers.Serializer):
+    """One search hit: built from a (message, rank) pair, see apps.core.search."""
+    id = serializers.IntegerField(source='message.id')
+    thread = serializers.IntegerField(source='message.thread_id')
+    thread_subject = serializers.CharField(source='message.thread.subject')
+    author = serializers.SerializerMethodField()
+    created_at = serializers.DateTimeField(source='message.created_at')
+    highlight = serializers.SerializerMethodField()
+    rank = serializers.FloatField()
+
+    def get_author(self, obj):
+        author = obj['message'].author
+        if author is None:
+            return None
+        return author.get_full_name() or author.email
+
+    def get_highlight(self, obj):
+        return highlight(obj['message'].text, self.context['query'])
+
+class DocumentSearchResultSerializer(serializers.Serializer):
+    """One search hit: built from a (document text, rank) pair, see apps.core.search."""
+    id = serializers.IntegerField(source='text.document_id')
+    title = serializers.CharField(source='text.document.title')
+    category = serializers.CharField(source='text.document.category')
+    created_at = serializers.DateTimeField(source='text.document.created_at')
+    highlight = serializers.SerializerMethodField()
+    rank = serializers.FloatField()
+
+    def get_highlight(self, obj):
+        return highlight(obj['text'].text, self.context['query'])
+
+class InvoiceSerializer(DownloadUrlMixin, serializers.ModelSerializer):
+    download_url = serializers.SerializerMethodField()
+    download_view_name = 'invoice-download'
 
-class InvoiceSerializer(serializers.ModelSerializer):
     class Meta:
         model = Invoice
         fields = '__all__'
@@ -46,3 +172,23 @@ class TransactionSerializer(serializers.ModelSerializer):
         model = Transaction
         fields = '__all__'
         read_only_fields = ('company',)
+
+class ActivityEventSerializer(serializers.ModelSerializer):
+    text = serializers.SerializerMethodField()
+    actor_name = serializers.SerializerMethodField()
+    date = serializers.DateTimeField(source='created_at', read_only=True)
+
+    class Meta:
+        model = ActivityEvent
+        fields = ('id', 'verb', 'target_type', 'target_id', 'title', 'detail', 'text', 'actor_name', 'date')
+
+    def get_text(self, obj):
+        text = f"{obj.get_verb_display()}: {obj.title}"
+        if obj.verb == 'request_status':
+            text += f" — {dict(ServiceRequest.STATUS_CHOICES).get(obj.detail, obj.detail)}"
+        return text
+
+    def get_actor_name(self, obj):
+        if obj.actor is None:
+            return ''
+        return obj.actor.get_full_name() or obj.actor.email
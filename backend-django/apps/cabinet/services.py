@@ -0,0 +1,338 @@
+from collections import Counter, defaultdict
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Count, F, OuterRef, Q, Subquery, Sum, When
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.text import Truncator
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from apps.core.models import Company
+from .models import BalanceCheckpoint, CompanyStats, Document, Message, ServiceRequest, Thread, ThreadReadState, Transaction
+from .realtime import broadcast, notify_new_message
+from .serializers import MessageSerializer
+
+PREVIEW_LENGTH = 140
+GIGABYTE = 1024 ** 3
+
+
+class StorageLimitExceeded(APIException):
+    status_code = status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    default_detail = 'Storage limit of your plan is exceeded'
+    default_code = 'storage_limit_exceeded'
+
+
+class ThreadService:
+    @staticmethod
+    def message_posted(message):
+        """
+        Bookkeeping after a new message has been saved; call it in the
+        transaction that saved the message. Refreshes the thread's
+        last-message preview, bumps the unread counter of every other
+        participant, moves the author's own watermark to the message they
+        just wrote and, once the transaction commits, wakes up long-poll
+        waiters and pushes the message to WebSocket subscribers.
+        """
+        with transaction.atomic():
+            Thread.objects.filter(pk=message.thread_id).update(
+                last_message_at=message.created_at,
+                last_message_author=ThreadService.author_name(message.author),
+                last_message_preview=Truncator(message.text).chars(PREVIEW_LENGTH),
+            )
+
+            ThreadReadState.objects.filter(thread_id=message.thread_id).exclude(
+                user_id=message.author_id
+            ).update(unread_count=F('unread_count') + 1)
+
+            if message.author_id:
+                ThreadReadState.objects.update_or_create(
+                    thread_id=message.thread_id,
+                    user_id=message.author_id,
+                    defaults={'last_read_message': message, 'unread_count': 0},
+                )
+
+            transaction.on_commit(lambda: ThreadService._announce_message(message))
+
+    @staticmethod
+    def author_name(user):
+        if user is None:
+            return ''
+        return user.get_full_name() or user.email
+
+    @staticmethod
+    def _announce_message(message):
+        notify_new_message(message.thread_id, message.id)
+        broadcast(message.thread_id, 'message.new', MessageSerializer(message).data)
+
+    @staticmethod
+    def status_changed(thread):
+        transaction.on_commit(lambda: broadcast(thread.id, 'thread.status', {
+            'thread': thread.id,
+            'status': thread.status,
+        }))
+
+    @staticmethod
+    def mark_read(thread, user, message_id):
+        """
+        Moves the user's watermark up to `message_id` and recounts what is
+        left unread in a single UPDATE. The watermark never moves backwards.
+        Returns the number of messages still unread.
+        """
+        remaining = Message.objects.filter(
+            thread_id=OuterRef('thread_id'), id__gt=message_id
+        ).exclude(author_id=user.id).values('thread_id').annotate(c=Count('id')).values('c')
+
+        updated = ThreadReadState.objects.filter(thread=thread, user=user).filter(
+            Q(last_read_message__isnull=True) | Q(last_read_message_id__lt=message_id)
+        ).update(
+            last_read_message_id=message_id,
+            unread_count=Coalesce(Subquery(remaining), 0),
+        )
+
+        if not updated:
+            state, created = ThreadReadState.objects.get_or_create(
+                thread=thread, user=user,
+                defaults={
+                    'last_read_message_id': message_id,
+                    'unread_count': thread.messages.filter(id__gt=message_id).exclude(author=user).count(),
+                },
+            )
+            if not created:
+                return state.unread_count
+            unread_count = state.unread_count
+        else:
+            unread_count = ThreadReadState.objects.filter(
+                thread=thread, user=user
+            ).values_list('unread_count', flat=True).first()
+
+        transaction.on_commit(lambda: broadcast(thread.id, 'thread.read', {
+            'thread': thread.id,
+            'user': user.id,
+            'last_read_message': message_id,
+        }))
+        return unread_count
+
+    @staticmethod
+    def total_unread(user):
+        """Sum of unread counts across the user's threads, in one query."""
+        return Thread.objects.filter(company_id=user.company_id).annotate(
+            unread=ThreadService.unread_count_subquery(user)
+        ).aggregate(total=Coalesce(Sum('unread'), 0))['total']
+
+    @staticmethod
+    def unread_count_subquery(user):
+        """
+        Annotation for thread querysets: the user's unread counter per
+        thread. Company members who never opened or wrote in a thread have
+        no read state yet: everything others wrote there is unread.
+        """
+        return Coalesce(
+            Subquery(
+                ThreadReadState.objects.filter(thread=OuterRef('pk'), user=user).values('unread_count')[:1]
+            ),
+            Subquery(
+                Message.objects.filter(thread=OuterRef('pk')).exclude(author_id=user.pk).order_by()
+                .values('thread').annotate(c=Count('id')).values('c')
+            ),
+            0,
+        )
+
+
+class StorageService:
+    """
+    Company.storage_used, kept in step with the company's documents.
+
+    reserve() is a single conditional UPDATE, so concurrent uploads cannot
+    overshoot the plan limit; call it inside the transaction that saves the
+    document, before the file is written. release() runs from the Document
+    post_delete signal.
+    """
+
+    @staticmethod
+    def limit(company):
+        """Plan limit in bytes (Subscription.limits['storage_gb']), None if unlimited."""
+        try:
+            gigabytes = company.subscription.limits.get('storage_gb')
+        except Company.subscription.RelatedObjectDoesNotExist:
+            return None
+        if gigabytes is None:
+            return None
+        return int(gigabytes * GIGABYTE)
+
+    @staticmethod
+    def check(company, num_bytes):
+        """Cheap early rejection, before the upload is read or stored."""
+        limit = StorageService.limit(company)
+        if limit is None:
+            return
+        used = Company.objects.filter(pk=company.pk).values_list('storage_used', flat=True).first() or 0
+        if used + num_bytes > limit:
+            raise StorageLimitExceeded()
+
+    @staticmethod
+    def reserve(company, num_bytes):
+        """Adds `num_bytes` (may be negative) to the counter, or raises if over the limit."""
+        queryset = Company.objects.filter(pk=company.pk)
+        limit = StorageService.limit(company)
+        if limit is not None and num_bytes > 0:
+            queryset = queryset.filter(storage_used__lte=limit - num_bytes)
+        if not queryset.update(storage_used=F('storage_used') + num_bytes):
+            raise StorageLimitExceeded()
+
+    @staticmethod
+    def release(company_id, num_bytes):
+        if num_bytes:
+            Company.objects.filter(pk=company_id).update(storage_used=F('storage_used') - num_bytes)
+
+
+class StatsService:
+    """
+    CompanyStats, kept in step with the company's requests, documents and
+    threads.
+
+    The signals pass change() what a row counted as before and after a save
+    or delete; the counters then move in one UPDATE of F() expressions in
+    the same transaction, so concurrent changes never lose an increment.
+    Bulk queryset updates bypass the signals: run rebuild_company_stats
+    after them.
+    """
+    # Model -> the field whose value picks the counter
+    COUNTED = {
+        ServiceRequest: 'status',
+        Document: 'category',
+        Thread: 'status',
+    }
+
+    @staticmethod
+    def counters():
+        return [field.name for field in CompanyStats._meta.concrete_fields if not field.primary_key]
+
+    @staticmethod
+    def counter(model, value):
+        """Name of the counter a `model` row with `value` adds to, or None."""
+        if model is ServiceRequest:
+            name = f'requests_{value}'
+        elif model is Document:
+            name = f'documents_{value}'
+        else:
+            name = 'threads_open' if value == 'active' else None
+        return name if name in StatsService.counters() else None
+
+    @staticmethod
+    def change(model, before, after):
+        """`before` and `after` are (company_id, value) of a row, None when it does not exist."""
+        if before == after:
+            return
+        deltas = defaultdict(Counter)
+        for state, step in ((before, -1), (after, 1)):
+            if state is not None:
+                company_id, value = state
+                name = StatsService.counter(model, value)
+                if name:
+                    deltas[company_id][name] += step
+        for company_id, steps in deltas.items():
+            updates = {name: F(name) + step for name, step in steps.items() if step}
+            if updates:
+                # No row yet: get() counts everything when it is first read
+                CompanyStats.objects.filter(company_id=company_id).update(**updates)
+
+    @staticmethod
+    def compute(company_ids):
+        """Counters of each company, counted from scratch: {company_id: {name: n}}."""
+        counts = {pk: dict.fromkeys(StatsService.counters(), 0) for pk in company_ids}
+        for model, field in StatsService.COUNTED.items():
+            rows = (
+                model.objects.filter(company_id__in=company_ids).order_by()
+                .values_list('company_id', field).annotate(n=Count('pk'))
+            )
+            for company_id, value, n in rows:
+                name = StatsService.counter(model, value)
+                if name:
+                    counts[company_id][name] += n
+        return counts
+
+    @staticmethod
+    def get(company_id):
+        """The company's CompanyStats, with the company itself joined in."""
+        stats = CompanyStats.objects.filter(company_id=company_id).select_related('company').first()
+        return stats if stats is not None else StatsService.rebuild(company_id)
+
+    @staticmethod
+    def rebuild(company_id):
+        """Recounts a company's counters and stores them; returns its CompanyStats."""
+        with transaction.atomic():
+            # Changes made meanwhile wait on the row lock and are added after
+            stats = CompanyStats.objects.select_for_update().filter(company_id=company_id).first()
+            counts = StatsService.compute([company_id])[company_id]
+            if stats is None:
+                try:
+                    with transaction.atomic():
+                        return CompanyStats.objects.create(company_id=company_id, **counts)
+                except IntegrityError:
+                    # Created concurrently, and counted by whoever did
+                    return CompanyStats.objects.get(company_id=company_id)
+            for name, n in counts.items():
+                setattr(stats, name, n)
+            stats.save()
+            return stats
+
+
+class LedgerService:
+    """
+    Company.balance and BalanceCheckpoint, kept in step with the ledger.
+
+    The Transaction signals call change() with what an entry added to the
+    balance before and after a save or delete, and the balance moves by the
+    difference with F() expressions. post() creates an entry and moves the
+    balance in one database transaction. A checkpoint holds the balance
+    before its date, so balance_as_of() sums only the entries since the
+    nearest earlier checkpoint; checkpoint_balances writes them periodically.
+    """
+
+    @staticmethod
+    def signed_amount():
+        """Expression for what a Transaction adds to the balance."""
+        return Case(When(type='write_off', then=-F('amount')), default=F('amount'))
+
+    @staticmethod
+    def post(company, type, amount, description, date=None):
+        if amount <= 0:
+            raise ValueError('Transaction amounts are positive; the type gives the direction')
+        with transaction.atomic():
+            return Transaction.objects.create(
+                company=company, type=type, amount=amount, description=description, date=date or timezone.now(),
+            )
+
+    @staticmethod
+    def change(before, after):
+        """`before` and `after` are (company_id, signed amount, date) of an entry, None when it does not exist."""
+        if before == after:
+            return
+        with transaction.atomic():
+            for state, sign in ((before, -1), (after, 1)):
+                if state is not None:
+                    company_id, amount, date = state
+                    LedgerService._move(company_id, sign * amount, date)
+
+    @staticmethod
+    def _move(company_id, amount, date):
+        # The company row first: checkpoint_balances locks it before counting
+        Company.objects.filter(pk=company_id).update(balance=F('balance') + amount)
+        # A backdated entry is part of the checkpoints after it
+        BalanceCheckpoint.objects.filter(company_id=company_id, at__gt=date).update(balance=F('balance') + amount)
+
+    @staticmethod
+    def balance_as_of(company_id, at, inclusive=True):
+        """Balance with the entries dated up to `at` (before it if not `inclusive`)."""
+        checkpoint = (
+            BalanceCheckpoint.objects.filter(company_id=company_id, at__lte=at)
+            .values_list('at', 'balance').first()
+        )
+        entries = Transaction.objects.filter(company_id=company_id)
+        entries = entries.filter(date__lte=at) if inclusive else entries.filter(date__lt=at)
+        balance = 0
+        if checkpoint is not None:
+            since, balance = checkpoint
+            entries = entries.filter(date__gte=since)
+        return balance + (entries.aggregate(total=Sum(LedgerService.signed_amount()))['total'] or 0)
@@ -0,0 +1,163 @@
+from django.db import transaction
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from apps.core.models import Company, Subscription
+from .models import ActivityEvent, Blob, CompanyStats, Document, DocumentText, DocumentVersion, Invoice, Message, ServiceRequest, Thread, Transaction
+from . import activity, dashboard, extraction, previews, versioning
+from .search import document_index, message_index
+from .services import LedgerService, StatsService, StorageService
+
+@receiver(post_save, sender=Message)
+def index_message(sender, instance, **kwargs):
+    message_index.index(instance.pk, instance.text, instance.thread.company_id)
+
+@receiver(post_delete, sender=Message)
+def unindex_message(sender, instance, **kwargs):
+    message_index.remove(instance.pk)
+
+@receiver(pre_save, sender=Document)
+def remember_document_file(sender, instance, **kwargs):
+    instance._previous_file = None
+    if instance.pk:
+        instance._previous_file = Document.objects.filter(pk=instance.pk).values_list('file', flat=True).first()
+
+@receiver(post_save, sender=Document)
+def release_replaced_file(sender, instance, created, **kwargs):
+    # A new file becomes the newest version, then the replaced file gives up
+    # its storage reference unless an older version has taken it over
+    previous = getattr(instance, '_previous_file', None)
+    name = instance.file.name
+    kept = bool(name) and (created or previous != name) and versioning.record(instance, previous)
+    if previous and previous != name and not kept:
+        instance.file.storage.delete(previous)
+
+@receiver(post_save, sender=Document)
+def process_document_file(sender, instance, created, **kwargs):
+    # Previews and text extraction for new files, in the process pool
+    name = instance.file.name
+    if name and (created or getattr(instance, '_previous_file', None) != name):
+        storage = instance.file.storage
+        transaction.on_commit(lambda: previews.schedule(name, storage))
+        transaction.on_commit(lambda: extraction.schedule(instance))
+
+@receiver(post_delete, sender=DocumentText)
+def unindex_document(sender, instance, **kwargs):
+    document_index.remove(instance.pk)
+
+@receiver(post_delete, sender=Document)
+def release_document_file(sender, instance, **kwargs):
+    StorageService.release(instance.company_id, instance.size)
+    if instance.file:
+        instance.file.delete(save=False)
+
+@receiver(post_delete, sender=DocumentVersion)
+def release_version_data(sender, instance, **kwargs):
+    if instance.data:
+        instance.data.delete(save=False)
+
+@receiver(post_delete, sender=Blob)
+def discard_blob_previews(sender, instance, **kwargs):
+    previews.discard(instance.sha256)
+
+@receiver(post_save, sender=ServiceRequest)
+@receiver(post_delete, sender=ServiceRequest)
+@receiver(post_save, sender=Document)
+@receiver(post_delete, sender=Document)
+@receiver(post_save, sender=Invoice)
+@receiver(post_delete, sender=Invoice)
+@receiver(post_save, sender=ActivityEvent)
+@receiver(post_save, sender=Transaction)
+@receiver(post_delete, sender=Transaction)
+@receiver(post_save, sender=Subscription)
+def invalidate_dashboard(sender, instance, **kwargs):
+    company_id = instance.company_id
+    transaction.on_commit(lambda: dashboard.invalidate(company_id))
+
+@receiver(post_save, sender=Company)
+def create_company_stats(sender, instance, created, **kwargs):
+    if created:
+        CompanyStats.objects.create(company=instance)
+
+@receiver(pre_save, sender=ServiceRequest)
+@receiver(pre_save, sender=Document)
+@receiver(pre_save, sender=Thread)
+def remember_counted(sender, instance, update_fields=None, **kwargs):
+    field = StatsService.COUNTED[sender]
+    if update_fields is not None and not {'company', field} & set(update_fields):
+        instance._counted = (instance.company_id, getattr(instance, field))
+    elif instance.pk:
+        instance._counted = sender.objects.filter(pk=instance.pk).values_list('company_id', field).first()
+    else:
+        instance._counted = None
+
+@receiver(post_save, sender=ServiceRequest)
+@receiver(post_save, sender=Document)
+@receiver(post_save, sender=Thread)
+def count_saved(sender, instance, **kwargs):
+    counted = (instance.company_id, getattr(instance, StatsService.COUNTED[sender]))
+    StatsService.change(sender, getattr(instance, '_counted', None), counted)
+
+@receiver(post_delete, sender=ServiceRequest)
+@receiver(post_delete, sender=Document)
+@receiver(post_delete, sender=Thread)
+def count_deleted(sender, instance, **kwargs):
+    StatsService.change(sender, (instance.company_id, getattr(instance, StatsService.COUNTED[sender])), None)
+
+@receiver(post_save, sender=ServiceRequest)
+def request_activity(sender, instance, created, **kwargs):
+    if created:
+        activity.record(instance.company_id, 'request_created', 'request', instance.pk, instance.title, instance.created_by)
+    elif (getattr(instance, '_counted', None) or (None, None))[1] != instance.status:
+        # _counted is what remember_counted found before the save
+        activity.record(instance.company_id, 'request_status', 'request', instance.pk, instance.title, detail=instance.status)
+
+@receiver(post_save, sender=Document)
+def document_activity(sender, instance, created, **kwargs):
+    if created:
+        activity.record(instance.company_id, 'document_uploaded', 'document', instance.pk, instance.title, instance.uploaded_by)
+
+@receiver(post_delete, sender=Document)
+def document_deleted_activity(sender, instance, origin=None, **kwargs):
+    # Not when the company itself is being deleted
+    if isinstance(origin, Document) or getattr(origin, 'model', None) is Document:
+        activity.record(instance.company_id, 'document_deleted', 'document', instance.pk, instance.title)
+
+@receiver(post_save, sender=Message)
+def message_activity(sender, instance, created, **kwargs):
+    if created:
+        thread = instance.thread
+        activity.record(thread.company_id, 'message_posted', 'thread', thread.pk, thread.subject, instance.author)
+
+@receiver(pre_save, sender=Invoice)
+def remember_invoice_status(sender, instance, **kwargs):
+    instance._previous_status = None
+    if instance.pk:
+        instance._previous_status = Invoice.objects.filter(pk=instance.pk).values_list('status', flat=True).first()
+
+@receiver(post_save, sender=Invoice)
+def invoice_activity(sender, instance, created, **kwargs):
+    if created:
+        activity.record(instance.company_id, 'invoice_issued', 'invoice', instance.pk, instance.number)
+    if instance.status == 'paid' and getattr(instance, '_previous_status', None) != 'paid':
+        activity.record(instance.company_id, 'invoice_paid', 'invoice', instance.pk, instance.number)
+
+def _ledger_entry(transaction_):
+    amount = Transaction._meta.get_field('amount').to_python(transaction_.amount)
+    if transaction_.type == 'write_off':
+        amount = -amount
+    return transaction_.company_id, amount, transaction_.date
+
+@receiver(pre_save, sender=Transaction)
+def remember_ledger_entry(sender, instance, **kwargs):
+    instance._ledger_entry = None
+    if instance.pk:
+        stored = Transaction.objects.filter(pk=instance.pk).only('company_id', 'type', 'amount', 'date').first()
+        instance._ledger_entry = stored and _ledger_entry(stored)
+
+@receiver(post_save, sender=Transaction)
+def move_balance(sender, instance, **kwargs):
+    LedgerService.change(getattr(instance, '_ledger_entry', None), _ledger_entry(instance))
+
+@receiver(post_delete, sender=Transaction)
+def move_balance_back(sender, instance, **kwargs):
+    LedgerService.change(_ledger_entry(instance), None)
@@ -0,0 +1,290 @@
+import hashlib
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.utils.http import content_disposition_header
+from django.utils.module_loading import import_string
+
+from . import compression, objectstore
+
+BLOB_PREFIX = 'blobs/'
+OBJECT_PREFIX = 'objects/'
+HASH_CHUNK_SIZE = 64 * 1024
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Stores every distinct file content once, under its SHA-256:
+
+        blobs/ab/cd/abcd...<64 hex>.pdf
+
+    The hash is computed while the upload is streamed to a temporary file
+    next to the blobs, which is then renamed into place, or dropped if that
+    content is already stored. Each save() takes a reference on the Blob row
+    and each delete() releases one; the file goes away with the last
+    reference. Names outside blobs/ (files stored before this backend) are
+    handled like plain FileSystemStorage files.
+
+    New blobs are compressed at rest (CABINET_COMPRESSION) when the content
+    is not a compressed format already and a sample shows it is worth it.
+    Blob.encoding records the codec; open() and size() always give the
+    original bytes, so callers never see the difference. Only path() points
+    at the stored bytes; check is_compressed() before handing it out.
+    """
+
+    def get_available_name(self, name, max_length=None):
+        # Names are derived from content in _save(), never uniquified
+        return name
+
+    def _save(self, name, content):
+        from .models import Blob
+
+        digest, size, temp_path = self._spool(content)
+        extension = os.path.splitext(name)[1].lower()[:16]
+        blob_name = f"{BLOB_PREFIX}{digest[:2]}/{digest[2:4]}/{digest}{extension}"
+        full_path = self.path(blob_name)
+
+        encoding, stored_path = '', temp_path
+        try:
+            if not os.path.exists(full_path):
+                # Outside the transaction: compressing a large file takes a while
+                encoding, stored_path = self._compress(temp_path, size)
+            stored = {'encoding': encoding, 'stored_size': os.path.getsize(stored_path)}
+
+            with transaction.atomic():
+                blob, created = Blob.objects.select_for_update().get_or_create(
+                    name=blob_name, defaults={'sha256': digest, 'size': size, **stored}
+                )
+                Blob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') + 1)
+                if created or not os.path.exists(full_path):
+                    if not created:
+                        Blob.objects.filter(pk=blob.pk).update(**stored)
+                    os.makedirs(os.path.dirname(full_path), exist_ok=True)
+                    os.replace(stored_path, full_path)
+                    if self.file_permissions_mode is not None:
+                        os.chmod(full_path, self.file_permissions_mode)
+        finally:
+            for path in {temp_path, stored_path}:
+                if os.path.exists(path):
+                    os.unlink(path)
+        return blob_name
+
+    def _compress(self, path, size):
+        """
+        (codec, compressed file) if compressing `path` pays off according to
+        CABINET_COMPRESSION, ('', path) otherwise.
+        """
+        options = settings.CABINET_COMPRESSION
+        if not options['enabled'] or size < options['min_size']:
+            return '', path
+        with open(path, 'rb') as f:
+            if compression.looks_compressed(f.read(16)):
+                return '', path
+
+        codec = compression.available_codec(options['codec'])
+        max_ratio = 1 - options['min_saving']
+        if compression.sample_ratio(path, codec, options['sample_size']) > max_ratio:
+            return '', path
+
+        compressed_path = f'{path}.{codec}'
+        compression.compress_file(path, compressed_path, codec)
+        if os.path.getsize(compressed_path) > size * max_ratio:
+            os.unlink(compressed_path)
+            return '', path
+        return codec, compressed_path
+
+    def _spool(self, content):
+        """Hash `content` while copying it to a temp file on the same filesystem."""
+        temp_dir = self.path(f"{BLOB_PREFIX}tmp")
+        os.makedirs(temp_dir, exist_ok=True)
+        sha256 = hashlib.sha256()
+        size = 0
+
+        if hasattr(content, 'temporary_file_path'):
+            # Already on disk (large uploads, finished upload sessions):
+            # hash it in place and move it instead of copying
+            with open(content.temporary_file_path(), 'rb') as source:
+                for chunk in iter(lambda: source.read(HASH_CHUNK_SIZE), b''):
+                    sha256.update(chunk)
+                    size += len(chunk)
+            fd, temp_path = tempfile.mkstemp(dir=temp_dir)
+            os.close(fd)
+            # A copy if the upload temp dir is on another filesystem
+            file_move_safe(content.temporary_file_path(), temp_path, allow_overwrite=True)
+            return sha256.hexdigest(), size, temp_path
+
+        fd, temp_path = tempfile.mkstemp(dir=temp_dir)
+        with os.fdopen(fd, 'wb') as target:
+            for chunk in content.chunks():
+                if isinstance(chunk, str):
+                    chunk = chunk.encode()
+                sha256.update(chunk)
+                size += len(chunk)
+                target.write(chunk)
+        return sha256.hexdigest(), size, temp_path
+
+    def delete(self, name):
+        from .models import Blob
+
+        if not name.startswith(BLOB_PREFIX):
+            return super().delete(name)
+
+        with transaction.atomic():
+            blob = Blob.objects.select_for_update().filter(name=name).first()
+            if blob is None:
+                return
+            if blob.ref_count > 1:
+                Blob.objects.filter(pk=blob.pk).update(ref_count=F('ref_count') - 1)
+                return
+            blob.delete()
+            super().delete(name)
+
+    def _open(self, name, mode='rb'):
+        blob = self._blob(name)
+        if blob is None or not blob['encoding']:
+            return super()._open(name, mode)
+        if 'w' in mode or 'a' in mode or '+' in mode:
+            raise ValueError('Compressed blobs are read-only')
+        f = File(compression.open_decompressed(self.path(name), blob['encoding']), name=name)
+        f.size = blob['size']
+        return f
+
+    def size(self, name):
+        blob = self._blob(name)
+        return blob['size'] if blob is not None else super().size(name)
+
+    def is_compressed(self, name):
+        blob = self._blob(name)
+        return bool(blob and blob['encoding'])
+
+    def encoding(self, name):
+        blob = self._blob(name)
+        return blob['encoding'] if blob is not None else ''
+
+    def _blob(self, name):
+        from .models import Blob
+
+        if not name.startswith(BLOB_PREFIX):
+            return None
+        return Blob.objects.filter(name=name).values('size', 'encoding').first()
+
+    @staticmethod
+    def stats():
+        """Bytes stored versus bytes uploaded, overall and per codec."""
+        from .models import Blob
+
+        rows = Blob.objects.values('encoding').annotate(
+            blobs=Count('pk'), size=Sum('size'), stored=Sum('stored_size'),
+        ).order_by('encoding')
+        by_encoding = {row['encoding'] or 'none': {
+            'blobs': row['blobs'], 'size': row['size'], 'stored': row['stored'],
+            'saved': row['size'] - row['stored'],
+        } for row in rows}
+        size = sum(row['size'] for row in by_encoding.values())
+        stored = sum(row['stored'] for row in by_encoding.values())
+        return {'size': size, 'stored': stored, 'saved': size - stored, 'by_encoding': by_encoding}
+
+    @staticmethod
+    def content_hash(name):
+        """SHA-256 of a stored blob, read from its name; None for legacy files."""
+        if not name or not name.startswith(BLOB_PREFIX):
+            return None
+        return os.path.splitext(os.path.basename(name))[0]
+
+
+class ObjectStorage(ContentAddressedStorage):
+    """
+    ContentAddressedStorage plus files uploaded straight to the S3-compatible
+    object store (settings.CABINET_OBJECT_STORE) with presigned URLs:
+
+        objects/<company id>/<random>.pdf
+
+    Those names are the object keys. Their bytes never pass through Django:
+    url() and direct_url() are presigned GETs, pool workers (previews, text
+    extraction) fetch them with fetch_url(), and only open() (export)
+    reads them back through Django. Everything saved through Django still goes
+    to the local blobs.
+    """
+
+    @staticmethod
+    def is_object(name):
+        return bool(name) and name.startswith(OBJECT_PREFIX)
+
+    @property
+    def config(self):
+        return settings.CABINET_OBJECT_STORE
+
+    def presigned_upload(self, key, size):
+        """PUT request for the browser to upload exactly `size` bytes to `key`."""
+        headers = {'Content-Length': str(size)}
+        return {
+            'method': 'PUT',
+            'url': objectstore.presign(self.config, 'PUT', key, self.config['upload_expires'], headers=headers),
+            'headers': headers,
+        }
+
+    def direct_url(self, name, filename=None, as_attachment=True):
+        """Presigned GET of an object, or None for local files."""
+        if not self.is_object(name):
+            return None
+        params = {}
+        if filename:
+            params['response-content-disposition'] = content_disposition_header(as_attachment, filename)
+        return objectstore.presign(self.config, 'GET', name, self.config['download_expires'], params=params)
+
+    def fetch_url(self, name):
+        """Presigned GET for a pool worker to read an object itself, or None for local files."""
+        if not self.is_object(name):
+            return None
+        return objectstore.presign(self.config, 'GET', name, self.config['worker_expires'])
+
+    def url(self, name):
+        return self.direct_url(name) or super().url(name)
+
+    def stat(self, name):
+        return objectstore.head(self.config, name)
+
+    def exists(self, name):
+        if self.is_object(name):
+            return self.stat(name) is not None
+        return super().exists(name)
+
+    def size(self, name):
+        if self.is_object(name):
+            info = self.stat(name)
+            if info is None:
+                raise FileNotFoundError(name)
+            return info['size']
+        return super().size(name)
+
+    def path(self, name):
+        if self.is_object(name):
+            raise NotImplementedError('Objects have no local path')
+        return super().path(name)
+
+    def _open(self, name, mode='rb'):
+        if not self.is_object(name):
+            return super()._open(name, mode)
+        if 'w' in mode or 'a' in mode or '+' in mode:
+            raise ValueError('Objects are read-only')
+        return File(objectstore.open_stream(self.config, name), name=name)
+
+    def delete(self, name):
+        if self.is_object(name):
+            from . import previews
+
+            objectstore.delete(self.config, name)
+            previews.discard(previews.key_of(name))
+            return
+        return super().delete(name)
+
+
+def document_storage():
+    """Storage for Document.file, selected by settings.CABINET_DOCUMENT_STORAGE."""
+    return import_string(settings.CABINET_DOCUMENT_STORAGE)()
@@ -1,3 +1,1591 @@
-from django.test import TestCase
+import errno
+import json
+import os
+from decimal import Decimal
+import shutil
+import tempfile
+import threading
+import time
+import warnings
+import zipfile
+from datetime import timedelta
+from io import BytesIO, StringIO
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+import requests
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.models import QuerySet
+from rest_framework_simplejwt.tokens import AccessToken
+from django.contrib.auth import get_user_model
+from rest_framework.test import APIClient
+from rest_framework import status
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from .models import ActivityEvent, BalanceCheckpoint, Blob, CompanyStats, Document, DocumentPreview, DocumentText, DocumentVersion, Invoice, ServiceRequest, UploadSession, Thread, Message, ThreadReadState, Transaction
+from .services import LedgerService, StatsService, StorageLimitExceeded, StorageService, ThreadService
+from .downloads import ChunkedStreamingResponse
+from .realtime import LATEST_MESSAGE_KEY, notify_new_message, wait_for_new_message
+from .search import document_index, message_index
+from .workers import extract_text, make_version
+from . import activity, compression, dashboard, jobs, objectstore, versioning
+from .s3double import S3Double
+from .storage import ObjectStorage
+from apps.core import quotas
+from apps.core.search import stem
+from baa_legal_backend.asgi import application
+
+User = get_user_model()
+
+class ThreadMessagesPaginationTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(email='client@example.com', password='testpassword123')
+        self.client.force_authenticate(user=self.user)
+        self.thread = Thread.objects.create(company=self.user.company, created_by=self.user, subject='Test')
+        self.messages = [
+            Message.objects.create(thread=self.thread, author=self.user, text=f"msg {i}")
+            for i in range(5)
+        ]
+        self.url = f'/api/cabinet/threads/{self.thread.id}/messages/'
+
+    def test_first_page_is_newest(self):
+        response = self.client.get(self.url, {'page_size': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([m['text'] for m in response.data['results']], ['msg 3', 'msg 4'])
+        self.assertIsNone(response.data['next'])
+        self.assertIsNotNone(response.data['previous'])
+
+    def test_walk_back_and_forward(self):
+        response = self.client.get(self.url, {'page_size': 2})
+        older = self.client.get(response.data['previous'])
+        self.assertEqual([m['text'] for m in older.data['results']], ['msg 1', 'msg 2'])
+
+        oldest = self.client.get(older.data['previous'])
+        self.assertEqual([m['text'] for m in oldest.data['results']], ['msg 0'])
+        self.assertIsNone(oldest.data['previous'])
+
+        newer = self.client.get(oldest.data['next'])
+        self.assertEqual([m['text'] for m in newer.data['results']], ['msg 1', 'msg 2'])
+
+    def test_invalid_cursor(self):
+        response = self.client.get(self.url, {'before': 'garbage'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class ThreadReadStateTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(email='client@example.com', password='testpassword123')
+        self.lawyer = User.objects.create_user(email='lawyer@example.com', password='testpassword123', role='lawyer')
+        self.client.force_authenticate(user=self.user)
+
+        response = self.client.post('/api/cabinet/threads/', {'subject': 'Contract'}, format='json')
+        self.thread = Thread.objects.get(id=response.data['id'])
+
+    def post_from_lawyer(self, text):
+        message = Message.objects.create(thread=self.thread, author=self.lawyer, text=text)
+        ThreadService.message_posted(message)
+        return message
+
+    def test_counter_follows_messages(self):
+        first = self.post_from_lawyer('Hello')
+        self.post_from_lawyer('Please send the charter')
+
+        response = self.client.get('/api/cabinet/threads/unread/')
+        self.assertEqual(response.data['total'], 2)
+
+        response = self.client.post(f'/api/cabinet/threads/{self.thread.id}/mark_read/', {'message': first.id}, format='json')
+        self.assertEqual(response.data['unread_count'], 1)
+
+        self.client.post(f'/api/cabinet/threads/{self.thread.id}/mark_read/', format='json')
+        self.assertEqual(ThreadReadState.objects.get(thread=self.thread, user=self.user).unread_count, 0)
+
+        # Watermark never moves backwards
+        response = self.client.post(f'/api/cabinet/threads/{self.thread.id}/mark_read/', {'message': first.id}, format='json')
+        self.assertEqual(response.data['unread_count'], 0)
+
+    def test_own_messages_are_read(self):
+        self.post_from_lawyer('Hello')
+        response = self.client.post(f'/api/cabinet/threads/{self.thread.id}/add_message/', {'text': 'Hi'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        state = ThreadReadState.objects.get(thread=self.thread, user=self.user)
+        self.assertEqual(state.unread_count, 0)
+        self.assertEqual(state.last_read_message_id, response.data['id'])
+
+    def test_message_and_bookkeeping_commit_together(self):
+        with mock.patch.object(ThreadService, 'message_posted', side_effect=RuntimeError('bookkeeping failed')):
+            with self.assertRaises(RuntimeError):
+                self.client.post(f'/api/cabinet/threads/{self.thread.id}/add_message/', {'text': 'Hi'}, format='json')
+        self.assertFalse(Message.objects.filter(thread=self.thread).exists())
+
+    def test_members_without_read_state_see_unread(self):
+        # Opened for the company by the lawyer: the client never saw it
+        thread = Thread.objects.create(company=self.user.company, created_by=self.lawyer, subject='Charter')
+        for text in ('Hello', 'Please sign'):
+            ThreadService.message_posted(Message.objects.create(thread=thread, author=self.lawyer, text=text))
+        self.assertFalse(ThreadReadState.objects.filter(thread=thread, user=self.user).exists())
+
+        self.assertEqual(self.client.get('/api/cabinet/threads/unread/').data['total'], 2)
+        response = self.client.get('/api/cabinet/threads/')
+        self.assertEqual({t['id']: t['unread_count'] for t in response.data}[thread.id], 2)
+        response = self.client.post(f'/api/cabinet/threads/{thread.id}/mark_read/', format='json')
+        self.assertEqual(response.data['unread_count'], 0)
+        self.assertEqual(self.client.get('/api/cabinet/threads/unread/').data['total'], 0)
+
+    def test_list_is_a_single_query(self):
+        self.post_from_lawyer('Hello')
+        for i in range(3):
+            thread = Thread.objects.create(company=self.user.company, created_by=self.user, subject=f'Thread {i}')
+            Message.objects.create(thread=thread, author=self.lawyer, text='Hello')
+
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/cabinet/threads/')
+        self.assertEqual(len(response.data), 4)
+
+    def test_list_shows_last_message_preview(self):
+        self.lawyer.first_name, self.lawyer.last_name = 'Anna', 'Petrova'
+        self.lawyer.save()
+        self.post_from_lawyer('x' * 500)
+
+        response = self.client.get('/api/cabinet/threads/')
+        row = response.data[0]
+        self.assertEqual(row['unread_count'], 1)
+        self.assertEqual(row['last_message']['author'], 'Anna Petrova')
+        self.assertEqual(len(row['last_message']['text']), 140)
+        self.assertNotIn('messages', row)
+
+
+class ThreadLongPollTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(email='client@example.com', password='testpassword123')
+        self.client.force_authenticate(user=self.user)
+        self.thread = Thread.objects.create(company=self.user.company, created_by=self.user, subject='Test')
+        self.first = Message.objects.create(thread=self.thread, author=self.user, text='first')
+        self.url = f'/api/cabinet/threads/{self.thread.id}/poll/'
+
+    def test_returns_newer_messages_immediately(self):
+        second = Message.objects.create(thread=self.thread, author=self.user, text='second')
+        response = self.client.get(self.url, {'since': self.first.id})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([m['id'] for m in response.data['results']], [second.id])
+
+    def test_empty_after_timeout(self):
+        response = self.client.get(self.url, {'since': self.first.id, 'timeout': 0})
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+    def test_add_message_announces_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(f'/api/cabinet/threads/{self.thread.id}/add_message/', {'text': 'Hi'}, format='json')
+        self.assertEqual(cache.get(LATEST_MESSAGE_KEY.format(self.thread.id)), response.data['id'])
+
+    def test_waiter_is_woken_up(self):
+        timer = threading.Timer(0.1, notify_new_message, args=(self.thread.id, self.first.id + 1))
+        started = time.monotonic()
+        timer.start()
+        self.assertTrue(wait_for_new_message(self.thread.id, self.first.id, timeout=5))
+        self.assertLess(time.monotonic() - started, 1)
+
+
+class ThreadWebSocketTest(TransactionTestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(email='client@example.com', password='testpassword123')
+        self.client.force_authenticate(user=self.user)
+        self.thread = Thread.objects.create(company=self.user.company, created_by=self.user, subject='Test')
+        self.path = f'/ws/cabinet/threads/{self.thread.id}/'
+
+    async def connect(self, user=None, token=None):
+        if user is not None:
+            token = await sync_to_async(AccessToken.for_user)(user)
+        communicator = WebsocketCommunicator(application, f'{self.path}?token={token}')
+        connected, code = await communicator.connect()
+        return communicator, connected, code
+
+    async def test_rejects_invalid_token(self):
+        communicator, connected, code = await self.connect(token='garbage')
+        self.assertFalse(connected)
+        self.assertEqual(code, 4401)
+
+    async def test_rejects_foreign_thread(self):
+        other = await sync_to_async(User.objects.create_user)(email='other@example.com', password='testpassword123')
+        communicator, connected, code = await self.connect(user=other)
+        self.assertFalse(connected)
+        self.assertEqual(code, 4403)
+
+    async def test_pushes_new_messages_and_status(self):
+        communicator, connected, code = await self.connect(user=self.user)
+        self.assertTrue(connected)
+
+        post = sync_to_async(self.client.post)
+        response = await post(f'/api/cabinet/threads/{self.thread.id}/add_message/', {'text': 'Hi'}, format='json')
+        event = await communicator.receive_json_from()
+        self.assertEqual(event['type'], 'message.new')
+        self.assertEqual(event['data']['id'], response.data['id'])
+
+        patch = sync_to_async(self.client.patch)
+        await patch(f'/api/cabinet/threads/{self.thread.id}/', {'status': 'closed'}, format='json')
+        event = await communicator.receive_json_from()
+        self.assertEqual(event, {'type': 'thread.status', 'data': {'thread': self.thread.id, 'status': 'closed'}})
+
+        await communicator.disconnect()
+
+
+class MessageSearchTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(email='client@example.com', password='testpassword123')
+        self.client.force_authenticate(user=self.user)
+        self.thread = Thread.objects.create(company=self.user.company, created_by=self.user, subject='Аренда')
+        self.url = '/api/cabinet/threads/search/'
+
+    def post(self, text, thread=None):
+        return Message.objects.create(thread=thread or self.thread, author=self.user, text=text)
+
+    def test_stemmer(self):
+        self.assertEqual({stem(w) for w in ['договор', 'договора', 'договоров', 'договорами']}, {'договор'})
+        self.assertEqual(stem('ответственности'), stem('ответственность'))
+
+    def test_finds_word_forms_and_highlights(self):
+        message = self.post('Направляю проект договоров аренды <b>на подпись</b>')
+        self.post('Спасибо, получили')
+
+        response = self.client.get(self.url, {'q': 'договор аренда'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 1)
+        hit = response.data['results'][0]
+        self.assertEqual(hit['id'], message.id)
+        self.assertEqual(hit['thread_subject'], 'Аренда')
+        self.assertIn('<mark>договоров</mark> <mark>аренды</mark>', hit['highlight'])
+        self.assertIn('&lt;b&gt;', hit['highlight'])
+
+    def test_company_scoped(self):
+        other = User.objects.create_user(email='other@example.com', password='testpassword123')
+        thread = Thread.objects.create(company=other.company, created_by=other, subject='Чужой')
+        self.post('Договор поставки', thread=thread)
+
+        response = self.client.get(self.url, {'q': 'договор'})
+        self.assertEqual(response.data['count'], 0)
+
+    def test_index_follows_deletes(self):
+        message = self.post('Исковое заявление')
+        message.delete()
+        response = self.client.get(self.url, {'q': 'исковое'})
+        self.assertEqual(response.data['count'], 0)
+
+    def test_paginated_and_ranked(self):
+        for i in range(3):
+            self.post(f'Счет номер {i}')
+        self.post('Счет, счет и еще раз счет')
+
+        response = self.client.get(self.url, {'q': 'счет', 'page_size': 2})
+        self.assertEqual(response.data['count'], 4)
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertIsNotNone(response.data['next'])
+        self.assertIn('еще раз', response.data['results'][0]['highlight'])
+
+    def test_rebuild_command(self):
+        self.post('Судебное решение')
+        with connection.cursor() as cursor:
+            cursor.execute('DELETE FROM cabinet_message_fts')
+        self.assertEqual(message_index.count(self.user.company.id, 'судебное'), 0)
+
+        call_command('rebuild_message_index', batch_size=1, stdout=StringIO())
+        self.assertEqual(message_index.count(self.user.company.id, 'судебное'), 1)
+
+    def test_query_required(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class DocumentUploadTest(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        settings_override = override_settings(
+            MEDIA_ROOT=Path(self.tmp) / 'media',
+            CABINET_UPLOAD_SESSION_DIR=Path(self.tmp) / 'sessions',
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.client = APIClient()
+        self.user = User.objects.create_user(email='client@example.com', password='testpassword123')
+        self.client.force_authenticate(user=self.user)
+        self.content = b'0123456789' * 10
+
+        response = self.client.post('/api/cabinet/document-uploads/', {
+            'filename': 'charter.pdf', 'size': len(self.content), 'category': 'statutory',
+        }, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.url = f"/api/cabinet/document-uploads/{response.data['id']}/"
+
+    def put_chunk(self, offset, data):
+        return self.client.put(self.url, data, content_type='application/octet-stream', HTTP_UPLOAD_OFFSET=str(offset))
+
+    def test_chunked_upload(self):
+        self.assertEqual(self.put_chunk(0, self.content[:40]).data['offset'], 40)
+        # Retrying a chunk is harmless
+        self.assertEqual(self.put_chunk(0, self.content[:40]).data['offset'], 40)
+        # Gaps are refused with the offset to resume from
+        response = self.put_chunk(60, self.content[60:])
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response['Upload-Offset'], '40')
+
+        response = self.client.post(self.url + 'complete/')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+        self.assertEqual(self.put_chunk(40, self.content[40:]).data['offset'], 100)
+        response = self.client.post(self.url + 'complete/')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        document = Document.objects.get(id=response.data['id'])
+        self.assertEqual(document.title, 'charter.pdf')
+        self.assertEqual(document.category, 'statutory')
+        with document.file.open('rb') as f:
+            self.assertEqual(f.read(), self.content)
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertEqual(list((Path(self.tmp) / 'sessions').iterdir()), [])
+
+    def test_chunk_outside_of_file(self):
+        response = self.put_chunk(0, self.content + b'x')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_expired_sessions_are_collected(self):
+        session = UploadSession.objects.get()
+        UploadSession.objects.update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.put_chunk(0, self.content).status_code, status.HTTP_404_NOT_FOUND)
+
+        call_command('cleanup_upload_sessions', stdout=StringIO())
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertFalse(session.part_path.exists())
+
+
+class ContentAddressedStorageTest(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        settings_override = override_settings(MEDIA_ROOT=self.tmp)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.client = APIClient()
+        self.user = User.objects.create_user(email='client@example.com', password='testpassword123')
+        self.client.force_authenticate(user=self.user)
+
+    def upload(self, content, name='charter.pdf'):
+        response = self.client.post('/api/cabinet/documents/', {
+            'title': name, 'file': SimpleUploadedFile(name, content),
+        }, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return Document.objects.get(id=response.data['id'])
+
+    def test_same_content_is_stored_once(self):
+        first = self.upload(b'%PDF same bytes')
+        second = self.upload(b'%PDF same bytes', name='copy.pdf')
+        other = self.upload(b'%PDF other bytes')
+
+        self.assertEqual(first.file.name, second.file.name)
+        self.assertTrue(first.file.name.startswith('blobs/'))
+        self.assertNotEqual(first.file.name, other.file.name)
+        self.assertEqual(Blob.objects.get(name=first.file.name).ref_count, 2)
+
+        path = Path(first.file.path)
+        self.client.delete(f'/api/cabinet/documents/{first.id}/')
+        self.assertTrue(path.exists())
+        self.assertEqual(Blob.objects.get(name=second.file.name).ref_count, 1)
+
+        self.client.delete(f'/api/cabinet/documents/{second.id}/')
+        self.assertFalse(path.exists())
+        self.assertFalse(Blob.objects.filter(name=second.file.name).exists())
+
+    @override_settings(FILE_UPLOAD_MAX_MEMORY_SIZE=1024)
+    def test_upload_temp_dir_on_another_filesystem(self):
+        content = b'%PDF large ' + os.urandom(4096)
+        real_rename, real_replace = os.rename, os.replace
+
+        def cross_device(rename):
+            # Uploads are spooled outside MEDIA_ROOT, as if on another filesystem
+            def move(source, target):
+                if not str(source).startswith(self.tmp):
+                    raise OSError(errno.EXDEV, 'Invalid cross-device link')
+                return rename(source, target)
+            return move
+
+        with mock.patch('os.rename', cross_device(real_rename)), mock.patch('os.replace', cross_device(real_replace)):
+            document = self.upload(content)
+        with document.file.open('rb') as f:
+            self.assertEqual(f.read(), content)
+        self.assertEqual(Blob.objects.get(name=document.file.name).size, len(content))
+
+    def test_dedupe_command(self):
+        legacy = []
+        for i in range(3):
+            document = Document.objects.create(company=self.user.company, title=f'Legacy {i}', file='documents/2026/01/x.pdf')
+            name = f'documents/2026/01/legacy{i}.pdf'
+            (Path(self.tmp) / name).parent.mkdir(parents=True, exist_ok=True)
+            (Path(self.tmp) / name).write_bytes(b'same' if i < 2 else b'different')
+            Document.objects.filter(pk=document.pk).update(file=name)
+            legacy.append(name)
+
+        call_command('dedupe_documents', batch_size=2, stdout=StringIO())
+
+        names = list(Document.objects.order_by('pk').values_list('file', flat=True))
+        self.assertEqual(names[0], names[1])
+        self.assertNotEqual(names[0], names[2])
+        self.assertEqual(Blob.objects.get(name=names[0]).ref_count, 2)
+        for name in legacy:
+            self.assertFalse((Path(self.tmp) / name).exists())
+
+
+    def test_dedupe_removes_only_settled_orphans(self):
+        orphan = self.upload(b'%PDF orphan')
+        fresh = self.upload(b'%PDF fresh')
+        # Lost their documents without releasing the blobs
+        Document.objects.update(file='')
+        # Saved by an upload that commits its document while the command runs
+        Blob.objects.filter(name=fresh.file.name).update(created_at=timezone.now() + timedelta(minutes=1))
+
+        call_command('dedupe_documents', stdout=StringIO())
+        self.assertFalse(Blob.objects.filter(name=orphan.file.name).exists())
+        self.assertFalse(os.path.exists(Path(self.tmp) / orphan.file.name))
+        self.assertTrue(Blob.objects.filter(name=fresh.file.name, ref_count=1).exists())
+
+    def test_dedupe_leaves_blobs_claimed_during_the_scan(self):
+        document = self.upload(b'%PDF claimed')
+        Document.objects.update(file='')
+        real_exists = QuerySet.exists
+
+        def claimed_meanwhile(queryset):
+            # An upload takes a reference between the count and the lock
+            Blob.objects.update(ref_count=2)
+            return real_exists(queryset)
+
+        with mock.patch.object(QuerySet, 'exists', claimed_meanwhile):
+            call_command('dedupe_documents', stdout=StringIO())
+        self.assertTrue(Blob.objects.filter(name=document.file.name, ref_count=2).exists())
+        self.assertTrue(os.path.exists(Path(self.tmp) / document.file.name))
+
+
+class DocumentDownloadTest(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        settings_override = override_settings(MEDIA_ROOT=self.tmp, CABINET_DOWNLOAD_ACCEL_PREFIX='')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.client = APIClient()
+        self.user = User.objects.create_user(email='client@example.com', password='testpassword123')
+        self.client.force_authenticate(user=self.user)
+        self.content = bytes(range(256)) * 40
+        self.document = Document(company=self.user.company, title='Устав', uploaded_by=self.user)
+        self.document.file.save('charter.pdf', ContentFile(self.content))
+        self.url = f'/api/cabinet/documents/{self.document.id}/download/'
+
+    def read(self, response):
+        return b''.join(response.streaming_content)
+
+    def test_full_download(self):
+        response = self.client.get(self.url, HTTP_ACCEPT='application/pdf')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.read(response), self.content)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertEqual(response['Content-Length'], str(len(self.content)))
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn("filename*=utf-8''%D0%A3%D1%81%D1%82%D0%B0%D0%B2.pdf", response['Content-Disposition'])
+        self.assertEqual(response['ETag'], f'"{Blob.objects.get().sha256}"')
+
+    def test_range_requests(self):
+        response = self.client.get(self.url, HTTP_RANGE='bytes=100-199')
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(response['Content-Range'], f'bytes 100-199/{len(self.content)}')
+        self.assertEqual(self.read(response), self.content[100:200])
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=-10')
+        self.assertEqual(self.read(response), self.content[-10:])
+
+        response = self.client.get(self.url, HTTP_RANGE='bytes=10000-')
+        self.assertEqual(self.read(response), self.content[10000:])
+
+        response = self.client.get(self.url, HTTP_RANGE=f'bytes={len(self.content)}-')
+        self.assertEqual(response.status_code, status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.content)}')
+
+        # A stale If-Range gets the whole current file instead
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"outdated"')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_streams_chunk_by_chunk_under_asgi(self):
+        pulled = []
+
+        def chunks():
+            for i in range(3):
+                pulled.append(i)
+                yield b'chunk'
+
+        async def first(response):
+            async for chunk in response:
+                return chunk
+
+        # Django's own __aiter__ would read the whole iterator first
+        self.assertEqual(async_to_sync(first)(ChunkedStreamingResponse(chunks())), b'chunk')
+        self.assertEqual(pulled, [0])
+
+        async def read_async(response):
+            return b''.join([chunk async for chunk in response])
+
+        with mock.patch('apps.cabinet.downloads.STREAM_CHUNK_SIZE', 1000):
+            response = self.client.get(self.url, HTTP_RANGE='bytes=100-4099')
+            self.assertIsInstance(response, ChunkedStreamingResponse)
+            self.assertEqual(async_to_sync(read_async)(response), self.content[100:4100])
+
+    def test_if_none_match(self):
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_accel_redirect(self):
+        document = Document(company=self.user.company, title='Скан', uploaded_by=self.user)
+        document.file.save('scan.pdf', ContentFile(b'%PDF' + os.urandom(8000)))
+        with override_settings(CABINET_DOWNLOAD_ACCEL_PREFIX='/protected-media/'):
+            response = self.client.get(f'/api/cabinet/documents/{document.id}/download/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response['X-Accel-Redirect'], f'/protected-media/{document.file.name}')
+        self.assertEqual(response.content, b'')
+
+    def test_compressed_blob_is_not_handed_to_nginx(self):
+        self.assertTrue(Blob.objects.get(name=self.document.file.name).encoding)
+        with override_settings(CABINET_DOWNLOAD_ACCEL_PREFIX='/protected-media/'):
+            response = self.client.get(self.url, HTTP_RANGE='bytes=5000-5099')
+        self.assertNotIn('X-Accel-Redirect', response)
+        self.assertEqual(self.read(response), self.content[5000:5100])
+
+    def test_serializer_exposes_download_url(self):
+        response = self.client.get(f'/api/cabinet/documents/{self.document.id}/')
+        self.assertTrue(response.data['download_url'].endswith(self.url))
+
+    def test_other_company_cannot_download(self):
+        other = User.objects.create_user(email='other@example.com', password='testpassword123')
+        self.client.force_authenticate(user=other)
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_invoice_download(self):
+        invoice = Invoice.objects.create(
+            company=self.user.company, number='42', description='Услуги', amount=1000, date=timezone.now().date(),
+        )
+        url = f'/api/cabinet/invoices/{invoice.id}/download/'
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+
+        invoice.file.save('invoice-42.pdf', ContentFile(b'%PDF invoice'))
+        response = self.client.get(url)
+        self.assertEqual(self.read(response), b'%PDF invoice')
+
+
+class StorageAccountingTest(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        settings_override = override_settings(MEDIA_ROOT=self.tmp, CABINET_UPLOAD_SESSION_DIR=Path(self.tmp) / 'sessions')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.client = APIClient()
+        self.user = User.objects.create_user(email='client@example.com', password='testpassword123')
+        self.client.force_authenticate(user=self.user)
+        self.company = self.user.company
+        # 1 KiB plan
+        self.company.subscription.limits['storage_gb'] = 1024 / 1024 ** 3
+        self.company.subscription.save()
+
+    def used(self):
+        self.company.refresh_from_db()
+        return self.company.storage_used
+
+    def upload(self, content, name='doc.pdf'):
+        return self.client.post('/api/cabinet/documents/', {
+            'title': name, 'file': SimpleUploadedFile(name, content),
+        }, format='multipart')
+
+    def test_upload_and_delete_update_counter(self):
+        response = self.upload(b'x' * 300)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['size'], 300)
+        self.upload(b'y' * 200)
+        self.assertEqual(self.used(), 500)
+
+        self.client.delete(f"/api/cabinet/documents/{response.data['id']}/")
+        self.assertEqual(self.used(), 200)
+
+    def test_over_limit_is_rejected_before_storing(self):
+        self.upload(b'x' * 600)
+        response = self.upload(b'y' * 600)
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        self.assertEqual(self.used(), 600)
+        self.assertEqual(Document.objects.count(), 1)
+        self.assertEqual(Blob.objects.count(), 1)
+
+    def test_file_that_exactly_fits_is_accepted(self):
+        self.assertEqual(self.upload(b'x' * 1024).status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.used(), 1024)
+        self.assertEqual(self.upload(b'y').status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+    def test_reserve_is_exact(self):
+        StorageService.reserve(self.company, 1000)
+        with self.assertRaises(StorageLimitExceeded):
+            StorageService.reserve(self.company, 25)
+        StorageService.reserve(self.company, 24)
+        self.assertEqual(self.used(), 1024)
+
+    def test_upload_session_checked_up_front(self):
+        response = self.client.post('/api/cabinet/document-uploads/', {'filename': 'big.pdf', 'size': 2048}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        self.assertEqual(UploadSession.objects.count(), 0)
+
+    def test_subscription_reports_usage(self):
+        self.upload(b'x' * 512)
+        self.client.force_authenticate(user=User.objects.get(pk=self.user.pk))
+        response = self.client.get('/api/auth/users/me/')
+        self.assertEqual(response.data['company']['storage_used'], 512)
+        self.assertEqual(response.data['company']['subscription']['usage']['storage_gb'], round(512 / 1024 ** 3, 3))
+
+    def test_reconcile_command(self):
+        self.upload(b'x' * 100)
+        Document.objects.update(size=0)
+        self.company.__class__.objects.filter(pk=self.company.pk).update(storage_used=12345)
+
+        call_command('reconcile_storage', batch_size=1, stdout=StringIO())
+
+        self.assertEqual(Document.objects.get().size, 100)
+        self.assertEqual(self.used(), 100)
+
+
+class DocumentPreviewTest(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        settings_override = override_settings(MEDIA_ROOT=self.tmp, CABINET_WORKERS=0, CABINET_DOWNLOAD_ACCEL_PREFIX='')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.client = APIClient()
+        self.user = User.objects.create_user(email='client@example.com', password='testpassword123')
+        self.client.force_authenticate(user=self.user)
+
+    def pdf(self, color='red'):
+        from PIL import Image
+        buffer = BytesIO()
+        Image.new('RGB', (600, 800), color).save(buffer, 'PDF')
+        return buffer.getvalue()
+
+    def upload(self, content, name):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/cabinet/documents/', {
+                'title': name, 'file': SimpleUploadedFile(name, content),
+            }, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.data
+
+    def test_pdf_preview_is_rendered_once_per_content(self):
+        # Built once: PDFs carry their creation time
+        pdf = self.pdf()
+        self.upload(pdf, 'contract.pdf')
+        with mock.patch('apps.cabinet.previews.render_preview') as render:
+            self.upload(pdf, 'copy.pdf')
+            render.assert_not_called()
+        self.assertEqual(DocumentPreview.objects.count(), 1)
+
+        response = self.client.get('/api/cabinet/documents/')
+        previews = [document['preview'] for document in response.data]
+        self.assertEqual([preview['status'] for preview in previews], ['ready', 'ready'])
+        self.assertEqual(set(previews[0]['urls']), {'thumbnail', 'preview'})
+
+        url = response.data[0]['preview']['urls']['thumbnail']
+        image = self.client.get(url)
+        self.assertEqual(image['Content-Type'], 'image/webp')
+        from PIL import Image
+        self.assertEqual(Image.open(BytesIO(b''.join(image.streaming_content))).width, 240)
+
+    def test_list_queries_do_not_grow_with_documents(self):
+        for i in range(3):
+            self.upload(self.pdf(color=(i, 0, 0)), f'doc{i}.pdf')
+        with self.assertNumQueries(2):
+            self.client.get('/api/cabinet/documents/')
+
+    def test_unsupported_and_failed(self):
+        data = self.upload(b'plain text', 'notes.txt')
+        self.assertEqual(data['preview'], None)  # serialized before the commit hook ran
+        self.assertEqual(self.client.get(f"/api/cabinet/documents/{data['id']}/").data['preview'],
+                         {'status': 'unsupported', 'urls': {}})
+
+        with self.assertLogs(level='WARNING'):
+            data = self.upload(b'%PDF-1.4 broken', 'broken.pdf')
+        preview = self.client.get(f"/api/cabinet/documents/{data['id']}/").data['preview']
+        self.assertEqual(preview['status'], 'failed')
+        response = self.client.get(f"/api/cabinet/documents/{data['id']}/preview/")
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_render_previews_command_uses_process_pool(self):
+        with override_settings(CABINET_WORKERS=2):
+            with mock.patch('apps.cabinet.jobs.submit'):
+                self.upload(self.pdf(), 'contract.pdf')
+            self.assertEqual(DocumentPreview.objects.get().status, 'pending')
+            call_command('render_previews', stdout=StringIO())
+        self.assertEqual(DocumentPreview.objects.get().status, 'ready')
+
+    def test_previews_are_dropped_with_the_content(self):
+        data = self.upload(self.pdf(), 'contract.pdf')
+        preview = DocumentPreview.objects.get()
+        path = Path(self.tmp) / preview.image_name('thumbnail')
+        self.assertTrue(path.exists())
+
+        self.client.delete(f"/api/cabinet/documents/{data['id']}/")
+        self.assertFalse(DocumentPreview.objects.exists())
+        self.assertFalse(path.exists())
+
+
+class DocumentSearchTest(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        settings_override = override_settings(MEDIA_ROOT=self.tmp, CABINET_WORKERS=0)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.client = APIClient()
+        self.user = User.objects.create_user(email='client@example.com', password='testpassword123')
+        self.client.force_authenticate(user=self.user)
+
+    def upload(self, content, name, client=None):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = (client or self.client).post('/api/cabinet/documents/', {
+                'title': name, 'file': SimpleUploadedFile(name, content),
+            }, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.data
+
+    def docx(self, *paragraphs):
+        body = ''.join(f'<w:p><w:r><w:t>{text}</w:t></w:r></w:p>' for text in paragraphs)
+        buffer = BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as docx:
+            docx.writestr('word/document.xml', (
+                '<?xml version="1.0" encoding="UTF-8"?>'
+                '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">'
+                f'<w:body>{body}</w:body></w:document>'
+            ))
+        return buffer.getvalue()
+
+    def pdf(self, text):
+        import pymupdf
+        with pymupdf.open() as pdf:
+            pdf.new_page().insert_text((72, 72), text)
+            return pdf.tobytes()
+
+    def search(self, query):
+        response = self.client.get('/api/cabinet/documents/search/', {'q': query})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_extracts_and_finds_documents(self):
+        supply = self.upload('Договор поставки. Пункт 7: неустойка за просрочку.'.encode('utf-8'), 'supply.txt')
+        lease = self.upload(self.docx('Договор аренды помещения', 'Арендатор уплачивает неустойку'), 'lease.docx')
+        nda = self.upload(self.pdf('Non-disclosure agreement, clause 12'), 'nda.pdf')
+        self.upload('Доверенность'.encode('cp1251'), 'power.txt')
+
+        self.assertEqual(
+            set(DocumentText.objects.values_list('status', flat=True)), {'ready'}
+        )
+        results = self.search('неустойки')
+        self.assertEqual(results['count'], 2)
+        self.assertEqual({hit['id'] for hit in results['results']}, {supply['id'], lease['id']})
+        self.assertIn('<mark>неустойка</mark>', results['results'][0]['highlight'] + results['results'][1]['highlight'])
+
+        self.assertEqual([hit['id'] for hit in self.search('clause')['results']], [nda['id']])
+        self.assertEqual(self.search('доверенности')['count'], 1)
+
+    def test_search_is_company_scoped(self):
+        other = APIClient()
+        other.force_authenticate(User.objects.create_user(email='other@example.com', password='testpassword123'))
+        self.upload('Секретный договор'.encode(), 'secret.txt', client=other)
+        self.assertEqual(self.search('договор')['count'], 0)
+
+    def test_same_content_is_extracted_once(self):
+        self.upload('Договор займа'.encode(), 'loan.txt')
+        with mock.patch('apps.cabinet.extraction.jobs.submit') as submit:
+            copy = self.upload('Договор займа'.encode(), 'copy.txt')
+            submit.assert_not_called()
+        self.assertEqual(DocumentText.objects.get(document_id=copy['id']).text, 'Договор займа')
+        self.assertEqual(self.search('займ')['count'], 2)
+
+    def test_deleted_document_leaves_the_index(self):
+        data = self.upload('Договор дарения'.encode(), 'gift.txt')
+        self.client.delete(f"/api/cabinet/documents/{data['id']}/")
+        self.assertEqual(self.search('дарения')['count'], 0)
+
+    def test_extraction_is_bounded(self):
+        self.assertEqual(len(extract_text(b'x' * 10000, '.txt', 100)), 100)
+        paragraphs = ['слово ' * 100] * 1000
+        self.assertLessEqual(len(extract_text(self.docx(*paragraphs), '.docx', 1000)), 1000)
+
+    def test_command_extracts_in_process_pool(self):
+        with override_settings(CABINET_WORKERS=1):
+            with mock.patch('apps.cabinet.jobs.submit'):
+                self.upload('Договор подряда'.encode(), 'work.txt')
+            self.assertEqual(DocumentText.objects.get().status, 'pending')
+            call_command('extract_document_text', stdout=StringIO())
+        self.assertEqual(DocumentText.objects.get().status, 'ready')
+        self.assertEqual(self.search('подряд')['count'], 1)
+
+
+class DocumentExportTest(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        settings_override = override_settings(MEDIA_ROOT=self.tmp, CABINET_WORKERS=0)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.client = APIClient()
+        self.user = User.objects.create_user(email='client@example.com', password='testpassword123')
+        self.client.force_authenticate(user=self.user)
+        company = self.user.company
+
+        self.contract = Document(company=company, title='Договор поставки', category='contract')
+        self.contract.file.save('supply.pdf', ContentFile(b'%PDF contract'))
+        self.charter = Document(company=company, title='Устав', category='statutory')
+        self.charter.file.save('charter.txt', ContentFile('Устав общества '.encode() * 1000))
+        Document.objects.filter(pk=self.charter.pk).update(created_at=timezone.now() - timedelta(days=30))
+        self.invoice = Invoice.objects.create(
+            company=company, number='A-1', description='Услуги', amount=1000, date=timezone.now().date(),
+        )
+        self.invoice.file.save('a1.pdf', ContentFile(b'%PDF invoice'))
+
+        other = User.objects.create_user(email='other@example.com', password='testpassword123')
+        foreign = Document(company=other.company, title='Чужой', category='contract')
+        foreign.file.save('foreign.pdf', ContentFile(b'%PDF foreign'))
+
+    def export(self, **params):
+        response = self.client.get('/api/cabinet/documents/export/', params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        return zipfile.ZipFile(BytesIO(b''.join(response.streaming_content)))
+
+    def test_exports_documents_invoices_and_manifest(self):
+        archive = self.export()
+        self.assertIsNone(archive.testzip())
+        manifest = json.loads(archive.read('manifest.json'))
+        self.assertEqual({d['id'] for d in manifest['documents']}, {self.contract.pk, self.charter.pk})
+        self.assertEqual([i['number'] for i in manifest['invoices']], ['A-1'])
+        for entry in manifest['documents'] + manifest['invoices']:
+            self.assertIn(entry['path'], archive.namelist())
+
+        contract = next(d for d in manifest['documents'] if d['id'] == self.contract.pk)
+        self.assertEqual(archive.read(contract['path']), b'%PDF contract')
+        self.assertEqual(contract['path'], f'documents/contract/{self.contract.pk}-Договор_поставки.pdf')
+        charter = next(d for d in manifest['documents'] if d['id'] == self.charter.pk)
+        self.assertEqual(archive.read(charter['path']), 'Устав общества '.encode() * 1000)
+
+    def test_missing_files_are_marked_in_the_manifest(self):
+        self.contract.file.storage.delete(self.contract.file.name)
+        with CaptureQueriesContext(connection) as queries:
+            archive = self.export()
+        self.assertEqual(sum('"cabinet_document"' in q['sql'] for q in queries), 1)
+        self.assertEqual(sum('"cabinet_invoice"' in q['sql'] for q in queries), 1)
+        self.assertIsNone(archive.testzip())
+        manifest = json.loads(archive.read('manifest.json'))
+        contract = next(d for d in manifest['documents'] if d['id'] == self.contract.pk)
+        self.assertEqual((contract['path'], contract['missing']), (None, True))
+        self.assertEqual(
+            sorted(e['path'] for e in manifest['documents'] + manifest['invoices'] if not e.get('missing')),
+            sorted(name for name in archive.namelist() if name != 'manifest.json'),
+        )
+
+    def test_filters(self):
+        manifest = json.loads(self.export(category='statutory', invoices='0').read('manifest.json'))
+        self.assertEqual([d['id'] for d in manifest['documents']], [self.charter.pk])
+        self.assertEqual(manifest['invoices'], [])
+
+        since = (timezone.now() - timedelta(days=1)).date().isoformat()
+        manifest = json.loads(self.export(date_from=since).read('manifest.json'))
+        self.assertEqual([d['id'] for d in manifest['documents']], [self.contract.pk])
+
+        response = self.client.get('/api/cabinet/documents/export/', {'date_to': '2026-13-01'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_streams_in_chunks(self):
+        response = self.client.get('/api/cabinet/documents/export/')
+        chunks = list(response.streaming_content)
+        self.assertGreater(len(chunks), 3)
+        self.assertLessEqual(max(len(chunk) for chunk in chunks), 300 * 1024)
+
+    def test_streams_in_chunks_under_asgi(self):
+        async def read(response):
+            return [chunk async for chunk in response]
+
+        response = self.client.get('/api/cabinet/documents/export/')
+        with warnings.catch_warnings():
+            # Django warns when it has to collect a sync iterator first
+            warnings.simplefilter('error')
+            chunks = async_to_sync(read)(response)
+        self.assertGreater(len(chunks), 3)
+        self.assertIsNone(zipfile.ZipFile(BytesIO(b''.join(chunks))).testzip())
+
+    def test_command(self):
+        path = Path(self.tmp) / 'export.zip'
+        call_command('export_documents', self.user.company.pk, output=str(path), stderr=StringIO())
+        self.assertEqual(len(zipfile.ZipFile(path).namelist()), 4)
+
+
+class CompressionAtRestTest(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        settings_override = override_settings(MEDIA_ROOT=self.tmp, CABINET_WORKERS=0)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.user = User.objects.create_user(email='client@example.com', password='testpassword123')
+        self.statement = ('<statement><line>Оплата по договору №%d</line></statement>\n' * 2000).encode()
+
+    def save(self, content, name):
+        document = Document(company=self.user.company, title=name)
+        with self.captureOnCommitCallbacks(execute=True):
+            document.file.save(name, ContentFile(content))
+        return document, Blob.objects.get(name=document.file.name)
+
+    def test_text_is_compressed_and_read_back_transparently(self):
+        document, blob = self.save(self.statement, 'statement.xml')
+        self.assertEqual(blob.encoding, 'zstd')
+        self.assertEqual(blob.size, len(self.statement))
+        self.assertLess(blob.stored_size, len(self.statement) // 5)
+        self.assertEqual(os.path.getsize(document.file.path), blob.stored_size)
+
+        storage = document.file.storage
+        self.assertEqual(storage.size(document.file.name), len(self.statement))
+        with storage.open(document.file.name) as f:
+            self.assertEqual(f.read(), self.statement)
+
+    def test_gzip_codec(self):
+        with override_settings(CABINET_COMPRESSION={**settings.CABINET_COMPRESSION, 'codec': 'gzip'}):
+            document, blob = self.save(self.statement, 'statement.xml')
+        self.assertEqual(blob.encoding, 'gzip')
+        with document.file.storage.open(document.file.name) as f:
+            f.seek(100)
+            self.assertEqual(f.read(50), self.statement[100:150])
+
+    def test_compressed_and_incompressible_content_is_stored_as_is(self):
+        with self.assertLogs(level='WARNING'):  # not a real PDF, previews fail
+            _, pdf = self.save(b'%PDF-1.7 ' + b'0' * 10000, 'contract.pdf')
+        self.assertEqual((pdf.encoding, pdf.stored_size), ('', pdf.size))
+        _, noise = self.save(os.urandom(50000), 'noise.bin')
+        self.assertEqual(noise.encoding, '')
+        _, small = self.save(b'a' * 100, 'small.txt')
+        self.assertEqual(small.encoding, '')
+
+    def test_workers_read_compressed_blobs(self):
+        text = 'Договор поставки нефтепродуктов. ' * 1000
+        document, blob = self.save(text.encode(), 'contract.txt')
+        self.assertTrue(blob.encoding)
+        self.assertEqual(DocumentText.objects.get(document=document).text, text)
+
+    def test_compress_blobs_command(self):
+        with override_settings(CABINET_COMPRESSION={**settings.CABINET_COMPRESSION, 'enabled': False}):
+            document, blob = self.save(self.statement, 'statement.xml')
+        self.assertEqual(blob.encoding, '')
+
+        out = StringIO()
+        call_command('compress_blobs', stdout=out)
+        blob.refresh_from_db()
+        self.assertEqual(blob.encoding, 'zstd')
+        with document.file.storage.open(document.file.name) as f:
+            self.assertEqual(f.read(), self.statement)
+        self.assertIn(f'{blob.size - blob.stored_size} bytes saved', out.getvalue())
+
+
+class DirectUploadTest(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.double = S3Double(os.path.join(self.tmp, 's3'), 'documents', 'test-access', 'test-secret')
+        endpoint = self.double.start()
+        self.addCleanup(self.double.stop)
+        self.config = dict(self.double.config(endpoint), upload_expires=60, download_expires=60, worker_expires=60)
+
+        settings_override = override_settings(MEDIA_ROOT=self.tmp, CABINET_OBJECT_STORE=self.config)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        storage_patch = mock.patch.object(Document._meta.get_field('file'), 'storage', ObjectStorage())
+        storage_patch.start()
+        self.addCleanup(storage_patch.stop)
+
+        self.client = APIClient()
+        self.user = User.objects.create_user(email='client@example.com', password='testpassword123')
+        self.client.force_authenticate(user=self.user)
+
+    def start(self, size, filename='contract.pdf'):
+        return self.client.post('/api/cabinet/documents/direct-upload/', {
+            'filename': filename, 'size': size, 'title': 'Contract', 'category': 'contract',
+        }, format='json')
+
+    def put(self, upload, data):
+        return requests.put(upload['url'], data=data, headers=upload['headers'], timeout=10)
+
+    def finalize(self, session_id):
+        return self.client.post(f'/api/cabinet/documents/direct-upload/{session_id}/finalize/')
+
+    def test_upload_goes_to_object_store(self):
+        content = b'%PDF direct ' + os.urandom(3000)
+        session = self.start(len(content)).data
+        self.assertEqual(session['upload']['method'], 'PUT')
+        self.assertEqual(self.put(session['upload'], content).status_code, 200)
+
+        response = self.finalize(session['id'])
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        document = Document.objects.get(pk=response.data['id'])
+        self.assertTrue(document.file.name.startswith(f'objects/{self.user.company.id}/'))
+        self.assertEqual(document.size, len(content))
+        self.user.company.refresh_from_db()
+        self.assertEqual(self.user.company.storage_used, len(content))
+        self.assertFalse(UploadSession.objects.exists())
+        self.assertFalse(Blob.objects.exists())
+
+        # Downloads are a redirect to a presigned GET
+        response = self.client.get(f'/api/cabinet/documents/{document.pk}/download/')
+        self.assertEqual(response.status_code, status.HTTP_302_FOUND)
+        fetched = requests.get(response['Location'], timeout=10)
+        self.assertEqual(fetched.content, content)
+        self.assertIn('Contract.pdf', fetched.headers['Content-Disposition'])
+
+        # A second finalize finds no session
+        self.assertEqual(self.finalize(session['id']).status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(Document.objects.count(), 1)
+
+        key = document.file.name
+        document.delete()
+        self.assertFalse(os.path.exists(self.double.path(key)))
+
+    @override_settings(CABINET_WORKERS=0)
+    def test_workers_fetch_objects_themselves(self):
+        text = 'Договор аренды помещения. ' * 200
+        session = self.start(len(text.encode()), 'lease.txt').data
+        self.put(session['upload'], text.encode())
+        with mock.patch.object(ObjectStorage, '_open', side_effect=AssertionError('read through Django')):
+            with self.captureOnCommitCallbacks(execute=True):
+                document = Document.objects.get(pk=self.finalize(session['id']).data['id'])
+        self.assertEqual(DocumentText.objects.get(document=document).text, text)
+
+        source = jobs.source_of(document.file.storage, document.file.name)
+        self.assertEqual(source[0], 'url')
+        self.assertEqual(extract_text(source, '.txt', 100), text[:100])
+
+    @override_settings(CABINET_WORKERS=0, CABINET_DOWNLOAD_ACCEL_PREFIX='')
+    def test_objects_get_previews(self):
+        from PIL import Image
+        buffer = BytesIO()
+        Image.new('RGB', (600, 800), 'blue').save(buffer, 'PNG')
+        content = buffer.getvalue()
+        session = self.start(len(content), 'scan.png').data
+        self.put(session['upload'], content)
+        with self.captureOnCommitCallbacks(execute=True):
+            document_id = self.finalize(session['id']).data['id']
+
+        preview = self.client.get(f'/api/cabinet/documents/{document_id}/').data['preview']
+        self.assertEqual(preview['status'], 'ready')
+        image = self.client.get(preview['urls']['thumbnail'])
+        self.assertEqual(Image.open(BytesIO(b''.join(image.streaming_content))).width, 240)
+
+        # Rendered again by render_previews if the server stopped meanwhile
+        DocumentPreview.objects.update(status='pending')
+        call_command('render_previews', stdout=StringIO())
+        self.assertEqual(DocumentPreview.objects.get().status, 'ready')
+
+        self.client.delete(f'/api/cabinet/documents/{document_id}/')
+        self.assertFalse(DocumentPreview.objects.exists())
+
+    def test_dedupe_leaves_objects_in_the_store(self):
+        content = b'%PDF direct ' + os.urandom(1000)
+        session = self.start(len(content)).data
+        self.put(session['upload'], content)
+        document = Document.objects.get(pk=self.finalize(session['id']).data['id'])
+        legacy = Document.objects.create(company=self.user.company, title='Legacy', file='documents/2026/01/legacy.pdf')
+        path = Path(self.tmp) / legacy.file.name
+        path.parent.mkdir(parents=True)
+        path.write_bytes(content)
+
+        call_command('dedupe_documents', stdout=StringIO())
+        document.refresh_from_db()
+        legacy.refresh_from_db()
+        self.assertTrue(document.file.name.startswith('objects/'))
+        self.assertTrue(os.path.exists(self.double.path(document.file.name)))
+        self.assertTrue(legacy.file.name.startswith('blobs/'))
+
+    def test_signed_size_and_expiry_are_enforced(self):
+        session = self.start(100).data
+        response = self.put(dict(session['upload'], headers={}), b'x' * 5000)
+        self.assertEqual(response.status_code, 403)
+        self.assertIn(b'SignatureDoesNotMatch', response.content)
+
+        expired = objectstore.presign(
+            self.config, 'PUT', UploadSession.objects.get().object_key, 60,
+            headers={'Content-Length': '100'}, now=timezone.now() - timedelta(minutes=5),
+        )
+        self.assertEqual(requests.put(expired, data=b'x' * 100, timeout=10).status_code, 403)
+        self.assertEqual(self.finalize(session['id']).status_code, status.HTTP_409_CONFLICT)
+
+    def test_object_of_wrong_size_is_refused(self):
+        session = UploadSession.objects.create(
+            company=self.user.company, filename='a.pdf', size=100,
+            expires_at=timezone.now() + timedelta(hours=1), object_key='objects/1/a.pdf',
+        )
+        upload = ObjectStorage().presigned_upload(session.object_key, 10)
+        self.put(upload, b'x' * 10)
+        response = self.finalize(session.id)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Document.objects.exists())
+        self.assertFalse(os.path.exists(self.double.path(session.object_key)))
+
+    def test_quota_checked_up_front(self):
+        self.user.company.subscription.limits['storage_gb'] = 1024 / 1024 ** 3
+        self.user.company.subscription.save()
+        self.assertEqual(self.start(2048).status_code, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+    def test_abandoned_uploads_are_cleaned_up(self):
+        session = self.start(10).data
+        self.put(session['upload'], b'x' * 10)
+        key = UploadSession.objects.get().object_key
+        self.assertTrue(os.path.exists(self.double.path(key)))
+        UploadSession.objects.update(expires_at=timezone.now())
+        call_command('cleanup_upload_sessions', stdout=StringIO())
+        self.assertFalse(os.path.exists(self.double.path(key)))
+
+    def test_disabled_without_endpoint(self):
+        with override_settings(CABINET_OBJECT_STORE=dict(self.config, endpoint='')):
+            self.assertEqual(self.start(10).status_code, status.HTTP_404_NOT_FOUND)
+
+
+@override_settings(CABINET_WORKERS=0, CABINET_DOWNLOAD_ACCEL_PREFIX='')
+class DocumentVersionTest(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        settings_override = override_settings(MEDIA_ROOT=self.tmp)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        cache.clear()
+        # Previews and text of these fake PDFs would only fail
+        for target in ('apps.cabinet.previews.schedule', 'apps.cabinet.extraction.schedule'):
+            patch = mock.patch(target)
+            patch.start()
+            self.addCleanup(patch.stop)
+
+        self.client = APIClient()
+        self.user = User.objects.create_user(email='client@example.com', password='testpassword123')
+        self.client.force_authenticate(user=self.user)
+        self.original = b'%PDF contract ' + os.urandom(200 * 1024)
+
+    def edit(self, content, at, text=b'amended clause'):
+        return content[:at] + text + content[at + len(text):]
+
+    def create(self, content):
+        response = self.client.post('/api/cabinet/documents/', {
+            'title': 'contract.pdf', 'file': SimpleUploadedFile('contract.pdf', content),
+        }, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        return response.data['id']
+
+    def replace(self, pk, content):
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(f'/api/cabinet/documents/{pk}/', {
+                'file': SimpleUploadedFile('contract.pdf', content),
+            }, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def versions(self, pk):
+        return self.client.get(f'/api/cabinet/documents/{pk}/versions/').data
+
+    def download(self, pk, number):
+        response = self.client.get(f'/api/cabinet/documents/{pk}/versions/{number}/download/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return b''.join(response.streaming_content) if response.streaming else response.content
+
+    def test_edits_are_stored_as_deltas(self):
+        pk = self.create(self.original)
+        [first] = self.versions(pk)
+        self.assertEqual((first['number'], first['kind'], first['stored_size']), (1, 'snapshot', 0))
+
+        edited = self.edit(self.original, 50 * 1024)
+        self.replace(pk, edited)
+        second, first = self.versions(pk)
+        self.assertEqual((second['number'], second['kind']), (2, 'delta'))
+        self.assertLess(second['stored_size'], 1024)
+        self.assertEqual((first['kind'], first['stored_size']), ('snapshot', len(self.original)))
+        self.assertTrue(second['download_url'].endswith(f'/documents/{pk}/versions/2/download/'))
+
+        self.assertEqual(self.download(pk, 1), self.original)
+        response = self.client.get(f'/api/cabinet/documents/{pk}/versions/1/download/')
+        self.assertIn('contract (v1).pdf', response['Content-Disposition'])
+        cache.clear()
+        self.assertEqual(self.download(pk, 2), edited)
+
+        # The original blob, the current one and the delta, which
+        # dedupe_documents counts as referenced
+        self.assertEqual(Blob.objects.count(), 3)
+        call_command('dedupe_documents', stdout=StringIO())
+        self.assertEqual(Blob.objects.count(), 3)
+        self.assertEqual(self.download(pk, 1), self.original)
+        self.client.delete(f'/api/cabinet/documents/{pk}/')
+        self.assertFalse(Blob.objects.exists())
+
+    def test_deltas_are_made_in_the_pool_after_commit(self):
+        pk = self.create(self.original)
+        edited = self.edit(self.original, 1000)
+        with mock.patch('apps.cabinet.jobs.submit') as submit:
+            self.replace(pk, edited)
+        second = DocumentVersion.objects.get(document_id=pk, number=2)
+        self.assertEqual((second.kind, second.stored_size), ('snapshot', 0))
+        self.assertEqual(self.download(pk, 2), edited)
+
+        (func, args), callbacks = submit.call_args
+        self.assertIs(func, make_version)
+        callbacks['on_success'](func(*args))
+        second.refresh_from_db()
+        self.assertEqual(second.kind, 'delta')
+        self.assertLess(second.stored_size, 1024)
+        cache.clear()
+        self.assertEqual(self.download(pk, 2), edited)
+        self.assertEqual(self.download(pk, 1), self.original)
+
+    @override_settings(CABINET_VERSIONING=dict(settings.CABINET_VERSIONING, snapshot_interval=3))
+    def test_snapshots_bound_the_delta_chain(self):
+        contents = [self.original]
+        for i in range(1, 6):
+            contents.append(self.edit(contents[-1], i * 20 * 1024, b'edit %d' % i))
+        pk = self.create(contents[0])
+        for content in contents[1:]:
+            self.replace(pk, content)
+
+        versions = DocumentVersion.objects.filter(document_id=pk).order_by('number')
+        self.assertEqual([v.kind for v in versions], ['snapshot', 'delta', 'delta', 'snapshot', 'delta', 'delta'])
+        cache.clear()
+        for version, content in zip(versions, contents):
+            self.assertEqual(self.download(pk, version.number), content)
+
+        cache.clear()
+        third = versions.get(number=3)
+        with mock.patch('apps.cabinet.compression.apply_delta', wraps=compression.apply_delta) as apply_delta:
+            versioning.content(versions.get(number=2))
+            self.assertEqual(apply_delta.call_count, 1)
+            # Starts from the cached version 2
+            self.assertEqual(versioning.content(third), contents[2])
+            self.assertEqual(apply_delta.call_count, 2)
+            # Hot versions come from the cache
+            versioning.content(third)
+            self.assertEqual(apply_delta.call_count, 2)
+
+    def test_unrelated_file_is_stored_whole(self):
+        pk = self.create(self.original)
+        self.replace(pk, b'%PDF other ' + os.urandom(100 * 1024))
+        self.assertEqual([v['kind'] for v in self.versions(pk)], ['snapshot', 'snapshot'])
+        self.assertEqual(self.download(pk, 1), self.original)
+
+    def test_documents_from_before_versioning_get_history(self):
+        pk = self.create(self.original)
+        DocumentVersion.objects.all().delete()
+        self.replace(pk, self.edit(self.original, 1000))
+        self.assertEqual([(v['number'], v['kind']) for v in self.versions(pk)], [(2, 'delta'), (1, 'snapshot')])
+        self.assertEqual(self.download(pk, 1), self.original)
+
+    def test_other_companies_cannot_list_versions(self):
+        pk = self.create(self.original)
+        other = User.objects.create_user(email='other@example.com', password='testpassword123')
+        self.client.force_authenticate(user=other)
+        self.assertEqual(self.client.get(f'/api/cabinet/documents/{pk}/versions/').status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(
+            self.client.get(f'/api/cabinet/documents/{pk}/versions/1/download/').status_code, status.HTTP_404_NOT_FOUND,
+        )
+
+
+class DashboardTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(email='client@example.com', password='testpassword123')
+        self.client.force_authenticate(user=self.user)
+        self.company = self.user.company
+        for status_ in ('pending', 'in_progress', 'done'):
+            ServiceRequest.objects.create(company=self.company, title=status_, service_type='consult', status=status_)
+        Document.objects.create(company=self.company, title='a.pdf', file='documents/a.pdf')
+        other = User.objects.create_user(email='other@example.com', password='testpassword123')
+        ServiceRequest.objects.create(company=other.company, title='other', service_type='consult')
+
+        submit = mock.patch('apps.cabinet.dashboard._submit')
+        self.submit = submit.start()
+        self.addCleanup(submit.stop)
+
+    def get(self):
+        response = self.client.get('/api/cabinet/dashboard/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def run_refresh(self):
+        for (func, *args), _ in self.submit.call_args_list:
+            func(*args)
+        self.submit.reset_mock()
+
+    def test_counts_come_from_the_stats_row(self):
+        quotas.remaining(self.company.pk) # opens this month's counters
+        with self.assertNumQueries(4):
+            data = dashboard.build(self.company.pk)
+        self.assertEqual(data['stats']['activeRequests'], 2)
+        self.assertEqual(data['stats']['documentsCount'], 1)
+        self.assertEqual(len(data['recentRequests']), 3)
+        self.assertEqual(data['recentActivity'][0]['text'], 'Загружен документ: a.pdf')
+        self.assertEqual(data['stats']['consultationsAvailable'], 1)
+
+    def test_payload_is_cached(self):
+        self.assertEqual(self.get()['stats']['activeRequests'], 2)
+        with self.assertNumQueries(0):
+            self.get()
+
+    def test_stale_payload_is_served_while_one_refresh_runs(self):
+        self.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            ServiceRequest.objects.create(company=self.company, title='new', service_type='consult')
+
+        # Stale, with a single rebuild scheduled however many visits come in
+        self.assertEqual(self.get()['stats']['activeRequests'], 2)
+        self.assertEqual(self.get()['stats']['activeRequests'], 2)
+        self.assertEqual(self.submit.call_count, 1)
+
+        self.run_refresh()
+        self.assertEqual(self.get()['stats']['activeRequests'], 3)
+        self.submit.assert_not_called()
+
+    def test_deletes_and_other_models_invalidate(self):
+        self.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            Document.objects.get().delete()
+        self.get()
+        self.run_refresh()
+        self.assertEqual(self.get()['stats']['documentsCount'], 0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            Invoice.objects.create(company=self.company, number='1', description='x', amount=1, date=timezone.localdate())
+        self.get()
+        self.assertEqual(self.submit.call_count, 1)
+
+    def test_old_payload_is_refreshed(self):
+        self.get()
+        with mock.patch('apps.cabinet.dashboard.time.time', return_value=time.time() + 3600):
+            self.get()
+        self.assertEqual(self.submit.call_count, 1)
+
+
+class CompanyStatsTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='client@example.com', password='testpassword123')
+        self.company = self.user.company
+        self.other = User.objects.create_user(email='other@example.com', password='testpassword123').company
+
+    def stats(self, company=None):
+        return CompanyStats.objects.get(company=company or self.company)
+
+    def test_counters_follow_saves_and_deletes(self):
+        request = ServiceRequest.objects.create(company=self.company, title='a', service_type='consult')
+        Document.objects.create(company=self.company, title='a.pdf', category='contract', file='documents/a.pdf')
+        thread = Thread.objects.create(company=self.company, subject='Question')
+        stats = self.stats()
+        self.assertEqual((stats.requests_pending, stats.documents_contract, stats.threads_open), (1, 1, 1))
+
+        request.status = 'done'
+        request.save()
+        thread.status = 'closed'
+        thread.save(update_fields=['status'])
+        stats = self.stats()
+        self.assertEqual((stats.requests_pending, stats.requests_done, stats.threads_open), (0, 1, 0))
+        self.assertEqual(stats.active_requests, 0)
+
+        # Moving to another company moves the count along
+        request.company = self.other
+        request.save()
+        self.assertEqual((self.stats().requests_done, self.stats(self.other).requests_done), (0, 1))
+
+        request.delete()
+        self.assertEqual(self.stats(self.other).requests_total, 0)
+
+    def test_unrelated_save_does_not_touch_counters(self):
+        request = ServiceRequest.objects.create(company=self.company, title='a', service_type='consult')
+        with self.assertNumQueries(1):
+            request.title = 'b'
+            request.save(update_fields=['title'])
+        self.assertEqual(self.stats().requests_pending, 1)
+
+    def test_missing_row_is_counted_on_first_read(self):
+        ServiceRequest.objects.create(company=self.company, title='a', service_type='consult', status='in_progress')
+        Document.objects.create(company=self.company, title='a.pdf', file='documents/a.pdf')
+        CompanyStats.objects.filter(company=self.company).delete()
+        stats = StatsService.get(self.company.pk)
+        self.assertEqual((stats.requests_in_progress, stats.documents_total), (1, 1))
+
+    def test_rebuild_command_checks_and_repairs(self):
+        ServiceRequest.objects.create(company=self.company, title='a', service_type='consult')
+        # Bulk updates bypass the signals
+        ServiceRequest.objects.filter(company=self.company).update(status='done')
+        CompanyStats.objects.filter(company=self.other).delete()
+
+        out = StringIO()
+        with self.assertRaises(CommandError):
+            call_command('rebuild_company_stats', check=True, stdout=out)
+        self.assertIn('requests_pending 1 -> 0, requests_done 0 -> 1', out.getvalue())
+        self.assertEqual(self.stats().requests_pending, 1)
+
+        call_command('rebuild_company_stats', batch_size=1, stdout=StringIO())
+        self.assertEqual((self.stats().requests_pending, self.stats().requests_done), (0, 1))
+        self.assertTrue(CompanyStats.objects.filter(company=self.other).exists())
+        call_command('rebuild_company_stats', check=True, stdout=StringIO())
+
+
+class ActivityFeedTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(email='client@example.com', password='testpassword123')
+        self.client.force_authenticate(user=self.user)
+        self.company = self.user.company
+
+    def verbs(self):
+        return list(ActivityEvent.objects.filter(company=self.company).order_by('id').values_list('verb', flat=True))
+
+    def test_changes_are_recorded(self):
+        request = ServiceRequest.objects.create(company=self.company, created_by=self.user, title='Audit', service_type='consult')
+        request.title = 'Audit 2024'
+        request.save()
+        request.status = 'in_progress'
+        request.save()
+        document = Document.objects.create(company=self.company, title='a.pdf', file='documents/a.pdf')
+        document.delete()
+        thread = Thread.objects.create(company=self.company, subject='Question')
+        Message.objects.create(thread=thread, author=self.user, text='Hello')
+        invoice = Invoice.objects.create(company=self.company, number='7', description='x', amount=1, date=timezone.localdate())
+        invoice.status = 'paid'
+        invoice.save()
+        self.assertEqual(self.verbs(), [
+            'request_created', 'request_status', 'document_uploaded', 'document_deleted',
+            'message_posted', 'invoice_issued', 'invoice_paid',
+        ])
+        event = ActivityEvent.objects.get(verb='request_status')
+        self.assertEqual((event.target_id, event.detail), (request.pk, 'in_progress'))
+
+    def test_feed_is_cursor_paginated_newest_first(self):
+        for i in range(5):
+            ServiceRequest.objects.create(company=self.company, title=f'r{i}', service_type='consult')
+        other = User.objects.create_user(email='other@example.com', password='testpassword123')
+        ServiceRequest.objects.create(company=other.company, title='other', service_type='consult')
+
+        response = self.client.get('/api/cabinet/activity/', {'page_size': 3})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([e['title'] for e in response.data['results']], ['r4', 'r3', 'r2'])
+        self.assertEqual(response.data['results'][0]['text'], 'Новая заявка: r4')
+        response = self.client.get(response.data['next'])
+        self.assertEqual([e['title'] for e in response.data['results']], ['r1', 'r0'])
+        self.assertIsNone(response.data['next'])
+
+    @override_settings(CABINET_ACTIVITY={'timeline_size': 3, 'trim_every': 2, 'trim_batch_size': 1})
+    def test_timeline_is_trimmed_to_the_newest_events(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(6):
+                ServiceRequest.objects.create(company=self.company, title=f'r{i}', service_type='consult')
+        titles = ActivityEvent.objects.filter(company=self.company).order_by('id').values_list('title', flat=True)
+        self.assertEqual(list(titles), ['r3', 'r4', 'r5'])
+        self.assertEqual(activity.trim(self.company.pk), 0)
+
+    def test_deleting_the_company_records_nothing(self):
+        Document.objects.create(company=self.company, title='a.pdf', file='documents/a.pdf')
+        self.user.delete()
+        self.assertFalse(ActivityEvent.objects.exists())
+
+
+class LedgerTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.user = User.objects.create_user(email='client@example.com', password='testpassword123')
+        self.client.force_authenticate(user=self.user)
+        self.company = self.user.company
+        self.start = timezone.make_aware(timezone.datetime(2025, 12, 31))
+
+    def day(self, n):
+        return self.start + timedelta(days=n)
+
+    def balance(self):
+        self.company.refresh_from_db(fields=['balance'])
+        return self.company.balance
+
+    def test_balance_moves_with_the_ledger(self):
+        deposit = LedgerService.post(self.company, 'deposit', Decimal('1000.00'), 'Top-up')
+        LedgerService.post(self.company, 'write_off', Decimal('250.50'), 'Consultation')
+        self.assertEqual(self.balance(), Decimal('749.50'))
+        self.assertEqual(dashboard.build(self.company.pk)['stats']['balance'], Decimal('749.50'))
+
+        deposit.amount = Decimal('2000.00')
+        deposit.save()
+        self.assertEqual(self.balance(), Decimal('1749.50'))
+        deposit.delete()
+        self.assertEqual(self.balance(), Decimal('-250.50'))
+        with self.assertRaises(ValueError):
+            LedgerService.post(self.company, 'deposit', 0, 'Nothing')
+
+    def test_balance_as_of_scans_from_the_nearest_checkpoint(self):
+        for n in range(1, 6):
+            LedgerService.post(self.company, 'deposit', Decimal(100), f'Day {n}', date=self.day(n))
+        call_command('checkpoint_balances', at='2026-01-04', stdout=StringIO())
+        checkpoint = BalanceCheckpoint.objects.get()
+        self.assertEqual(checkpoint.balance, Decimal(300))
+
+        # Backdated entries move the checkpoints after them
+        LedgerService.post(self.company, 'write_off', Decimal(50), 'Fee', date=self.day(2))
+        checkpoint.refresh_from_db()
+        self.assertEqual(checkpoint.balance, Decimal(250))
+
+        with self.assertNumQueries(2):
+            self.assertEqual(LedgerService.balance_as_of(self.company.pk, self.day(4)), Decimal(350))
+        self.assertEqual(LedgerService.balance_as_of(self.company.pk, self.day(2)), Decimal(150))
+
+        response = self.client.get('/api/cabinet/transactions/balance/', {'at': '2026-01-04'})
+        self.assertEqual(response.data['balance'], Decimal(350))
+        response = self.client.get('/api/cabinet/transactions/balance/')
+        self.assertEqual(response.data['balance'], Decimal(450))
+        self.assertEqual(self.client.get('/api/cabinet/transactions/balance/', {'at': 'soon'}).status_code, 400)
+
+        # Already written
+        call_command('checkpoint_balances', at='2026-01-04', stdout=StringIO())
+        self.assertEqual(BalanceCheckpoint.objects.count(), 1)
+
+    def test_verify_ledger_reports_and_fixes_drift(self):
+        for n in range(1, 4):
+            LedgerService.post(self.company, 'deposit', Decimal(100), f'Day {n}', date=self.day(n))
+        call_command('checkpoint_balances', at='2026-01-03', stdout=StringIO())
+        # Bulk updates bypass the signals
+        Transaction.objects.filter(date=self.day(1)).update(amount=Decimal(10))
+
+        out = StringIO()
+        with self.assertRaises(CommandError):
+            call_command('verify_ledger', chunk_size=1, stdout=out)
+        self.assertIn('checkpoint at 2026-01-03 00:00: 200.00 -> 110.00', out.getvalue())
+        self.assertIn('balance 300.00 -> 210.00', out.getvalue())
+
+        call_command('verify_ledger', fix=True, stdout=StringIO())
+        self.assertEqual(self.balance(), Decimal(210))
+        self.assertEqual(BalanceCheckpoint.objects.get().balance, Decimal(110))
+        call_command('verify_ledger', stdout=StringIO())
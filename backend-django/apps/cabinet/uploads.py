@@ -0,0 +1,40 @@
+from django.core.files import File
+from django.http import UnreadablePostError
+
+CHUNK_READ_SIZE = 64 * 1024
+
+
+class PartFile(File):
+    """
+    A finished upload part file. Exposing temporary_file_path() lets
+    FileSystemStorage move it into place instead of copying it.
+    """
+
+    def __init__(self, path, name):
+        self.path = path
+        super().__init__(open(path, 'rb'), name=name)
+
+    def temporary_file_path(self):
+        return str(self.path)
+
+
+def write_chunk(path, offset, stream, length):
+    """
+    Copies `length` bytes from the request stream into the part file at
+    `offset`, 64 KB at a time. Returns how many bytes actually landed, which
+    is less than `length` if the client went away mid-chunk; those bytes
+    are still good and the client can resume right after them.
+    """
+    written = 0
+    with open(path, 'r+b') as part:
+        part.seek(offset)
+        try:
+            while written < length:
+                data = stream.read(min(CHUNK_READ_SIZE, length - written))
+                if not data:
+                    break
+                part.write(data)
+                written += len(data)
+        except (UnreadablePostError, OSError):
+            pass
+    return written
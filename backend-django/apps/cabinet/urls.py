@@ -1,15 +1,18 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 from .views import (
-    ServiceRequestViewSet, DocumentViewSet, 
-    ThreadViewSet, InvoiceViewSet, DashboardViewSet
+    ServiceRequestViewSet, DocumentViewSet, DocumentUploadViewSet,
+    ThreadViewSet, InvoiceViewSet, TransactionViewSet, ActivityViewSet, DashboardViewSet
 )
 
 router = DefaultRouter()
 router.register(r'requests', ServiceRequestViewSet, basename='request')
 router.register(r'documents', DocumentViewSet, basename='document')
+router.register(r'document-uploads', DocumentUploadViewSet, basename='document-upload')
 router.register(r'threads', ThreadViewSet, basename='thread')
 router.register(r'invoices', InvoiceViewSet, basename='invoice')
+router.register(r'transactions', TransactionViewSet, basename='transaction')
+router.register(r'activity', ActivityViewSet, basename='activity')
 router.register(r'dashboard', DashboardViewSet, basename='dashboard')
 
 urlpatterns = [
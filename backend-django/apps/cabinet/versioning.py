@@ -0,0 +1,207 @@
+"""
+Version history of a document's file.
+
+Every file a Document gets becomes a DocumentVersion. A version is stored
+as a zstd delta against the version before it (compression.make_delta),
+so re-uploading a slightly edited contract costs about the size of the
+edit. At least every CABINET_VERSIONING['snapshot_interval'] versions one
+is kept whole, which bounds how many deltas rebuilding a version applies.
+
+The current version needs no copy of its own: a snapshot with empty `data`
+is the document's current file. When that file is replaced, the snapshot
+takes it over instead of it being released. Deltas are made, and files
+outside content-addressed storage hashed, in the cabinet process pool
+after the save commits; until then the new version is such a snapshot.
+Files in the object store (direct uploads) get version 1 only once they
+are first replaced. Rebuilt versions are cached under their SHA-256, so a
+version that is asked for again costs nothing.
+"""
+import hashlib
+import logging
+import os
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.db import transaction
+
+from . import compression, jobs
+from .models import DocumentVersion
+from .storage import ContentAddressedStorage
+from .workers import make_version
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT = 'snapshot'
+DELTA = 'delta'
+
+
+def record(document, previous_name):
+    """
+    Adds the document's new file as its newest version; `previous_name` is
+    the file it replaced, if any. Called from post_save before the previous
+    file is released. Returns True if the previous file must not be
+    released: a version took it over, or the job making the delta will
+    release it once done.
+
+    Only rows are written here. The new version starts out as a snapshot
+    (the current file); after commit a job in the process pool hashes
+    files outside content-addressed storage and makes the delta, which
+    finish() stores.
+    """
+    options = settings.CABINET_VERSIONING
+    storage = document.file.storage
+    name = document.file.name
+    digest = ContentAddressedStorage.content_hash(name) or ''
+    last = DocumentVersion.objects.filter(document=document).first()
+    if last is None and previous_name is None and not digest:
+        # Hashing an object-store file would fetch it: version 1 is recorded
+        # when the file is first replaced
+        return False
+    try:
+        size = storage.size(name)
+    except FileNotFoundError:
+        logger.warning('Document %s has no file %s: no version recorded', document.pk, name)
+        return False
+
+    if last is None and previous_name:
+        # Uploaded before versioning existed: what it replaced is version 1
+        last = DocumentVersion.objects.create(
+            document=document, number=1, kind=SNAPSHOT, extension=_extension(previous_name),
+            size=storage.size(previous_name), stored_size=0,
+            sha256=ContentAddressedStorage.content_hash(previous_name) or '',
+        )
+    if last is None:
+        DocumentVersion.objects.create(
+            document=document, number=1, kind=SNAPSHOT, extension=_extension(name),
+            size=size, stored_size=0, sha256=digest,
+        )
+        return False
+    if digest and last.sha256 == digest:
+        # Same content again
+        return False
+
+    took_previous = False
+    if previous_name and last.kind == SNAPSHOT and not last.data:
+        # No longer the current file, so the snapshot keeps it
+        last.data.name = previous_name
+        last.stored_size = last.size
+        last.save(update_fields=['data', 'stored_size'])
+        took_previous = True
+
+    last_snapshot = DocumentVersion.objects.filter(document=document, kind=SNAPSHOT).values_list('number', flat=True).first()
+    version = DocumentVersion.objects.create(
+        document=document, number=last.number + 1, kind=SNAPSHOT,
+        extension=_extension(name), size=size, stored_size=0, sha256=digest,
+    )
+    delta = bool(
+        previous_name and compression.zstandard is not None
+        and version.number - last_snapshot < options['snapshot_interval']
+        and max(size, last.size) <= options['delta_max_size']
+    )
+    if not delta and digest:
+        return took_previous
+
+    # The delta is made from the previous file, so it stays until the job is done
+    release = previous_name if delta and not took_previous else None
+    args = (
+        jobs.source_of(storage, name), jobs.source_of(storage, previous_name) if delta else None,
+        last.sha256, options['min_saving'],
+    )
+    transaction.on_commit(lambda: jobs.submit(
+        make_version, args,
+        on_success=lambda result: finish(version.pk, last.pk, result, storage, release),
+        on_failure=lambda error: failed(version.pk, error, storage, release),
+    ))
+    return took_previous or release is not None
+
+
+def finish(version_id, base_id, result, storage, release=None):
+    """
+    Stores what make_version returned: the hashes, and the delta, unless
+    the version was replaced meanwhile and keeps its whole file. Releases
+    `release`, the previous file the job read.
+    """
+    digest, base_digest, delta = result
+    try:
+        DocumentVersion.objects.filter(pk=version_id).update(sha256=digest)
+        if base_digest:
+            DocumentVersion.objects.filter(pk=base_id, sha256='').update(sha256=base_digest)
+        version = DocumentVersion.objects.filter(pk=version_id, kind=SNAPSHOT, data='').first()
+        if delta is None or version is None:
+            return
+        version.data.save(f'{version.document_id}-{version.number}.zdelta', ContentFile(delta), save=False)
+        stored = DocumentVersion.objects.filter(pk=version_id, kind=SNAPSHOT, data='').update(
+            kind=DELTA, data=version.data.name, stored_size=len(delta),
+        )
+        if not stored:
+            version.data.delete(save=False)
+    finally:
+        if release:
+            storage.delete(release)
+
+
+def failed(version_id, error, storage, release=None):
+    logger.warning('Version %s could not be hashed or delta-compressed: %s', version_id, error)
+    if release:
+        storage.delete(release)
+
+
+def source(version):
+    """(storage, name) holding a version whole, or None for a delta."""
+    if version.kind == DELTA:
+        return None
+    if version.data:
+        return version.data.storage, version.data.name
+    return version.document.file.storage, version.document.file.name
+
+
+def content(version):
+    """
+    Bytes of a version: from the cache, from its snapshot, or by applying
+    the deltas since the nearest snapshot, starting from the newest of them
+    that is still cached.
+    """
+    cached = cache.get(_cache_key(version.sha256))
+    if cached is not None:
+        return cached
+
+    whole = source(version)
+    if whole is not None:
+        data = _read(*whole)
+    else:
+        versions = DocumentVersion.objects.filter(document_id=version.document_id)
+        snapshot = versions.filter(kind=SNAPSHOT, number__lt=version.number).select_related('document').first()
+        chain = list(versions.filter(number__gt=snapshot.number, number__lte=version.number).order_by('number'))
+        hits = cache.get_many([_cache_key(v.sha256) for v in chain[:-1]])
+        data = None
+        for i in range(len(chain) - 2, -1, -1):
+            data = hits.get(_cache_key(chain[i].sha256))
+            if data is not None:
+                chain = chain[i + 1:]
+                break
+        if data is None:
+            data = _read(*source(snapshot))
+        for delta in chain:
+            data = compression.apply_delta(data, _read(delta.data.storage, delta.data.name))
+
+    # No sha256 yet: the version's job has not finished (or failed)
+    if version.sha256 and hashlib.sha256(data).hexdigest() != version.sha256:
+        raise ValueError(f'Version {version.number} of document {version.document_id} does not match its checksum')
+    options = settings.CABINET_VERSIONING
+    if len(data) <= options['cache_max_size']:
+        cache.set(_cache_key(version.sha256), data, options['cache_timeout'])
+    return data
+
+
+def _read(storage, name):
+    with storage.open(name, 'rb') as f:
+        return f.read()
+
+
+def _extension(name):
+    return os.path.splitext(name)[1].lower()[:16]
+
+
+def _cache_key(digest):
+    return f'cabinet:version:{digest}'
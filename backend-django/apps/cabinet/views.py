@@ -1,75 +1,460 @@
+import os
+import uuid
+from datetime import datetime, time, timedelta
+
 from rest_framework import viewsets, status, permissions
 from rest_framework.response import Response
 from rest_framework.decorators import action
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import transaction
 from django.db.models import Count, Q
+from django.db.models.functions import Greatest
+from django.http import HttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.utils.http import content_disposition_header
 from django.shortcuts import get_object_or_404
 
-from .models import ServiceRequest, Document, Thread, Message, Invoice, Transaction
+from apps.core import quotas
+from apps.core.models import Company
+from .models import ActivityEvent, ServiceRequest, Document, DocumentPreview, UploadSession, Thread, Message, Invoice, Transaction, ThreadReadState
 from .serializers import (
-    ServiceRequestSerializer, DocumentSerializer, 
-    ThreadSerializer, MessageSerializer, 
-    InvoiceSerializer, TransactionSerializer
+    ServiceRequestSerializer, DocumentSerializer, UploadSessionSerializer,
+    ThreadSerializer, ThreadListSerializer, MessageSerializer, MessageSearchResultSerializer,
+    DocumentSearchResultSerializer, DocumentVersionSerializer,
+    InvoiceSerializer, TransactionSerializer, ActivityEventSerializer
 )
 from .permissions import IsOwnerOrCompany
+from .pagination import ActivityCursorPagination, MessageCursorPagination, SearchPagination
+from .services import LedgerService, StorageService, ThreadService
+from .realtime import wait_for_new_message
+from .search import document_index, message_index
+from .uploads import PartFile, write_chunk
+from .downloads import ChunkedStreamingResponse, DownloadNegotiation, file_response
+from .storage import OBJECT_PREFIX
+from .previews import key_of
+from .export import export_querysets, stream_export
+from . import dashboard, versioning
 
 class BaseCabinetViewSet(viewsets.ModelViewSet):
     permission_classes = [permissions.IsAuthenticated, IsOwnerOrCompany]
     
     def get_queryset(self):
-        # Filter by user's company
-        if self.request.user.company:
-            return self.model.objects.filter(company=self.request.user.company)
+        # Filter by user's company; ids only, so the user is not loaded
+        if self.request.user.company_id:
+            return self.model.objects.filter(company_id=self.request.user.company_id)
         return self.model.objects.none()
 
     def perform_create(self, serializer):
         # Auto-assign company and creator
         serializer.save(
-            company=self.request.user.company,
-            created_by=self.request.user
+            company_id=self.request.user.company_id,
+            created_by_id=self.request.user.pk
         )
 
 class ServiceRequestViewSet(BaseCabinetViewSet):
     model = ServiceRequest
     queryset = ServiceRequest.objects.all()
     serializer_class = ServiceRequestSerializer
+    # Service types that also use up a consultation of the plan
+    consultation_service_types = ('consultation',)
+
+    def perform_create(self, serializer):
+        company = self.request.user.company
+        with transaction.atomic():
+            # Rolled back with the request if it is not created
+            quotas.consume(company.pk, 'requests')
+            if serializer.validated_data.get('service_type') in self.consultation_service_types:
+                quotas.consume(company.pk, 'consultations')
+            super().perform_create(serializer)
 
 class DocumentViewSet(BaseCabinetViewSet):
     model = Document
     queryset = Document.objects.all()
     serializer_class = DocumentSerializer
 
+    def create(self, request, *args, **kwargs):
+        # Refuse before the body is parsed and spooled. Content-Length also
+        # counts the multipart framing, so this only catches files that are
+        # clearly too big; the exact check is in perform_create
+        content_length = int(request.META.get('CONTENT_LENGTH') or 0)
+        StorageService.check(request.user.company, max(0, content_length - settings.CABINET_UPLOAD_MULTIPART_SLACK))
+        return super().create(request, *args, **kwargs)
+
     def perform_create(self, serializer):
-        serializer.save(
+        size = self.request.FILES['file'].size
+        with transaction.atomic():
+            StorageService.reserve(self.request.user.company, size)
+            serializer.save(
+                company=self.request.user.company,
+                uploaded_by_id=self.request.user.pk,
+                file_size=Document.format_size(size),
+                size=size,
+            )
+
+    def perform_update(self, serializer):
+        upload = self.request.FILES.get('file')
+        if upload is None:
+            serializer.save()
+            return
+        with transaction.atomic():
+            StorageService.reserve(self.request.user.company, upload.size - serializer.instance.size)
+            serializer.save(file_size=Document.format_size(upload.size), size=upload.size)
+
+    @action(detail=False, methods=['post'], url_path='direct-upload')
+    def direct_upload(self, request):
+        """
+        Upload that skips Django: {filename, size, title, category} gives an
+        upload session and a presigned PUT (`upload`: method, url, headers)
+        for the browser to send the file to the object store with. Then
+        POST direct-upload/<id>/finalize/ creates the Document.
+        """
+        storage = Document._meta.get_field('file').storage
+        if not settings.CABINET_OBJECT_STORE['endpoint'] or not hasattr(storage, 'presigned_upload'):
+            return Response({'error': 'Direct uploads are not enabled'}, status=status.HTTP_404_NOT_FOUND)
+
+        serializer = UploadSessionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        company = request.user.company
+        size = serializer.validated_data['size']
+        StorageService.check(company, size)
+        extension = os.path.splitext(serializer.validated_data['filename'])[1].lower()[:16]
+        session = serializer.save(
+            company=company,
+            created_by=request.user,
+            expires_at=timezone.now() + settings.CABINET_UPLOAD_SESSION_TTL,
+            object_key=f'{OBJECT_PREFIX}{company.id}/{uuid.uuid4().hex}{extension}',
+        )
+        data = dict(serializer.data, upload=storage.presigned_upload(session.object_key, size))
+        return Response(data, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['post'], url_path=r'direct-upload/(?P<upload_id>[0-9a-f-]{36})/finalize')
+    def finalize_direct_upload(self, request, upload_id=None):
+        """Checks the object the browser uploaded and turns it into a Document."""
+        sessions = UploadSession.objects.filter(
+            company=request.user.company, expires_at__gt=timezone.now()
+        ).exclude(object_key='')
+        session = get_object_or_404(sessions, pk=upload_id)
+        storage = Document._meta.get_field('file').storage
+
+        uploaded = storage.stat(session.object_key)
+        if uploaded is None:
+            return Response({'error': 'The file has not been uploaded yet'}, status=status.HTTP_409_CONFLICT)
+        if uploaded['size'] != session.size:
+            session.discard()
+            return Response({'error': 'The uploaded file does not have the announced size'}, status=status.HTTP_400_BAD_REQUEST)
+
+        with transaction.atomic():
+            # Locked and fetched again: a repeated finalize must not create a second Document
+            session = get_object_or_404(sessions.select_for_update(), pk=upload_id)
+            document = Document(
+                company=session.company,
+                uploaded_by=request.user,
+                title=session.title or session.filename,
+                category=session.category,
+                file=session.object_key,
+                file_size=Document.format_size(session.size),
+                size=session.size,
+            )
+            StorageService.reserve(session.company, session.size)
+            document.save()
+            # The object now belongs to the document
+            session.delete()
+
+        return Response(DocumentSerializer(document, context={'request': request}).data, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """Ranked full-text search over the text of the company's documents: ?q=...&page=N"""
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({'error': 'Query parameter q is required'}, status=status.HTTP_400_BAD_REQUEST)
+
+        paginator = SearchPagination()
+        page = paginator.paginate_queryset(document_index.search(request.user.company_id, query), request, view=self)
+        hits = [{'text': text, 'rank': rank} for text, rank in page]
+        serializer = DocumentSearchResultSerializer(hits, many=True, context={'query': query})
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(detail=False, methods=['get'], content_negotiation_class=DownloadNegotiation)
+    def export(self, request):
+        """
+        ZIP of the company's document and invoice files plus manifest.json,
+        streamed as it is built: ?category=&date_from=&date_to=&invoices=0
+        """
+        params = request.query_params
+        category = params.get('category') or None
+        if category and category not in dict(Document.CATEGORY_CHOICES):
+            return Response({'error': f'Unknown category: {category}'}, status=status.HTTP_400_BAD_REQUEST)
+        dates = {}
+        for param in ('date_from', 'date_to'):
+            value = params.get(param)
+            try:
+                dates[param] = parse_date(value) if value else None
+                if value and dates[param] is None:
+                    raise ValueError(value)
+            except ValueError:
+                return Response({'error': f'{param} must be YYYY-MM-DD'}, status=status.HTTP_400_BAD_REQUEST)
+
+        documents, invoices = export_querysets(
+            request.user.company, category=category, invoices=params.get('invoices') != '0', **dates,
+        )
+        response = ChunkedStreamingResponse(stream_export(documents, invoices), content_type='application/zip')
+        filename = f"documents-{timezone.localdate().isoformat()}.zip"
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        response['Cache-Control'] = 'private, no-store'
+        # Let nginx pass chunks through as they are produced
+        response['X-Accel-Buffering'] = 'no'
+        return response
+
+    @action(detail=True, methods=['get'], content_negotiation_class=DownloadNegotiation)
+    def download(self, request, pk=None):
+        document = self.get_object()
+        if not document.file:
+            return Response({'detail': 'Document has no file'}, status=status.HTTP_404_NOT_FOUND)
+        extension = os.path.splitext(document.file.name)[1]
+        filename = document.title if document.title.endswith(extension) else document.title + extension
+        return file_response(request, document.file.storage, document.file.name, filename=filename)
+
+    @action(detail=True, methods=['get'])
+    def versions(self, request, pk=None):
+        """The document's file versions, newest first. Nothing is read from storage."""
+        document = self.get_object()
+        serializer = DocumentVersionSerializer(document.versions.all(), many=True, context={'request': request})
+        return Response(serializer.data)
+
+    @action(detail=True, methods=['get'], url_path=r'versions/(?P<number>\d+)/download',
+            content_negotiation_class=DownloadNegotiation)
+    def download_version(self, request, pk=None, number=None):
+        document = self.get_object()
+        version = get_object_or_404(document.versions.select_related('document'), number=number)
+        title, extension = os.path.splitext(document.title)
+        if extension.lower() != version.extension:
+            title = document.title
+        filename = f'{title} (v{version.number}){version.extension}'
+
+        whole = versioning.source(version)
+        if whole is not None:
+            return file_response(request, *whole, filename=filename)
+        response = HttpResponse(versioning.content(version), content_type='application/octet-stream')
+        response['Content-Disposition'] = content_disposition_header(True, filename)
+        response['ETag'] = f'"{version.sha256}"'
+        response['Cache-Control'] = 'private, no-cache'
+        return response
+
+    @action(detail=True, methods=['get'], content_negotiation_class=DownloadNegotiation)
+    def preview(self, request, pk=None):
+        document = self.get_object()
+        size = request.query_params.get('size', 'thumbnail')
+        if size not in settings.CABINET_PREVIEW_SIZES:
+            return Response({'error': f'Unknown preview size: {size}'}, status=status.HTTP_400_BAD_REQUEST)
+        digest = key_of(document.file.name)
+        preview = DocumentPreview.objects.filter(sha256=digest, status='ready').first() if digest else None
+        if preview is None:
+            return Response({'detail': 'Preview is not available'}, status=status.HTTP_404_NOT_FOUND)
+        return file_response(request, default_storage, preview.image_name(size), as_attachment=False)
+
+class DocumentUploadViewSet(BaseCabinetViewSet):
+    """
+    Resumable document uploads.
+
+    POST creates a session ({filename, size, title, category}); each chunk is
+    a PUT of raw bytes with an `Upload-Offset` header and may be retried;
+    GET tells how far the upload got; POST complete/ turns it into a
+    Document. Sessions that are never completed expire after
+    CABINET_UPLOAD_SESSION_TTL (see cleanup_upload_sessions).
+    """
+    model = UploadSession
+    queryset = UploadSession.objects.all()
+    serializer_class = UploadSessionSerializer
+    http_method_names = ['get', 'post', 'put', 'delete', 'head', 'options']
+
+    def get_queryset(self):
+        # Direct uploads are finalized through DocumentViewSet
+        return super().get_queryset().filter(expires_at__gt=timezone.now(), object_key='')
+
+    def perform_create(self, serializer):
+        StorageService.check(self.request.user.company, serializer.validated_data['size'])
+        session = serializer.save(
             company=self.request.user.company,
-            uploaded_by=self.request.user,
-            file_size=f"{self.request.FILES['file'].size / 1024 / 1024:.2f} MB"
+            created_by_id=self.request.user.pk,
+            expires_at=timezone.now() + settings.CABINET_UPLOAD_SESSION_TTL,
+        )
+        session.part_path.parent.mkdir(parents=True, exist_ok=True)
+        session.part_path.touch()
+
+    def perform_destroy(self, instance):
+        instance.discard()
+
+    def update(self, request, *args, **kwargs):
+        session = self.get_object()
+        try:
+            offset = int(request.headers['Upload-Offset'])
+            length = int(request.META.get('CONTENT_LENGTH') or 0)
+        except (KeyError, ValueError):
+            return Response({'error': 'Upload-Offset and Content-Length are required'}, status=status.HTTP_400_BAD_REQUEST)
+
+        if offset < 0 or offset + length > session.size:
+            return Response({'error': 'Chunk is outside of the file'}, status=status.HTTP_400_BAD_REQUEST)
+        if length > settings.CABINET_UPLOAD_MAX_CHUNK_SIZE:
+            return Response({'error': 'Chunk is too large'}, status=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+        if offset > session.offset:
+            # A gap would leave a hole in the file: resume from what we have
+            return self.offset_response(session, status.HTTP_409_CONFLICT)
+
+        written = write_chunk(session.part_path, offset, request.stream, length) if length else 0
+        UploadSession.objects.filter(pk=session.pk).update(offset=Greatest('offset', offset + written))
+        session.refresh_from_db(fields=['offset'])
+        return self.offset_response(session)
+
+    @action(detail=True, methods=['post'])
+    def complete(self, request, pk=None):
+        with transaction.atomic():
+            session = self.get_object()
+            session = UploadSession.objects.select_for_update().get(pk=session.pk)
+            if session.offset < session.size:
+                return self.offset_response(session, status.HTTP_409_CONFLICT)
+
+            document = Document(
+                company=session.company,
+                uploaded_by=request.user,
+                title=session.title or session.filename,
+                category=session.category,
+                file_size=Document.format_size(session.size),
+                size=session.size,
+            )
+            StorageService.reserve(session.company, session.size)
+            with PartFile(session.part_path, name=session.filename) as part:
+                document.file.save(session.filename, part, save=False)
+            document.save()
+            session.discard()
+
+        return Response(DocumentSerializer(document, context={'request': request}).data, status=status.HTTP_201_CREATED)
+
+    def offset_response(self, session, status_code=status.HTTP_200_OK):
+        return Response(
+            {'offset': session.offset, 'size': session.size},
+            status=status_code,
+            headers={'Upload-Offset': str(session.offset)},
         )
 
 class ThreadViewSet(BaseCabinetViewSet):
     model = Thread
     queryset = Thread.objects.all()
     serializer_class = ThreadSerializer
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action not in ('list', 'retrieve'):
+            return queryset
+        return queryset.annotate(
+            unread_count=ThreadService.unread_count_subquery(self.request.user)
+        )
+
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return ThreadListSerializer
+        return ThreadSerializer
+
+    def perform_create(self, serializer):
+        super().perform_create(serializer)
+        ThreadReadState.objects.create(thread=serializer.instance, user_id=self.request.user.pk)
+
+    def perform_update(self, serializer):
+        previous_status = serializer.instance.status
+        serializer.save()
+        if serializer.instance.status != previous_status:
+            ThreadService.status_changed(serializer.instance)
     
     @action(detail=True, methods=['post'])
     def add_message(self, request, pk=None):
         thread = self.get_object()
         serializer = MessageSerializer(data=request.data)
         if serializer.is_valid():
-            serializer.save(
-                thread=thread,
-                author=request.user
-            )
-            thread.last_message_at = serializer.instance.created_at
-            thread.save()
+            # The message and the thread's bookkeeping commit together
+            with transaction.atomic():
+                serializer.save(
+                    thread=thread,
+                    author=request.user
+                )
+                ThreadService.message_posted(serializer.instance)
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+    @action(detail=True, methods=['post'])
+    def mark_read(self, request, pk=None):
+        """Mark everything up to `message` (default: the latest one) as read."""
+        thread = self.get_object()
+        message_id = request.data.get('message')
+        if message_id is None:
+            message_id = thread.messages.order_by('-id').values_list('id', flat=True).first()
+            if message_id is None:
+                return Response({'unread_count': 0})
+        else:
+            try:
+                message_id = int(message_id)
+            except (TypeError, ValueError):
+                return Response({'error': 'Invalid message id'}, status=status.HTTP_400_BAD_REQUEST)
+            if not thread.messages.filter(id=message_id).exists():
+                return Response({'error': 'Message not found in this thread'}, status=status.HTTP_400_BAD_REQUEST)
+
+        unread_count = ThreadService.mark_read(thread, request.user, message_id)
+        return Response({'unread_count': unread_count})
+
+    @action(detail=False, methods=['get'])
+    def unread(self, request):
+        """Total unread messages across all threads (header badge)."""
+        return Response({'total': ThreadService.total_unread(request.user)})
     
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """Ranked full-text search over the company's messages: ?q=...&page=N"""
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({'error': 'Query parameter q is required'}, status=status.HTTP_400_BAD_REQUEST)
+
+        paginator = SearchPagination()
+        page = paginator.paginate_queryset(message_index.search(request.user.company_id, query), request, view=self)
+        hits = [{'message': message, 'rank': rank} for message, rank in page]
+        serializer = MessageSearchResultSerializer(hits, many=True, context={'query': query})
+        return paginator.get_paginated_response(serializer.data)
+
     @action(detail=True, methods=['get'])
     def messages(self, request, pk=None):
         thread = self.get_object()
-        messages = thread.messages.all().order_by('created_at')
-        serializer = MessageSerializer(messages, many=True)
-        return Response(serializer.data)
+        paginator = MessageCursorPagination()
+        page = paginator.paginate_queryset(self.get_messages_queryset(thread), request, view=self)
+        serializer = MessageSerializer(page, many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(detail=True, methods=['get'])
+    def poll(self, request, pk=None):
+        """
+        Long-poll for messages newer than `since` (the last message id the
+        client has). Returns them as soon as they exist, or 204 after
+        `timeout` seconds without news.
+        """
+        thread = self.get_object()
+        try:
+            since = int(request.query_params.get('since', 0))
+            timeout = float(request.query_params.get('timeout', settings.CABINET_LONG_POLL_TIMEOUT))
+        except ValueError:
+            return Response({'error': 'Invalid since/timeout'}, status=status.HTTP_400_BAD_REQUEST)
+        timeout = max(0, min(timeout, settings.CABINET_LONG_POLL_MAX_TIMEOUT))
+
+        newer = self.get_messages_queryset(thread).filter(id__gt=since).order_by('id')
+        limit = MessageCursorPagination.max_page_size
+        messages = list(newer[:limit])
+        if not messages and wait_for_new_message(thread.id, since, timeout):
+            messages = list(newer[:limit])
+
+        if not messages:
+            return Response(status=status.HTTP_204_NO_CONTENT)
+        return Response({'results': MessageSerializer(messages, many=True).data})
+
+    def get_messages_queryset(self, thread):
+        return thread.messages.select_related('author__profile', 'author__company__subscription')
 
 class InvoiceViewSet(BaseCabinetViewSet):
     model = Invoice
@@ -77,27 +462,61 @@ class InvoiceViewSet(BaseCabinetViewSet):
     serializer_class = InvoiceSerializer
     http_method_names = ['get'] # Read-only for now
 
+    @action(detail=True, methods=['get'], content_negotiation_class=DownloadNegotiation)
+    def download(self, request, pk=None):
+        invoice = self.get_object()
+        if not invoice.file:
+            return Response({'detail': 'Invoice has no file'}, status=status.HTTP_404_NOT_FOUND)
+        return file_response(request, invoice.file.storage, invoice.file.name)
+
+class TransactionViewSet(BaseCabinetViewSet):
+    model = Transaction
+    queryset = Transaction.objects.all()
+    serializer_class = TransactionSerializer
+    http_method_names = ['get'] # Entries are posted by billing, see LedgerService.post
+
+    def get_queryset(self):
+        return super().get_queryset().order_by('-date', '-id')
+
+    @action(detail=False, methods=['get'])
+    def balance(self, request):
+        """Current balance, or as of ?at= (YYYY-MM-DD for the end of that day, or an ISO datetime)."""
+        company = request.user.company
+        value = request.query_params.get('at')
+        if not value:
+            balance = Company.objects.filter(pk=company.pk).values_list('balance', flat=True).first()
+            return Response({'at': None, 'balance': balance})
+        try:
+            at = parse_datetime(value)
+            day = parse_date(value) if at is None else None
+        except ValueError:
+            at = day = None
+        if at is None and day is None:
+            return Response({'error': 'at must be YYYY-MM-DD or an ISO datetime'}, status=status.HTTP_400_BAD_REQUEST)
+        if day is not None:
+            # Everything dated that day: before the next midnight
+            at = timezone.make_aware(datetime.combine(day + timedelta(days=1), time.min))
+            balance = LedgerService.balance_as_of(company.pk, at, inclusive=False)
+        else:
+            if timezone.is_naive(at):
+                at = timezone.make_aware(at)
+            balance = LedgerService.balance_as_of(company.pk, at)
+        return Response({'at': value, 'balance': balance})
+
+class ActivityViewSet(BaseCabinetViewSet):
+    """The company's activity feed, newest first (see apps.cabinet.activity)."""
+    model = ActivityEvent
+    queryset = ActivityEvent.objects.all()
+    serializer_class = ActivityEventSerializer
+    pagination_class = ActivityCursorPagination
+    http_method_names = ['get']
+
+    def get_queryset(self):
+        return super().get_queryset().select_related('actor')
+
 class DashboardViewSet(viewsets.ViewSet):
     permission_classes = [permissions.IsAuthenticated]
 
     def list(self, request):
-        company = request.user.company
-        requests = ServiceRequest.objects.filter(company=company)
-        docs = Document.objects.filter(company=company)
-        invoices = Invoice.objects.filter(company=company)
-        
-        active_requests_count = requests.exclude(status='done').count()
-        docs_count = docs.count()
-        balance = 15400 # Mock balance from subscription integration later
-        
-        recent_activity = [] # TODO: Aggregate recent signals
-        
-        return Response({
-            'stats': {
-                'activeRequests': active_requests_count,
-                'documentsCount': docs_count,
-                'consultationsAvailable': 2, # TODO: real limits
-                'balance': balance,
-            },
-            'recentRequests': ServiceRequestSerializer(requests.order_by('-updated_at')[:3], many=True).data
-        })
+        # Cached per company, see apps.cabinet.dashboard
+        return Response(dashboard.payload(request.user.company_id))
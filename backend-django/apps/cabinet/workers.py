@@ -0,0 +1,274 @@
+"""
+CPU-bound work that runs in the cabinet process pool (see pool()).
+
+Functions here are executed in child processes: they take and return
+plain data and must not touch Django models or settings.
+"""
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import threading
+import zipfile
+from contextlib import contextmanager
+from xml.etree import ElementTree
+
+from .compression import make_delta, open_decompressed, read_decompressed
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+PDF_EXTENSIONS = {'.pdf'}
+IMAGE_EXTENSIONS = {'.png', '.jpg', '.jpeg', '.gif', '.bmp', '.tif', '.tiff', '.webp'}
+DOCX_EXTENSIONS = {'.docx'}
+TEXT_EXTENSIONS = {'.txt', '.md', '.csv'}
+WORD_NAMESPACE = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+# (URL, presigned GET): an object the worker fetches itself (see jobs.source_of)
+URL = 'url'
+FETCH_TIMEOUT = 30
+READ_CHUNK_SIZE = 256 * 1024
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def pool(max_workers, memory_limit=None):
+    """
+    The process pool of this server process, created on first use (and
+    again if a worker died). Children are spawned rather than forked:
+    forking a process that already runs threads and holds database
+    connections is not safe. `memory_limit` caps each worker's address
+    space, so a pathological file fails its own job with MemoryError
+    instead of exhausting the machine.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None or getattr(_pool, '_broken', False):
+            _pool = ProcessPoolExecutor(
+                max_workers=max_workers,
+                mp_context=get_context('spawn'),
+                initializer=_limit_memory,
+                initargs=(memory_limit,),
+            )
+        return _pool
+
+
+@contextmanager
+def _fetched(source, limit=None):
+    """
+    The source itself, or for (URL, url) a temporary file holding the
+    object (its first `limit` bytes with a limit), removed afterwards.
+    """
+    if not (isinstance(source, tuple) and source[0] == URL):
+        yield source
+        return
+    import requests
+
+    with tempfile.NamedTemporaryFile(prefix='cabinet-object-') as f:
+        headers = {'Range': f'bytes=0-{limit - 1}'} if limit else {}
+        with requests.get(source[1], headers=headers, stream=True, timeout=FETCH_TIMEOUT) as response:
+            response.raise_for_status()
+            response.raw.decode_content = True
+            if limit is None:
+                shutil.copyfileobj(response.raw, f, READ_CHUNK_SIZE)
+            else:
+                f.write(response.raw.read(limit))
+        f.flush()
+        yield f.name
+
+
+def _readable(source):
+    """A path or bytes: files compressed at rest are decompressed here, in the worker."""
+    if isinstance(source, tuple):
+        codec, path = source
+        return read_decompressed(path, codec)
+    return source
+
+
+def _open(source):
+    if isinstance(source, tuple):
+        codec, path = source
+        return open_decompressed(path, codec)
+    if isinstance(source, str):
+        return open(source, 'rb')
+    return io.BytesIO(source)
+
+
+def _limit_memory(limit):
+    if not limit:
+        return
+    try:
+        import resource
+    except ImportError:  # not available on Windows
+        return
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def can_render_preview(name):
+    extension = os.path.splitext(name)[1].lower()
+    return extension in PDF_EXTENSIONS or extension in IMAGE_EXTENSIONS
+
+
+def render_preview(source, extension, widths, image_format):
+    """
+    Renders the first page of a PDF, or an image, at each of `widths`.
+
+    `source` is a file path, (codec, path), (URL, url) or the file's bytes.
+    Returns {name: encoded image bytes} for every name in `widths`.
+    """
+    with _fetched(source) as source:
+        return _render_preview(_readable(source), extension, widths, image_format)
+
+
+def _render_preview(source, extension, widths, image_format):
+    from PIL import Image, ImageOps
+
+    largest = max(widths.values())
+    if extension.lower() in PDF_EXTENSIONS:
+        image = _render_pdf_page(source, largest)
+    else:
+        image = Image.open(source if isinstance(source, str) else io.BytesIO(source))
+        image.seek(0)
+        image = ImageOps.exif_transpose(image)
+
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if image.has_transparency_data else 'RGB')
+
+    renditions = {}
+    for name, width in widths.items():
+        rendition = image.copy()
+        rendition.thumbnail((width, width * 4), Image.LANCZOS)
+        buffer = io.BytesIO()
+        if image_format.upper() == 'WEBP':
+            rendition.save(buffer, 'WEBP', quality=80, method=4)
+        else:
+            rendition.save(buffer, image_format.upper(), optimize=True)
+        renditions[name] = buffer.getvalue()
+    return renditions
+
+
+def _render_pdf_page(source, width):
+    import pymupdf
+    from PIL import Image
+
+    if isinstance(source, str):
+        pdf = pymupdf.open(source)
+    else:
+        pdf = pymupdf.open(stream=source, filetype='pdf')
+    with pdf:
+        page = pdf[0]
+        zoom = width / page.rect.width if page.rect.width else 1
+        pixmap = page.get_pixmap(matrix=pymupdf.Matrix(zoom, zoom), alpha=False)
+        return Image.frombytes('RGB', (pixmap.width, pixmap.height), pixmap.samples)
+
+
+def can_extract_text(name):
+    extension = os.path.splitext(name)[1].lower()
+    return extension in PDF_EXTENSIONS or extension in DOCX_EXTENSIONS or extension in TEXT_EXTENSIONS
+
+
+def extract_text(source, extension, max_chars):
+    """
+    Plain text of a PDF, DOCX or text file, at most `max_chars` long.
+    `source` is a file path, (codec, path), (URL, url) or the file's bytes. Reading
+    stops as soon as enough text is collected, so the size of the file does
+    not matter.
+    """
+    extension = extension.lower()
+    plain = extension not in PDF_EXTENSIONS and extension not in DOCX_EXTENSIONS
+    # Plain text needs only the start of an object
+    with _fetched(source, limit=max_chars * 4 if plain else None) as source:
+        if extension in PDF_EXTENSIONS:
+            text = _pdf_text(_readable(source), max_chars)
+        elif extension in DOCX_EXTENSIONS:
+            text = _docx_text(_readable(source), max_chars)
+        else:
+            text = _plain_text(source, max_chars)
+    # PostgreSQL text cannot hold NUL
+    return text[:max_chars].replace('\x00', '')
+
+
+def _pdf_text(source, max_chars):
+    import pymupdf
+
+    if isinstance(source, str):
+        pdf = pymupdf.open(source)
+    else:
+        pdf = pymupdf.open(stream=source, filetype='pdf')
+    parts, length = [], 0
+    with pdf:
+        for page in pdf:
+            text = page.get_text()
+            parts.append(text)
+            length += len(text)
+            if length >= max_chars:
+                break
+    return '\n'.join(parts)
+
+
+def _docx_text(source, max_chars):
+    parts, length = [], 0
+    with zipfile.ZipFile(source if isinstance(source, str) else io.BytesIO(source)) as docx:
+        with docx.open('word/document.xml') as xml:
+            for _, element in ElementTree.iterparse(xml):
+                if element.tag == f'{WORD_NAMESPACE}t' and element.text:
+                    parts.append(element.text)
+                    length += len(element.text)
+                elif element.tag == f'{WORD_NAMESPACE}tab':
+                    parts.append('\t')
+                elif element.tag == f'{WORD_NAMESPACE}p':
+                    parts.append('\n')
+                    element.clear()
+                if length >= max_chars:
+                    break
+    return ''.join(parts)
+
+
+def _plain_text(source, max_chars):
+    # UTF-8 takes up to 4 bytes per character (2 for Cyrillic)
+    if isinstance(source, tuple):
+        codec, path = source
+        with open_decompressed(path, codec) as f:
+            data = f.read(max_chars * 4)
+    elif isinstance(source, str):
+        with open(source, 'rb') as f:
+            data = f.read(max_chars * 4)
+    else:
+        data = source[:max_chars * 4]
+    try:
+        return data.decode('utf-8')
+    except UnicodeDecodeError as e:
+        if e.start > len(data) - 4:
+            # Cut in the middle of a character
+            return data[:e.start].decode('utf-8', errors='replace')
+        return data.decode('cp1251', errors='replace')
+
+
+def make_version(source, base, base_sha256, min_saving):
+    """
+    Hashes a new version of a document and, given the file of the version
+    before it as `base`, makes a zstd delta from that (see versioning).
+    The delta is None if the base is not the version `base_sha256` names
+    (when given) or if it saves less than `min_saving` of the size. Sources
+    are as for extract_text. Returns (sha256, sha256 of base, delta).
+    """
+    with _fetched(source) as source:
+        if base is None:
+            sha256 = hashlib.sha256()
+            with _open(source) as f:
+                for chunk in iter(lambda: f.read(READ_CHUNK_SIZE), b''):
+                    sha256.update(chunk)
+            return sha256.hexdigest(), None, None
+        with _open(source) as f:
+            target = f.read()
+    with _fetched(base) as base:
+        with _open(base) as f:
+            base = f.read()
+    digest = hashlib.sha256(target).hexdigest()
+    base_digest = hashlib.sha256(base).hexdigest()
+    delta = None
+    if base_sha256 in ('', base_digest) and digest != base_digest:
+        delta = make_delta(base, target)
+        if len(delta) > len(target) * (1 - min_saving):
+            delta = None
+    return digest, base_digest, delta
@@ -0,0 +1,153 @@
+"""
+JWT access tokens that carry what most requests need to know about the
+user, checked against usercache instead of being looked up.
+
+Tokens issued here embed role, company_id, plan_code and
+subscription_status (see claims_for). ClaimsJWTAuthentication reads the
+user from usercache, refuses it if it is gone or inactive, as
+JWTAuthentication does, and refuses the token if its claims no longer
+match the user: the client then refreshes it, and a refreshed access token
+reads the claims from the database again. Saving a user, profile, company
+or subscription drops the user's cache entry (see signals), so a change
+reaches every process within what usercache guarantees.
+"""
+import time
+
+from django.contrib.auth import get_user_model
+from django.utils.functional import SimpleLazyObject
+from rest_framework_simplejwt import serializers as jwt_serializers
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from . import usercache
+from .models import Company
+
+# When the claims were read from the database; a token's own `iat` is
+# copied from the refresh token, so it cannot tell
+CLAIMS_AT = 'claims_at'
+
+CLAIMS = ('role', 'company_id', 'plan_code', 'subscription_status', 'is_staff', 'is_superuser')
+
+
+def claims_for(user):
+    account = getattr(user, 'cached_account', None)
+    if account is not None:
+        # From usercache: no query
+        return dict(account, role=user.role, is_staff=user.is_staff, is_superuser=user.is_superuser,
+                    **{CLAIMS_AT: time.time()})
+    try:
+        company = user.company
+    except Company.DoesNotExist:
+        company = None
+    subscription = getattr(company, 'subscription', None) if company is not None else None
+    return {
+        'role': user.role,
+        'company_id': company.pk if company is not None else None,
+        'plan_code': subscription.plan_code if subscription is not None else None,
+        'subscription_status': subscription.status if subscription is not None else None,
+        'is_staff': user.is_staff,
+        'is_superuser': user.is_superuser,
+        CLAIMS_AT: time.time(),
+    }
+
+
+class ClaimsRefreshToken(RefreshToken):
+    @property
+    def access_token(self):
+        access = super().access_token
+        user = (
+            get_user_model().objects.select_related('company__subscription')
+            .filter(**{api_settings.USER_ID_FIELD: self[api_settings.USER_ID_CLAIM]}).first()
+        )
+        if user is not None:
+            access.payload.update(claims_for(user))
+        return access
+
+
+class TokenObtainPairSerializer(jwt_serializers.TokenObtainPairSerializer):
+    token_class = ClaimsRefreshToken
+
+
+class TokenRefreshSerializer(jwt_serializers.TokenRefreshSerializer):
+    token_class = ClaimsRefreshToken
+
+
+class ClaimsUser(SimpleLazyObject):
+    """
+    request.user of a token with claims: the cached user of usercache,
+    with pk, role, company_id, plan_code, subscription_status, is_staff and
+    is_superuser read from the (checked) claims, and a `company` that loads
+    only the Company.
+    """
+
+    def __init__(self, token, user):
+        super().__init__(lambda: user)
+        # Set directly: LazyObject.__setattr__ would set them on the user
+        self.__dict__['token'] = token
+        self.__dict__['_company'] = None
+
+    @property
+    def pk(self):
+        return get_user_model()._meta.pk.to_python(self.token[api_settings.USER_ID_CLAIM])
+
+    id = pk
+
+    role = property(lambda self: self.token['role'])
+    company_id = property(lambda self: self.token['company_id'])
+    plan_code = property(lambda self: self.token['plan_code'])
+    subscription_status = property(lambda self: self.token['subscription_status'])
+    is_staff = property(lambda self: self.token.get('is_staff', False))
+    is_superuser = property(lambda self: self.token.get('is_superuser', False))
+    is_authenticated = True
+    is_anonymous = False
+
+    @property
+    def company(self):
+        if self.company_id is None:
+            return None
+        if self.__dict__['_company'] is None:
+            self.__dict__['_company'] = Company.objects.get(pk=self.company_id)
+        return self.__dict__['_company']
+
+    def __bool__(self):
+        # `request.user and ...` must not load the user
+        return True
+
+
+class ClaimsJWTAuthentication(JWTAuthentication):
+    """JWTAuthentication that reads the user from usercache and checks the token's claims against it."""
+
+    def get_user(self, validated_token):
+        user = self.get_cached_user(validated_token)
+        if CLAIMS_AT not in validated_token:
+            # Issued before tokens had claims
+            return user
+        current = claims_for(user)
+        if any(validated_token.get(name) != current[name] for name in CLAIMS):
+            raise InvalidToken('Token claims are out of date')
+        return ClaimsUser(validated_token, user)
+
+    def get_cached_user(self, validated_token):
+        if api_settings.USER_ID_CLAIM not in validated_token:
+            raise InvalidToken(_('Token contained no recognizable user identification'))
+        try:
+            user = _cached_user(validated_token[api_settings.USER_ID_CLAIM])
+        except get_user_model().DoesNotExist:
+            raise AuthenticationFailed(_('User not found'), code='user_not_found')
+        if api_settings.CHECK_USER_IS_ACTIVE and not user.is_active:
+            raise AuthenticationFailed(_('User is inactive'), code='user_inactive')
+        if api_settings.CHECK_REVOKE_TOKEN:
+            # Needs the password, which usercache does not load
+            return super().get_user(validated_token)
+        return user
+
+
+def _cached_user(user_id):
+    user = usercache.get(user_id)
+    if user is None:
+        raise get_user_model().DoesNotExist(f'No user {user_id}')
+    return user
+
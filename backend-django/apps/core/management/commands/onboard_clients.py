@@ -0,0 +1,32 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+from apps.core import onboarding
+
+
+class Command(BaseCommand):
+    help = 'Creates clients with their profile, company and subscription from a CSV or JSONL file; existing emails are skipped'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="CSV or JSONL file, '-' for standard input")
+        parser.add_argument('--format', choices=onboarding.FORMATS, help='Default: from the file extension')
+        parser.add_argument('--chunk-size', type=int, help='Clients per transaction (default CORE_ONBOARDING chunk_size)')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        format = options['format'] or onboarding.format_of(path)
+        if format is None:
+            raise CommandError('Cannot tell the format from the file name: pass --format')
+        stream = sys.stdin.buffer if path == '-' else open(path, 'rb')
+        try:
+            result = onboarding.onboard(onboarding.read(stream, format), chunk_size=options['chunk_size'])
+        finally:
+            if stream is not sys.stdin.buffer:
+                stream.close()
+        for line, error in result['errors']:
+            self.stderr.write(f'Line {line}: {error}')
+        self.stdout.write(self.style.SUCCESS(
+            f"Done: {result['created']} clients created, {result['skipped']} already existed, {result['invalid']} invalid."
+        ))
+        if 'file_error' in result:
+            raise CommandError(f"Stopped reading the file: {result['file_error']}")
@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from apps.core import avatars
+from apps.core.models import Profile
+
+
+class Command(BaseCommand):
+    help = 'Renders the resized copies of avatars uploaded before renditions existed (all of them with --all)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Also re-render avatars that have renditions, e.g. after changing AVATAR_RENDITION_SIZES')
+
+    def handle(self, *args, **options):
+        profiles = Profile.objects.exclude(avatar='').exclude(avatar=None)
+        if not options['all']:
+            profiles = profiles.filter(avatar_hash='')
+        done = failed = 0
+        for profile in profiles.only('pk', 'avatar').iterator(chunk_size=200):
+            digest = avatars.generate(profile.avatar, force=options['all'])
+            if not digest:
+                failed += 1
+                continue
+            Profile.objects.filter(pk=profile.pk).update(avatar_hash=digest)
+            done += 1
+        self.stdout.write(self.style.SUCCESS(f'Done: {done} avatars rendered, {failed} failed.'))
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from apps.core import usercache
+
+
+class Command(BaseCommand):
+    help = 'Shows how often authentication found users in the cache (apps.core.usercache)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Start counting again from zero')
+
+    def handle(self, *args, **options):
+        counts = usercache.stats()
+        lookups = sum(counts.values())
+        for name in usercache.COUNTERS:
+            self.stdout.write(f'{name}: {counts[name]}')
+        if lookups:
+            hit_rate = 100 * (lookups - counts['misses']) / lookups
+            self.stdout.write(self.style.SUCCESS(f'Hit rate: {hit_rate:.1f}% of {lookups} lookups'))
+        if options['reset']:
+            usercache.reset_stats()
+            self.stdout.write('Counters reset.')
@@ -0,0 +1,44 @@
+from urllib.parse import parse_qs
+
+from channels.db import database_sync_to_async
+from channels.middleware import BaseMiddleware
+from django.contrib.auth.models import AnonymousUser
+from rest_framework_simplejwt.exceptions import InvalidToken, AuthenticationFailed, TokenError
+
+from .authentication import ClaimsJWTAuthentication
+
+
+class JWTAuthMiddleware(BaseMiddleware):
+    """
+    Authenticates WebSocket connections with the same SimpleJWT access
+    tokens as the REST API. Browsers cannot set headers on a WebSocket
+    handshake, so the token is read from `?token=<access>`, falling back
+    to an `Authorization: Bearer <access>` header for other clients.
+    """
+
+    async def __call__(self, scope, receive, send):
+        scope = dict(scope)
+        scope['user'] = await self.get_user(self.get_raw_token(scope))
+        return await super().__call__(scope, receive, send)
+
+    def get_raw_token(self, scope):
+        query = parse_qs(scope.get('query_string', b'').decode())
+        if query.get('token'):
+            return query['token'][0]
+
+        header = dict(scope.get('headers', [])).get(b'authorization', b'').decode()
+        parts = header.split()
+        if len(parts) == 2 and parts[0] == 'Bearer':
+            return parts[1]
+        return None
+
+    @database_sync_to_async
+    def get_user(self, raw_token):
+        if not raw_token:
+            return AnonymousUser()
+        auth = ClaimsJWTAuthentication()
+        try:
+            # The full user, from usercache: consumers run queries with it
+            return auth.get_cached_user(auth.get_validated_token(raw_token))
+        except (InvalidToken, AuthenticationFailed, TokenError):
+            return AnonymousUser()
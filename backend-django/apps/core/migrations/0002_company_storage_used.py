@@ -0,0 +1,18 @@
+# Generated by Django 4.2.27 on 2026-10-18 15:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='company',
+            name='storage_used',
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.27 on 2026-10-18 16:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_profile_avatar_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='company',
+            name='balance',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+    ]
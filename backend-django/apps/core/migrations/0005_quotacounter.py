@@ -0,0 +1,29 @@
+# Generated by Django 4.2.27 on 2026-10-18 16:41
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_company_balance'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='QuotaCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('resource', models.CharField(max_length=20)),
+                ('period_start', models.DateField()),
+                ('used', models.PositiveIntegerField(default=0)),
+                ('limit', models.PositiveIntegerField(blank=True, null=True)),
+                ('company', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='quota_counters', to='core.company')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='quotacounter',
+            constraint=models.UniqueConstraint(fields=('company', 'period_start', 'resource'), name='core_unique_quota_counter'),
+        ),
+    ]
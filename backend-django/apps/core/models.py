@@ -49,6 +49,16 @@ class User(AbstractUser):
     def __str__(self):
         return self.email
 
+    @property
+    def company_id(self):
+        # Same as ClaimsUser.company_id (apps.core.authentication), so views
+        # need not care which of the two request.user is
+        account = getattr(self, 'cached_account', None)  # see apps.core.usercache
+        if account is not None:
+            return account['company_id']
+        company = getattr(self, 'company', None)
+        return company.pk if company is not None else None
+
 
 class Company(models.Model):
     name = models.CharField(max_length=255)
@@ -57,6 +67,12 @@ class Company(models.Model):
     address = models.TextField(blank=True, null=True)
     industry = models.CharField(max_length=100, blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
+    # Bytes of all the company's documents; maintained by
+    # apps.cabinet.services.StorageService, checked by reconcile_storage
+    storage_used = models.BigIntegerField(default=0)
+    # Sum of the company's ledger (cabinet Transaction); maintained by
+    # apps.cabinet.services.LedgerService, checked by verify_ledger
+    balance = models.DecimalField(max_digits=12, decimal_places=2, default=0)
     
     # Simple owner relationship for MVP
     owner = models.OneToOneField(User, on_delete=models.CASCADE, related_name='company')
@@ -69,6 +85,8 @@ class Profile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE, related_name='profile')
     position = models.CharField(max_length=100, blank=True, null=True)
     avatar = models.ImageField(upload_to='avatars/', blank=True, null=True)
+    # Names the resized copies of the avatar (see apps.core.avatars)
+    avatar_hash = models.CharField(max_length=32, blank=True, editable=False)
     
     def __str__(self):
         return f"Profile of {self.user.email}"
@@ -86,6 +104,15 @@ class Subscription(models.Model):
         ('canceled', 'Canceled'),
         ('expired', 'Expired'),
     )
+    # What every new client starts with (see signals and onboarding)
+    TRIAL_LIMITS = {'requests': 3, 'consultations': 1, 'storage_gb': 1}
+    TRIAL_USAGE = {'requests': 0, 'consultations': 0, 'storage_gb': 0}
+    # Limits of each plan once it is paid for, as on the tariff page (None: unlimited)
+    PLAN_LIMITS = {
+        'start': {'requests': 7, 'consultations': 5, 'storage_gb': 1},
+        'business': {'requests': 25, 'consultations': 15, 'storage_gb': 10},
+        'pro': {'requests': None, 'consultations': None, 'storage_gb': None},
+    }
     
     company = models.OneToOneField(Company, on_delete=models.CASCADE, related_name='subscription')
     plan_code = models.CharField(max_length=20, choices=PLAN_CHOICES, default='start')
@@ -101,3 +128,29 @@ class Subscription(models.Model):
 
     def __str__(self):
         return f"{self.company.name} - {self.plan_code}"
+
+    @classmethod
+    def limits_for(cls, plan_code, status):
+        """Limits of a new subscription: the trial's while on trial, the plan's otherwise."""
+        return dict(cls.TRIAL_LIMITS if status == 'trial' else cls.PLAN_LIMITS[plan_code])
+
+
+class QuotaCounter(models.Model):
+    """
+    How much of a plan resource a company used in one period (a calendar
+    month). Maintained by apps.core.quotas; `limit` is Subscription.limits
+    of the resource, copied when the period's row is created.
+    """
+    company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name='quota_counters')
+    resource = models.CharField(max_length=20)
+    period_start = models.DateField()
+    used = models.PositiveIntegerField(default=0)
+    limit = models.PositiveIntegerField(null=True, blank=True) # None: unlimited
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['company', 'period_start', 'resource'], name='core_unique_quota_counter'),
+        ]
+
+    def __str__(self):
+        return f"{self.resource} of company {self.company_id} from {self.period_start}: {self.used}/{self.limit}"
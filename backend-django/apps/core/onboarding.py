@@ -0,0 +1,215 @@
+"""
+Bulk onboarding of clients from a CSV or JSONL file (`manage.py
+onboard_clients`, POST /api/core/clients/import/).
+
+Every client becomes a User with its Profile, Company and Subscription
+(with the limits of its plan and status, see Subscription.limits_for), as User's post_save signal would create them, but in
+batches: the file is read as a stream, CORE_ONBOARDING['chunk_size']
+clients at a time, and each chunk is four bulk_create calls in one
+transaction. Passwords are hashed in the cabinet process pool. Signals do
+not fire for these rows; CompanyStats and quota counters are created on
+first use anyway.
+
+Clients are identified by email: emails that already have a user are
+skipped, so importing the same file again changes nothing. Rows are
+columns of the header (CSV) or keys of an object per line (JSONL): email
+(required), password (none: the user cannot log in until it is reset),
+first_name, last_name, phone, position, company_name, inn, ogrn, address,
+industry, plan_code and status. A file that cannot be read (not UTF-8,
+malformed CSV) stops the import at that point: the chunks before it stay
+created and the result carries the error.
+"""
+import csv
+import io
+import json
+import os
+from itertools import islice
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import get_hasher, make_password
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import IntegrityError, transaction
+
+from apps.cabinet import jobs
+from . import workers
+from .models import Company, Profile, Subscription
+
+FORMATS = ('csv', 'jsonl')
+
+USER_FIELDS = ('first_name', 'last_name', 'phone')
+COMPANY_FIELDS = ('inn', 'ogrn', 'address', 'industry')
+
+
+class InvalidFile(ValueError):
+    """The file itself cannot be read past some line."""
+
+
+def format_of(name):
+    """'csv' or 'jsonl' from a file name, None if it tells neither."""
+    extension = os.path.splitext(name or '')[1].lower().lstrip('.')
+    return {'csv': 'csv', 'jsonl': 'jsonl', 'ndjson': 'jsonl'}.get(extension)
+
+
+def read(stream, format):
+    """
+    Yields (line number, row) for each client in a binary stream; a row that
+    is not an object is None. Raises InvalidFile where the stream is not
+    UTF-8 or not valid CSV.
+    """
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='' if format == 'csv' else None)
+    number = 0
+    try:
+        if format == 'csv':
+            reader = csv.DictReader(text)
+            for row in reader:
+                number = reader.line_num
+                yield number, row
+        else:
+            for number, line in enumerate(text, 1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    row = None
+                yield number, row if isinstance(row, dict) else None
+    except UnicodeDecodeError:
+        # Text is decoded in blocks: the bad byte is somewhere after the last line read
+        raise InvalidFile(f'The file is not UTF-8 text after line {number}: save it as UTF-8') from None
+    except csv.Error as e:
+        raise InvalidFile(f'Invalid CSV after line {number}: {e}') from None
+    finally:
+        # Closing the wrapper would close the caller's stream
+        text.detach()
+
+
+def onboard(rows, chunk_size=None):
+    """
+    Creates the clients of `rows`, as read() yields them. Returns counts of
+    created, skipped (existing email) and invalid rows, and the errors of
+    the first CORE_ONBOARDING['max_errors'] invalid rows as (line, message).
+    If the file cannot be read to the end, the rows before the failure are
+    still created and 'file_error' is the InvalidFile message.
+    """
+    options = settings.CORE_ONBOARDING
+    chunk_size = chunk_size or options['chunk_size']
+    result = {'created': 0, 'skipped': 0, 'invalid': 0, 'errors': []}
+    rows = iter(rows)
+    while 'file_error' not in result:
+        batch = []
+        try:
+            batch.extend(islice(rows, chunk_size))
+        except InvalidFile as e:
+            result['file_error'] = str(e)
+        if not batch:
+            break
+        chunk = []
+        for line, row in batch:
+            try:
+                chunk.append(clean(row))
+            except ValueError as e:
+                result['invalid'] += 1
+                if len(result['errors']) < options['max_errors']:
+                    result['errors'].append((line, str(e)))
+        created = _create(chunk) if chunk else 0
+        result['created'] += created
+        result['skipped'] += len(chunk) - created
+    return result
+
+
+def clean(row):
+    """The client of a row, with defaults filled in; raises ValueError for invalid rows."""
+    if row is None:
+        raise ValueError('Not a JSON object')
+    row = {key.strip(): '' if value is None else str(value).strip() for key, value in row.items() if key}
+    email = get_user_model().objects.normalize_email(row.get('email', ''))
+    try:
+        validate_email(email)
+    except ValidationError:
+        raise ValueError(f'Invalid email: {email!r}')
+    client = {
+        'email': email,
+        'password': row.get('password') or None,
+        'position': row.get('position', ''),
+        'company_name': row.get('company_name') or f'Company of {email}',
+        'plan_code': row.get('plan_code') or 'start',
+        'status': row.get('status') or 'trial',
+        **{name: row.get(name, '') for name in USER_FIELDS + COMPANY_FIELDS},
+    }
+    if client['plan_code'] not in dict(Subscription.PLAN_CHOICES):
+        raise ValueError(f"Unknown plan_code: {client['plan_code']}")
+    if client['status'] not in dict(Subscription.STATUS_CHOICES):
+        raise ValueError(f"Unknown status: {client['status']}")
+    # bulk_create does not validate: too long a value would fail the whole chunk
+    for model, name, key in _length_checks():
+        max_length = model._meta.get_field(name).max_length
+        if max_length and len(client[key]) > max_length:
+            raise ValueError(f'{key} is longer than {max_length} characters')
+    return client
+
+
+def _length_checks():
+    # (model, field, key of the client)
+    return (
+        [(get_user_model(), name, name) for name in ('email',) + USER_FIELDS]
+        + [(Profile, 'position', 'position'), (Company, 'name', 'company_name')]
+        + [(Company, name, name) for name in COMPANY_FIELDS]
+    )
+
+
+def _create(chunk):
+    """Creates the clients of a chunk whose email has no user yet; returns how many."""
+    User = get_user_model()
+    batch_size = settings.CORE_ONBOARDING['batch_size']
+    for attempt in range(2):
+        existing = set(User.objects.filter(email__in=[c['email'] for c in chunk]).values_list('email', flat=True))
+        new = []
+        for client in chunk:
+            if client['email'] not in existing:
+                existing.add(client['email'])  # the same email twice in the file
+                new.append(client)
+        if not new:
+            return 0
+        hashes = _hash([client['password'] for client in new])
+        try:
+            with transaction.atomic():
+                users = User.objects.bulk_create([
+                    User(email=c['email'], password=password or make_password(None), role='client',
+                         **{name: c[name] for name in USER_FIELDS})
+                    for c, password in zip(new, hashes)
+                ], batch_size=batch_size)
+                Profile.objects.bulk_create([
+                    Profile(user=user, position=c['position']) for c, user in zip(new, users)
+                ], batch_size=batch_size)
+                companies = Company.objects.bulk_create([
+                    Company(owner=user, name=c['company_name'], **{name: c[name] for name in COMPANY_FIELDS})
+                    for c, user in zip(new, users)
+                ], batch_size=batch_size)
+                Subscription.objects.bulk_create([
+                    Subscription(company=company, plan_code=c['plan_code'], status=c['status'],
+                                 limits=Subscription.limits_for(c['plan_code'], c['status']),
+                                 usage=dict(Subscription.TRIAL_USAGE))
+                    for c, company in zip(new, companies)
+                ], batch_size=batch_size)
+        except IntegrityError:
+            # Another import created some of these emails meanwhile: look again
+            if attempt:
+                raise
+            continue
+        return len(new)
+
+
+def _hash(passwords):
+    """Hashes of `passwords` (None for none) in the process pool, in batches."""
+    hasher = type(get_hasher())
+    path = f'{hasher.__module__}.{hasher.__qualname__}'
+    size = settings.CORE_ONBOARDING['hash_batch_size']
+    batches = [(start, (path, passwords[start:start + size])) for start in range(0, len(passwords), size)]
+    hashes = []
+    for start, result, error in jobs.run_batch(workers.hash_passwords, batches):
+        if error is not None:
+            raise error
+        hashes.extend(result)
+    return hashes
@@ -0,0 +1,99 @@
+"""
+Subscription quotas, counted per (company, resource, period) in
+QuotaCounter rows.
+
+consume() is a single conditional UPDATE (used = used + n WHERE used + n
+<= limit), so concurrent requests can neither overshoot a limit nor lose
+an increment, and the Subscription JSON is never rewritten. A period's
+rows are created on first use with the limits copied from
+Subscription.limits, which resets the counters lazily; the first period
+a company is counted in starts from what Subscription.usage already
+recorded, so switching to counters does not hand out a fresh quota.
+Reading what is left only touches the counter rows. Changing a subscription updates the
+limits of the current period (see signals).
+"""
+from django.db.models import F, Q
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from .models import QuotaCounter, Subscription
+
+RESOURCES = ('requests', 'consultations')
+
+
+class QuotaExceeded(APIException):
+    status_code = status.HTTP_403_FORBIDDEN
+    default_detail = 'Quota of your plan is exceeded'
+    default_code = 'quota_exceeded'
+
+    def __init__(self, resource):
+        super().__init__(f'The {resource} quota of your plan is used up for this month')
+        self.resource = resource
+
+
+def period_start(today=None):
+    return (today or timezone.localdate()).replace(day=1)
+
+
+def consume(company_id, resource, amount=1):
+    """Uses `amount` of the resource, or raises QuotaExceeded. Call it in the transaction that creates the thing counted."""
+    period = period_start()
+    counters = QuotaCounter.objects.filter(
+        Q(limit__isnull=True) | Q(limit__gte=F('used') + amount),
+        company_id=company_id, resource=resource, period_start=period,
+    )
+    if counters.update(used=F('used') + amount):
+        return
+    # First use in this period, or used up
+    if not _open_period(company_id, period) or not counters.update(used=F('used') + amount):
+        raise QuotaExceeded(resource)
+
+
+def usage(company_id):
+    """{resource: (used, limit)} of the current period; limit None is unlimited."""
+    period = period_start()
+    current = {
+        resource: (used, limit) for resource, used, limit in
+        QuotaCounter.objects.filter(company_id=company_id, period_start=period).values_list('resource', 'used', 'limit')
+    }
+    if len(current) < len(RESOURCES) and _open_period(company_id, period):
+        return usage(company_id)
+    return current
+
+
+def remaining(company_id):
+    """{resource: what is left this period}; None is unlimited."""
+    return {
+        resource: None if limit is None else max(limit - used, 0)
+        for resource, (used, limit) in usage(company_id).items()
+    }
+
+
+def sync_limits(subscription):
+    """Applies the subscription's limits to the current period."""
+    for resource in RESOURCES:
+        QuotaCounter.objects.filter(
+            company_id=subscription.company_id, resource=resource, period_start=period_start(),
+        ).update(limit=subscription.limits.get(resource))
+
+
+def _open_period(company_id, period):
+    """Creates the period's missing counters; False if there were none to create."""
+    existing = set(
+        QuotaCounter.objects.filter(company_id=company_id, period_start=period).values_list('resource', flat=True)
+    )
+    missing = [resource for resource in RESOURCES if resource not in existing]
+    if not missing:
+        return False
+    limits, used = Subscription.objects.filter(company_id=company_id).values_list('limits', 'usage').first() or ({}, {})
+    # Usage recorded before the company had counters belongs to this period; later periods start at 0
+    counted = set(
+        QuotaCounter.objects.filter(company_id=company_id, resource__in=missing).values_list('resource', flat=True).distinct()
+    )
+    QuotaCounter.objects.bulk_create([
+        QuotaCounter(company_id=company_id, resource=resource, period_start=period, limit=limits.get(resource),
+                     used=0 if resource in counted else int((used or {}).get(resource) or 0))
+        for resource in missing
+    ], ignore_conflicts=True)
+    return True
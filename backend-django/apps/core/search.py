@@ -0,0 +1,356 @@
+"""
+Full-text search shared by the cabinet apps.
+
+`FullTextIndex` keeps a company-scoped inverted index over one text column:
+an FTS5 virtual table when running on SQLite, a GIN expression index over
+to_tsvector('russian', ...) on PostgreSQL. On SQLite words are reduced with
+the Snowball Russian stemmer below before indexing, so "договора",
+"договоров" and "договором" all find each other, as they do on PostgreSQL.
+"""
+import re
+
+from django.db import connection
+from django.db.models import F
+from django.utils.html import escape
+
+WORD_RE = re.compile(r'\w+')
+CYRILLIC_RE = re.compile(r'^[а-я]+$')
+
+# Snowball Russian stemmer, https://snowballstem.org/algorithms/russian/stemmer.html
+_VOWELS = 'аеиоуыэюя'
+_PERFECTIVE_GERUND = (
+    ('в', 'вши', 'вшись'),
+    ('ив', 'ивши', 'ившись', 'ыв', 'ывши', 'ывшись'),
+)
+_ADJECTIVE = (
+    'ее', 'ие', 'ые', 'ое', 'ими', 'ыми', 'ей', 'ий', 'ый', 'ой', 'ем', 'им', 'ым', 'ом',
+    'его', 'ого', 'ему', 'ому', 'их', 'ых', 'ую', 'юю', 'ая', 'яя', 'ою', 'ею',
+)
+_PARTICIPLE = (
+    ('ем', 'нн', 'вш', 'ющ', 'щ'),
+    ('ивш', 'ывш', 'ующ'),
+)
+_REFLEXIVE = ('ся', 'сь')
+_VERB = (
+    ('ла', 'на', 'ете', 'йте', 'ли', 'й', 'л', 'ем', 'н', 'ло', 'но', 'ет', 'ют', 'ны', 'ть', 'ешь', 'нно'),
+    ('ила', 'ыла', 'ена', 'ейте', 'уйте', 'ите', 'или', 'ыли', 'ей', 'уй', 'ил', 'ыл', 'им', 'ым', 'ен',
+     'ило', 'ыло', 'ено', 'ят', 'ует', 'уют', 'ит', 'ыт', 'ены', 'ить', 'ыть', 'ишь', 'ую', 'ю'),
+)
+_NOUN = (
+    'а', 'ев', 'ов', 'ие', 'ье', 'е', 'иями', 'ями', 'ами', 'еи', 'ии', 'и', 'ией', 'ей', 'ой', 'ий', 'й',
+    'иям', 'ям', 'ием', 'ем', 'ам', 'ом', 'о', 'у', 'ах', 'иях', 'ях', 'ы', 'ь', 'ию', 'ью', 'ю', 'ия', 'ья', 'я',
+)
+_DERIVATIONAL = ('ост', 'ость')
+_TIDY_UP = ('ейш', 'ейше', 'н', 'ь')
+
+
+def _regions(word):
+    rv = p1 = p2 = len(word)
+    for i, char in enumerate(word):
+        if char in _VOWELS:
+            rv = i + 1
+            break
+    for i in range(1, len(word)):
+        if word[i] not in _VOWELS and word[i - 1] in _VOWELS:
+            p1 = i + 1
+            break
+    for i in range(p1 + 1, len(word)):
+        if word[i] not in _VOWELS and word[i - 1] in _VOWELS:
+            p2 = i + 1
+            break
+    return rv, p2
+
+
+def _longest_suffix(word, start, suffixes):
+    best = None
+    for suffix in suffixes:
+        if word.endswith(suffix) and len(word) - len(suffix) >= start:
+            if best is None or len(suffix) > len(best):
+                best = suffix
+    return best
+
+
+def _remove_grouped(word, start, groups):
+    """Group 1 endings only count after 'а'/'я', which is kept."""
+    first, second = groups
+    suffix = _longest_suffix(word, start, first + second)
+    if suffix is None:
+        return None
+    cut = len(word) - len(suffix)
+    if suffix in first and (cut - 1 < start or word[cut - 1] not in 'ая'):
+        return None
+    return word[:cut]
+
+
+def _remove_adjectival(word, start):
+    suffix = _longest_suffix(word, start, _ADJECTIVE)
+    if suffix is None:
+        return None
+    word = word[:-len(suffix)]
+    without_participle = _remove_grouped(word, start, _PARTICIPLE)
+    return word if without_participle is None else without_participle
+
+
+def stem(word):
+    word = word.lower().replace('ё', 'е')
+    if not CYRILLIC_RE.match(word):
+        return word
+    rv, p2 = _regions(word)
+
+    stemmed = _remove_grouped(word, rv, _PERFECTIVE_GERUND)
+    if stemmed is None:
+        reflexive = _longest_suffix(word, rv, _REFLEXIVE)
+        if reflexive:
+            word = word[:-len(reflexive)]
+        stemmed = _remove_adjectival(word, rv)
+        if stemmed is None:
+            stemmed = _remove_grouped(word, rv, _VERB)
+        if stemmed is None:
+            noun = _longest_suffix(word, rv, _NOUN)
+            stemmed = word[:-len(noun)] if noun else word
+    word = stemmed
+
+    if word.endswith('и') and len(word) - 1 >= rv:
+        word = word[:-1]
+
+    derivational = _longest_suffix(word, p2, _DERIVATIONAL)
+    if derivational:
+        word = word[:-len(derivational)]
+
+    tidy = _longest_suffix(word, rv, _TIDY_UP)
+    if tidy in ('ейш', 'ейше'):
+        word = word[:-len(tidy)]
+        if word.endswith('нн') and len(word) - 2 >= rv:
+            word = word[:-1]
+    elif tidy == 'н':
+        if word.endswith('нн') and len(word) - 2 >= rv:
+            word = word[:-1]
+    elif tidy == 'ь':
+        word = word[:-1]
+    return word
+
+
+def query_stems(query):
+    return [stem(word) for word in WORD_RE.findall(query)]
+
+
+def normalize(text):
+    """Text as it goes into the SQLite index: space-separated stems."""
+    return ' '.join(stem(word) for word in WORD_RE.findall(text or ''))
+
+
+def highlight(text, query, max_words=30):
+    """
+    HTML-escaped snippet of `text` around the first match of `query`, with
+    matching words wrapped in <mark>. Safe to render as HTML.
+    """
+    stems = [s for s in query_stems(query) if s]
+    words = list(WORD_RE.finditer(text or ''))
+    if not words:
+        return escape(text or '')
+
+    def matches(match):
+        word_stem = stem(match.group())
+        return any(word_stem.startswith(s) for s in stems)
+
+    first = next((i for i, word in enumerate(words) if matches(word)), 0)
+    start = max(0, first - max_words // 3)
+    end = min(len(words), start + max_words)
+
+    parts = ['…' if start > 0 else '']
+    position = words[start].start()
+    for word in words[start:end]:
+        parts.append(escape(text[position:word.start()]))
+        if matches(word):
+            parts.append(f'<mark>{escape(word.group())}</mark>')
+        else:
+            parts.append(escape(word.group()))
+        position = word.end()
+    if end < len(words):
+        parts.append('…')
+    else:
+        parts.append(escape(text[position:]))
+    return ''.join(parts)
+
+
+class SearchResults:
+    """
+    Lazy, sliceable list of (object, rank) pairs. Paginators only ever ask
+    for the count and one slice, so only one page is fetched.
+    """
+
+    def __init__(self, index, company_id, query):
+        self.index = index
+        self.company_id = company_id
+        self.query = query
+        self._count = None
+
+    def count(self):
+        if self._count is None:
+            self._count = self.index.count(self.company_id, self.query)
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice):
+            return self[item:item + 1][0]
+        start = item.start or 0
+        stop = item.stop if item.stop is not None else self.count()
+        return self.index.fetch(self.company_id, self.query, start, stop - start)
+
+
+class FullTextIndex:
+    """
+    Company-scoped full-text index over `model.<text_field>`.
+
+    On PostgreSQL the index is a GIN expression index maintained by the
+    database itself. On SQLite it is a separate FTS5 table keyed by the
+    object's pk that has to be fed through index()/remove() (see the
+    model signals) or rebuilt with rebuild().
+    """
+    config = 'russian'
+
+    def __init__(self, model, text_field, company_field, table, select_related=()):
+        self.model = model
+        self.text_field = text_field
+        self.company_field = company_field
+        self.table = table
+        self.select_related = select_related
+
+    def get_queryset(self):
+        queryset = self.model.objects.all()
+        if self.select_related:
+            queryset = queryset.select_related(*self.select_related)
+        return queryset
+
+    @property
+    def is_postgres(self):
+        return connection.vendor == 'postgresql'
+
+    @property
+    def is_sqlite(self):
+        return connection.vendor == 'sqlite'
+
+    # Schema, used from migrations through RunPython
+
+    def create(self, schema_editor, model=None):
+        model = model or self.model
+        if schema_editor.connection.vendor == 'sqlite':
+            schema_editor.execute(
+                f'CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} USING fts5('
+                f'body, company_id UNINDEXED, tokenize="unicode61 remove_diacritics 2")'
+            )
+        elif schema_editor.connection.vendor == 'postgresql':
+            schema_editor.add_index(model, self._gin_index())
+
+    def drop(self, schema_editor, model=None):
+        model = model or self.model
+        if schema_editor.connection.vendor == 'sqlite':
+            schema_editor.execute(f'DROP TABLE IF EXISTS {self.table}')
+        elif schema_editor.connection.vendor == 'postgresql':
+            schema_editor.remove_index(model, self._gin_index())
+
+    def _gin_index(self):
+        from django.contrib.postgres.indexes import GinIndex
+        from django.contrib.postgres.search import SearchVector
+        return GinIndex(SearchVector(self.text_field, config=self.config), name=f'{self.table}_idx')
+
+    # Maintenance
+
+    def index(self, pk, text, company_id):
+        if not self.is_sqlite:
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT OR REPLACE INTO {self.table} (rowid, body, company_id) VALUES (%s, %s, %s)',
+                [pk, normalize(text), company_id],
+            )
+
+    def remove(self, pk):
+        if not self.is_sqlite:
+            return
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table} WHERE rowid = %s', [pk])
+
+    def rebuild(self, batch_size=1000, queryset=None):
+        """Re-index everything in pk order, one batch per round trip. Yields progress."""
+        if not self.is_sqlite:
+            return
+        queryset = queryset if queryset is not None else self.model.objects.all()
+        rows = queryset.order_by('pk').values_list('pk', self.text_field, self.company_field)
+
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table}')
+
+        done, last_pk = 0, None
+        while True:
+            batch = rows.filter(pk__gt=last_pk) if last_pk is not None else rows
+            batch = list(batch[:batch_size])
+            if not batch:
+                break
+            with connection.cursor() as cursor:
+                cursor.executemany(
+                    f'INSERT INTO {self.table} (rowid, body, company_id) VALUES (%s, %s, %s)',
+                    [(pk, normalize(text), company_id) for pk, text, company_id in batch],
+                )
+            done += len(batch)
+            last_pk = batch[-1][0]
+            yield done
+
+    # Queries
+
+    def search(self, company_id, query):
+        return SearchResults(self, company_id, query)
+
+    def match_expression(self, query):
+        """FTS5 MATCH: every word must be present, each as a stem prefix."""
+        stems = [s for s in query_stems(query) if s]
+        return ' '.join(f'"{s}"*' for s in stems)
+
+    def count(self, company_id, query):
+        if self.is_postgres:
+            return self._pg_queryset(company_id, query).count()
+        match = self.match_expression(query)
+        if not match:
+            return 0
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'SELECT COUNT(*) FROM {self.table} WHERE {self.table} MATCH %s AND company_id = %s',
+                [match, company_id],
+            )
+            return cursor.fetchone()[0]
+
+    def fetch(self, company_id, query, offset, limit):
+        if limit <= 0:
+            return []
+        if self.is_postgres:
+            return [(obj, obj.rank) for obj in self._pg_queryset(company_id, query)[offset:offset + limit]]
+
+        match = self.match_expression(query)
+        if not match:
+            return []
+        with connection.cursor() as cursor:
+            # bm25() is lower-is-better
+            cursor.execute(
+                f'SELECT rowid, bm25({self.table}) AS rank FROM {self.table} '
+                f'WHERE {self.table} MATCH %s AND company_id = %s '
+                f'ORDER BY rank, rowid DESC LIMIT %s OFFSET %s',
+                [match, company_id, limit, offset],
+            )
+            ranked = cursor.fetchall()
+        objects = self.get_queryset().in_bulk([pk for pk, rank in ranked])
+        return [(objects[pk], -rank) for pk, rank in ranked if pk in objects]
+
+    def _pg_queryset(self, company_id, query):
+        from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVector
+        search_query = SearchQuery(query, config=self.config, search_type='websearch')
+        return self.get_queryset().annotate(
+            search_vector=SearchVector(self.text_field, config=self.config),
+        ).filter(
+            **{self.company_field: company_id},
+            search_vector=search_query,
+        ).annotate(
+            rank=SearchRank(F('search_vector'), search_query),
+        ).order_by('-rank', '-pk')
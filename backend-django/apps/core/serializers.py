@@ -2,19 +2,31 @@ from djoser.serializers import UserCreateSerializer as BaseUserCreateSerializer
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
 from .models import Profile, Company, Subscription
+from . import avatars
 
 User = get_user_model()
 
 class ProfileSerializer(serializers.ModelSerializer):
+    avatar_renditions = serializers.SerializerMethodField()
+
     class Meta:
         model = Profile
-        fields = ('position', 'avatar')
+        fields = ('position', 'avatar', 'avatar_renditions')
+
+    def get_avatar_renditions(self, obj):
+        return avatars.urls(obj.avatar_hash, self.context.get('request'))
 
 class SubscriptionSerializer(serializers.ModelSerializer):
     class Meta:
         model = Subscription
         fields = '__all__'
 
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        # Storage usage is counted in Company.storage_used, not in the JSON
+        data['usage'] = dict(data['usage'] or {}, storage_gb=round(instance.company.storage_used / 1024 ** 3, 3))
+        return data
+
 class CompanySerializer(serializers.ModelSerializer):
     subscription = SubscriptionSerializer(read_only=True)
     
@@ -37,6 +49,9 @@ class UserSerializer(serializers.ModelSerializer):
         fields = ('id', 'email', 'first_name', 'last_name', 'phone', 'role', 'profile', 'company', 'subscription_status')
 
     def get_subscription_status(self, obj):
+        account = getattr(obj, 'cached_account', None) # a user from usercache has it
+        if account is not None:
+            return account['subscription_status']
         if hasattr(obj, 'company') and hasattr(obj.company, 'subscription'):
             return obj.company.subscription.status
         return None
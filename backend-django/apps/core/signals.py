@@ -1,7 +1,8 @@
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, pre_save, post_save
 from django.dispatch import receiver
 from django.contrib.auth import get_user_model
 from .models import Profile, Company, Subscription
+from . import avatars, quotas, usercache
 
 User = get_user_model()
 
@@ -22,6 +23,58 @@ def create_related_models(sender, instance, created, **kwargs):
             company=company,
             plan_code='start',
             status='trial',
-            limits={'requests': 3, 'consultations': 1, 'storage_gb': 1},
-            usage={'requests': 0, 'consultations': 0, 'storage_gb': 0}
+            limits=dict(Subscription.TRIAL_LIMITS),
+            usage=dict(Subscription.TRIAL_USAGE)
         )
+
+@receiver(pre_save, sender=Profile)
+def remember_avatar(sender, instance, update_fields=None, **kwargs):
+    instance._previous_avatar = None
+    if update_fields is not None and 'avatar' not in update_fields:
+        instance._previous_avatar = (instance.avatar.name, instance.avatar_hash)
+    elif instance.pk:
+        instance._previous_avatar = Profile.objects.filter(pk=instance.pk).values_list('avatar', 'avatar_hash').first()
+
+@receiver(post_save, sender=Profile)
+def render_avatar(sender, instance, **kwargs):
+    # Resized copies for a new photo; the old ones go unless shared
+    previous_name, previous_hash = getattr(instance, '_previous_avatar', None) or ('', '')
+    name = instance.avatar.name if instance.avatar else ''
+    if name == (previous_name or ''):
+        return
+    instance.avatar_hash = avatars.generate(instance.avatar) if name else ''
+    Profile.objects.filter(pk=instance.pk).update(avatar_hash=instance.avatar_hash)
+    if previous_hash and previous_hash != instance.avatar_hash \
+            and not Profile.objects.filter(avatar_hash=previous_hash).exists():
+        avatars.discard(previous_hash)
+
+@receiver(post_save, sender=Subscription)
+def apply_quota_limits(sender, instance, created, **kwargs):
+    # New subscriptions have no counters yet; they copy the limits on first use
+    if not created:
+        quotas.sync_limits(instance)
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def drop_cached_user(sender, instance, **kwargs):
+    usercache.invalidate(instance.pk)
+
+@receiver(post_save, sender=Profile)
+@receiver(post_delete, sender=Profile)
+def drop_cached_profile(sender, instance, **kwargs):
+    # usercache keeps the profile with its user
+    usercache.invalidate(instance.user_id)
+
+@receiver(post_save, sender=Company)
+@receiver(post_delete, sender=Company)
+def drop_cached_owner(sender, instance, **kwargs):
+    # usercache keeps the company's plan with its owner, and access tokens
+    # are checked against it (apps.core.authentication)
+    usercache.invalidate(instance.owner_id)
+
+@receiver(post_save, sender=Subscription)
+@receiver(post_delete, sender=Subscription)
+def drop_cached_subscriber(sender, instance, **kwargs):
+    owner_id = Company.objects.filter(pk=instance.company_id).values_list('owner_id', flat=True).first()
+    if owner_id is not None:
+        usercache.invalidate(owner_id)
@@ -1,3 +1,420 @@
-from django.test import TestCase
+import csv
+import json
+import os
+import shutil
+import tempfile
+from datetime import date
+from io import BytesIO, StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.files.storage import default_storage
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from rest_framework import status
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from . import avatars, onboarding, quotas, usercache
+from .models import Company, Profile, QuotaCounter, Subscription
+
+User = get_user_model()
+
+
+def image_bytes(size=(1200, 800), fmt='JPEG', color=(200, 30, 30)):
+    out = BytesIO()
+    Image.new('RGB', size, color).save(out, fmt)
+    return out.getvalue()
+
+
+class AvatarRenditionsTest(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        settings_override = override_settings(MEDIA_ROOT=self.tmp, AVATAR_RENDITION_SIZES=(32, 64, 256))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.user = User.objects.create_user(email='avatar@example.com', password='testpassword123')
+        self.profile = self.user.profile
+
+    def set_avatar(self, profile, data, name='photo.jpg'):
+        profile.avatar.save(name, ContentFile(data))
+        profile.refresh_from_db()
+        return profile
+
+    def test_renditions_are_square_and_content_hashed(self):
+        profile = self.set_avatar(self.profile, image_bytes())
+        self.assertEqual(len(profile.avatar_hash), 32)
+        for size in (32, 64, 256):
+            for fmt, pillow_format in (('webp', 'WEBP'), ('jpeg', 'JPEG')):
+                name = avatars.rendition_name(profile.avatar_hash, size, fmt)
+                self.assertTrue(name.startswith(f'avatars/r/{profile.avatar_hash}-{size}.'))
+                with default_storage.open(name) as f, Image.open(f) as image:
+                    self.assertEqual(image.size, (size, size))
+                    self.assertEqual(image.format, pillow_format)
+
+        # Same photo for someone else: same names, nothing rendered again
+        other = User.objects.create_user(email='other@example.com', password='testpassword123').profile
+        name = avatars.rendition_name(profile.avatar_hash, 32, 'webp')
+        mtime = os.path.getmtime(default_storage.path(name))
+        other = self.set_avatar(other, image_bytes())
+        self.assertEqual(other.avatar_hash, profile.avatar_hash)
+        self.assertEqual(os.path.getmtime(default_storage.path(name)), mtime)
+
+    def test_transparent_png_gets_flattened_jpeg(self):
+        out = BytesIO()
+        Image.new('RGBA', (300, 300), (0, 0, 0, 0)).save(out, 'PNG')
+        profile = self.set_avatar(self.profile, out.getvalue(), 'photo.png')
+        with default_storage.open(avatars.rendition_name(profile.avatar_hash, 64, 'jpeg')) as f, Image.open(f) as image:
+            self.assertEqual(image.mode, 'RGB')
+            self.assertEqual(image.getpixel((10, 10)), (255, 255, 255))
+
+    def test_replaced_avatar_drops_unshared_renditions(self):
+        first = self.set_avatar(self.profile, image_bytes()).avatar_hash
+        other = User.objects.create_user(email='other@example.com', password='testpassword123').profile
+        second = self.set_avatar(other, image_bytes(color=(0, 0, 255))).avatar_hash
+
+        self.set_avatar(other, image_bytes(color=(0, 255, 0)))
+        self.assertFalse(default_storage.exists(avatars.rendition_name(second, 32, 'webp')))
+
+        # Still used by the first profile
+        other.avatar.save('photo.jpg', ContentFile(image_bytes()))
+        self.set_avatar(self.profile, image_bytes(color=(9, 9, 9)))
+        self.assertTrue(default_storage.exists(avatars.rendition_name(first, 32, 'webp')))
+
+        self.profile.avatar = None
+        self.profile.save()
+        self.profile.refresh_from_db()
+        self.assertEqual(self.profile.avatar_hash, '')
+
+    def test_unreadable_image_has_no_renditions(self):
+        with self.assertLogs('apps.core.avatars', level='WARNING'):
+            profile = self.set_avatar(self.profile, b'not an image')
+        self.assertEqual(profile.avatar_hash, '')
+
+    def test_user_serializer_returns_srcset_map(self):
+        profile = self.set_avatar(self.profile, image_bytes())
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        response = client.get('/api/auth/users/me/')
+        renditions = response.data['profile']['avatar_renditions']
+        self.assertEqual(set(renditions['webp']), {'32', '64', '256'})
+        url = renditions['webp']['32']
+        self.assertTrue(url.startswith('http://testserver/media/avatars/r/'))
+        self.assertTrue(url.endswith(f'{profile.avatar_hash}-32.webp'))
+        self.assertEqual(renditions['srcset']['jpeg'].split(', ')[0], renditions['jpeg']['32'] + ' 32w')
+
+        other = User.objects.create_user(email='other@example.com', password='testpassword123')
+        client.force_authenticate(user=other)
+        self.assertIsNone(client.get('/api/auth/users/me/').data['profile']['avatar_renditions'])
+
+    def test_render_avatars_backfills_existing_photos(self):
+        self.profile.avatar.save('photo.jpg', ContentFile(image_bytes()))
+        Profile.objects.filter(pk=self.profile.pk).update(avatar_hash='')
+        call_command('render_avatars', stdout=StringIO())
+        self.profile.refresh_from_db()
+        self.assertTrue(default_storage.exists(avatars.rendition_name(self.profile.avatar_hash, 256, 'jpeg')))
+
+
+class QuotaTest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.user = User.objects.create_user(email='client@example.com', password='testpassword123')
+        self.client.force_authenticate(user=self.user)
+        self.company = self.user.company # trial limits: 3 requests, 1 consultation
+
+    def create_request(self, service_type='contract'):
+        return self.client.post('/api/cabinet/requests/', {'title': 'Help', 'service_type': service_type})
+
+    def test_requests_stop_at_the_limit(self):
+        for _ in range(3):
+            self.assertEqual(self.create_request().status_code, status.HTTP_201_CREATED)
+        response = self.create_request()
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(response.data['detail'].code, 'quota_exceeded')
+        self.assertEqual(self.company.requests.count(), 3)
+        self.assertEqual(quotas.remaining(self.company.pk), {'requests': 0, 'consultations': 1})
+
+    def test_refused_consultation_uses_no_request(self):
+        self.assertEqual(self.create_request('consultation').status_code, status.HTTP_201_CREATED)
+        self.assertEqual(self.create_request('consultation').status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(quotas.usage(self.company.pk), {'requests': (1, 3), 'consultations': (1, 1)})
+
+    def test_consume_is_one_statement_once_the_period_is_open(self):
+        quotas.consume(self.company.pk, 'requests')
+        with self.assertNumQueries(1):
+            quotas.consume(self.company.pk, 'requests')
+        with self.assertNumQueries(1):
+            self.assertEqual(quotas.remaining(self.company.pk)['requests'], 1)
+
+    def test_periods_reset_lazily(self):
+        for _ in range(3):
+            quotas.consume(self.company.pk, 'requests')
+        with mock.patch('apps.core.quotas.timezone.localdate', return_value=date(2099, 1, 15)):
+            quotas.consume(self.company.pk, 'requests')
+            self.assertEqual(quotas.remaining(self.company.pk)['requests'], 2)
+        self.assertEqual(QuotaCounter.objects.filter(resource='requests').count(), 2)
+
+    def test_first_period_starts_from_recorded_usage(self):
+        Subscription.objects.filter(company=self.company).update(usage={'requests': 2, 'consultations': 0, 'storage_gb': 0})
+        self.assertEqual(quotas.remaining(self.company.pk), {'requests': 1, 'consultations': 1})
+        quotas.consume(self.company.pk, 'requests')
+        with self.assertRaises(quotas.QuotaExceeded):
+            quotas.consume(self.company.pk, 'requests')
+        with mock.patch('apps.core.quotas.timezone.localdate', return_value=date(2099, 1, 15)):
+            self.assertEqual(quotas.remaining(self.company.pk)['requests'], 3)
+
+    def test_limit_changes_apply_to_the_current_period(self):
+        quotas.consume(self.company.pk, 'consultations')
+        subscription = self.company.subscription
+        subscription.limits = dict(subscription.limits, consultations=5, requests=None)
+        subscription.save()
+        self.assertEqual(quotas.remaining(self.company.pk), {'requests': None, 'consultations': 4})
+
+
+class ClaimsTokenTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        usercache.clear_local()
+        self.user = User.objects.create_user(email='claims@example.com', password='secret-pass-1')
+        self.company = self.user.company
+        self.client = APIClient()
+
+    def obtain(self):
+        response = self.client.post(
+            '/api/auth/jwt/create/', {'email': 'claims@example.com', 'password': 'secret-pass-1'}, format='json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def get(self, url, access):
+        return self.client.get(url, HTTP_AUTHORIZATION=f'Bearer {access}')
+
+    def test_access_token_carries_claims(self):
+        access = AccessToken(self.obtain()['access'])
+        subscription = self.company.subscription
+        self.assertEqual(access['role'], 'client')
+        self.assertEqual(access['company_id'], self.company.pk)
+        self.assertEqual(access['plan_code'], subscription.plan_code)
+        self.assertEqual(access['subscription_status'], subscription.status)
+
+    def test_listing_needs_no_user_query_once_cached(self):
+        access = self.obtain()['access']
+        self.get('/api/cabinet/requests/', access)
+        with self.assertNumQueries(1):
+            response = self.get('/api/cabinet/requests/', access)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        me = self.get('/api/auth/users/me/', access)
+        self.assertEqual(me.data['email'], 'claims@example.com')
+
+    def test_plan_change_forces_a_refresh(self):
+        tokens = self.obtain()
+        subscription = self.company.subscription
+        subscription.plan_code = 'business'
+        subscription.save()
+        self.assertEqual(self.get('/api/cabinet/requests/', tokens['access']).status_code, status.HTTP_401_UNAUTHORIZED)
+
+        response = self.client.post('/api/auth/jwt/refresh/', {'refresh': tokens['refresh']}, format='json')
+        access = response.data['access']
+        self.assertEqual(AccessToken(access)['plan_code'], 'business')
+        self.assertEqual(self.get('/api/cabinet/requests/', access).status_code, status.HTTP_200_OK)
+
+    def test_role_change_forces_a_refresh(self):
+        access = self.obtain()['access']
+        self.get('/api/cabinet/requests/', access)
+        User.objects.filter(pk=self.user.pk).update(role='lawyer')
+        usercache.invalidate(self.user.pk)  # what saving the user does
+        self.assertEqual(self.get('/api/cabinet/requests/', access).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_inactive_users_are_refused(self):
+        access = self.obtain()['access']
+        self.get('/api/cabinet/requests/', access)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.get('/api/cabinet/requests/', access).status_code, status.HTTP_401_UNAUTHORIZED)
+        self.user.delete()
+        self.assertEqual(self.get('/api/cabinet/requests/', access).status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_unrelated_saves_keep_tokens_valid(self):
+        access = self.obtain()['access']
+        self.user.phone = '+7 900 000-00-00'
+        self.user.save()
+        self.assertEqual(self.get('/api/cabinet/requests/', access).status_code, status.HTTP_200_OK)
+
+    def test_tokens_without_claims_still_work(self):
+        access = str(AccessToken.for_user(self.user))
+        self.assertEqual(self.get('/api/cabinet/requests/', access).status_code, status.HTTP_200_OK)
+
+
+class UserCacheTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        usercache.clear_local()
+        usercache.reset_stats()
+        self.user = User.objects.create_user(email='cached@example.com', password='secret-pass-1', first_name='Ivan')
+        self.access = str(AccessToken.for_user(self.user))  # no claims: the user is needed
+        self.client = APIClient()
+
+    def me(self):
+        return self.client.get('/api/auth/users/me/', HTTP_AUTHORIZATION=f'Bearer {self.access}')
+
+    def test_tiers(self):
+        with self.assertNumQueries(1):
+            user = usercache.get(self.user.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(usercache.get(self.user.pk).email, 'cached@example.com')
+            usercache.clear_local()
+            self.assertEqual(usercache.get(self.user.pk).profile.user_id, self.user.pk)
+        self.assertEqual(usercache.stats(), {'local_hits': 1, 'shared_hits': 1, 'misses': 1})
+        self.assertIn('date_joined', user.get_deferred_fields())
+        self.assertIsNone(usercache.get(self.user.pk + 1000))
+
+    def test_requests_after_the_first_do_not_load_the_user(self):
+        self.assertEqual(self.me().status_code, status.HTTP_200_OK)
+        # Company, then its subscription, for the serializer
+        with self.assertNumQueries(2):
+            response = self.me()
+        self.assertEqual(response.data['first_name'], 'Ivan')
+        self.assertEqual(usercache.stats()['misses'], 1)
+
+    def test_user_and_profile_saves_invalidate(self):
+        self.me()
+        self.user.first_name = 'Petr'
+        self.user.save()
+        profile = self.user.profile
+        profile.position = 'Director'
+        profile.save()
+        response = self.me()
+        self.assertEqual(response.data['first_name'], 'Petr')
+        self.assertEqual(response.data['profile']['position'], 'Director')
+
+    def test_inactive_users_are_refused(self):
+        self.me()
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertEqual(self.me().status_code, status.HTTP_200_OK)  # until the entry expires or is dropped
+        usercache.invalidate(self.user.pk)
+        self.assertEqual(self.me().status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_stats_command(self):
+        self.me()
+        self.me()
+        out = StringIO()
+        call_command('user_cache_stats', '--reset', stdout=out)
+        self.assertIn('Hit rate: 50.0% of 2 lookups', out.getvalue())
+        self.assertEqual(usercache.stats(), {'local_hits': 0, 'shared_hits': 0, 'misses': 0})
+
+
+@override_settings(CABINET_WORKERS=0, PASSWORD_HASHERS=['django.contrib.auth.hashers.MD5PasswordHasher'])
+class OnboardingTest(TestCase):
+    CSV = (
+        'email,password,first_name,company_name,inn,plan_code\n'
+        'one@example.com,secret-1,Anna,Alpha LLC,7701234567,pro\n'
+        'two@EXAMPLE.com,,Boris,,,\n'
+        'not-an-email,x,,,,\n'
+        'three@example.com,secret-3,,,,gold\n'
+    )
+
+    def onboard(self, data, format='csv', **kwargs):
+        return onboarding.onboard(onboarding.read(BytesIO(data.encode()), format), **kwargs)
+
+    def test_csv_creates_clients_with_company_and_subscription(self):
+        result = self.onboard(self.CSV)
+        self.assertEqual(result['created'], 2)
+        self.assertEqual(result['invalid'], 2)
+        self.assertEqual([line for line, _ in result['errors']], [4, 5])
+
+        user = User.objects.get(email='one@example.com')
+        self.assertTrue(user.check_password('secret-1'))
+        self.assertEqual(user.company.name, 'Alpha LLC')
+        self.assertEqual(user.company.subscription.plan_code, 'pro')
+        self.assertEqual(user.company.subscription.limits, Subscription.TRIAL_LIMITS)
+        self.assertTrue(Profile.objects.filter(user=user).exists())
+        other = User.objects.get(email='two@example.com')
+        self.assertFalse(other.has_usable_password())
+        self.assertEqual(other.company.name, 'Company of two@example.com')
+
+    def test_paid_plans_get_their_limits(self):
+        self.onboard('email,plan_code,status\nb@example.com,business,active\nt@example.com,business,\n')
+        paid = Subscription.objects.get(company__owner__email='b@example.com')
+        self.assertEqual(paid.limits, Subscription.PLAN_LIMITS['business'])
+        trial = Subscription.objects.get(company__owner__email='t@example.com')
+        self.assertEqual(trial.limits, Subscription.TRIAL_LIMITS)
+
+    def test_malformed_csv_stops_with_the_line(self):
+        data = 'email,company_name\nok@example.com,Alpha\nbad@example.com,' + 'x' * (csv.field_size_limit() + 1) + '\n'
+        result = self.onboard(data, chunk_size=1)
+        self.assertEqual(result['created'], 1)
+        self.assertIn('after line 2:', result['file_error'])
+
+    def test_queries_do_not_grow_with_the_number_of_clients(self):
+        def rows(prefix, n):
+            return '\n'.join(json.dumps({'email': f'{prefix}{i}@example.com', 'password': 'p'}) for i in range(n))
+
+        with CaptureQueriesContext(connection) as few:
+            self.onboard(rows('a', 2), 'jsonl')
+        with CaptureQueriesContext(connection) as many:
+            self.assertEqual(self.onboard(rows('b', 40), 'jsonl')['created'], 40)
+        self.assertEqual(len(few), len(many))
+        self.assertEqual(Subscription.objects.count(), 42)
+
+    def test_idempotent_on_email(self):
+        User.objects.create_user(email='one@example.com', password='kept')
+        data = '{"email": "one@example.com", "password": "new"}\n{"email": "four@example.com"}\n{"email": "four@example.com"}\n[1]\n'
+        first = self.onboard(data, 'jsonl', chunk_size=2)
+        self.assertEqual((first['created'], first['skipped'], first['invalid']), (1, 2, 1))
+        again = self.onboard(data, 'jsonl')
+        self.assertEqual((again['created'], again['skipped']), (0, 3))
+        self.assertTrue(User.objects.get(email='one@example.com').check_password('kept'))
+        self.assertEqual(Company.objects.filter(owner__email='four@example.com').count(), 1)
+
+    def test_passwords_are_hashed_in_the_process_pool(self):
+        with override_settings(CABINET_WORKERS=2):
+            result = self.onboard(self.CSV)
+        self.assertEqual(result['created'], 2)
+        self.assertTrue(User.objects.get(email='one@example.com').check_password('secret-1'))
+
+    def test_command(self):
+        path = os.path.join(tempfile.mkdtemp(), 'clients.csv')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(self.CSV)
+        out, err = StringIO(), StringIO()
+        call_command('onboard_clients', path, stdout=out, stderr=err)
+        self.assertIn('2 clients created, 0 already existed, 2 invalid', out.getvalue())
+        self.assertIn('Line 5: Unknown plan_code: gold', err.getvalue())
+
+    def test_command_reports_an_unreadable_file(self):
+        path = os.path.join(tempfile.mkdtemp(), 'clients.csv')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        with open(path, 'w', encoding='cp1251') as f:
+            f.write('email,company_name\nb@example.com,Бета\n')
+        with self.assertRaisesMessage(CommandError, 'not UTF-8'):
+            call_command('onboard_clients', path, stdout=StringIO(), stderr=StringIO())
+
+    def test_endpoint_is_staff_only(self):
+        client = APIClient()
+        upload = lambda: SimpleUploadedFile('clients.csv', self.CSV.encode(), content_type='text/csv')
+        client.force_authenticate(User.objects.create_user(email='client@example.com', password='x'))
+        self.assertEqual(client.post('/api/core/clients/import/', {'file': upload()}).status_code, status.HTTP_403_FORBIDDEN)
+
+        client.force_authenticate(User.objects.create_user(email='staff@example.com', password='x', is_staff=True))
+        response = client.post('/api/core/clients/import/', {'file': upload()})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual(response.data['errors'][0], {'line': 4, 'error': "Invalid email: 'not-an-email'"})
+
+    def test_endpoint_rejects_a_file_that_is_not_utf8(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_user(email='staff@example.com', password='x', is_staff=True))
+        data = 'email,company_name\nb@example.com,Бета\n'.encode('cp1251')
+        response = client.post('/api/core/clients/import/', {'file': SimpleUploadedFile('clients.csv', data)})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('not UTF-8', response.data['error'])
+        self.assertEqual(response.data['created'], 0)
@@ -0,0 +1,6 @@
+from django.urls import path
+from .views import ClientImportView
+
+urlpatterns = [
+    path('clients/import/', ClientImportView.as_view(), name='client-import'),
+]
@@ -0,0 +1,181 @@
+"""
+Users for authentication, read through two cache tiers instead of the
+database on every request.
+
+get() looks in a small LRU in this process first, then in the shared
+cache, and only then loads the user with its profile in one query. Only
+the fields authentication and the current-user endpoint read are loaded
+(USER_FIELDS, PROFILE_FIELDS); any other field is fetched on first use,
+as with QuerySet.only(). The same query reads the company and plan the
+access token claims are checked against, as `user.cached_account`. Each
+call returns new instances built from the cached row, so a view changing
+the user cannot affect another request.
+
+Saving or deleting a User, Profile, Company or Subscription drops the
+entry (see signals) from the shared cache and this process's LRU. Other
+processes keep their copy for at most CORE_USER_CACHE['local_ttl']
+seconds, which bounds how long a deactivated user can still authenticate
+there. That holds only if the shared cache is shared: without REDIS_URL
+it is a LocMemCache per process, and settings cap its timeout at
+local_ttl as well.
+
+Hits and misses are counted per process and added to shared counters
+every CORE_USER_CACHE['report_every'] lookups; `manage.py user_cache_stats`
+shows the totals.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import Profile
+
+USER_FIELDS = ('id', 'email', 'first_name', 'last_name', 'phone', 'role', 'is_active', 'is_staff', 'is_superuser')
+PROFILE_FIELDS = ('id', 'user_id', 'position', 'avatar', 'avatar_hash')
+# user.cached_account: {name: value of the lookup}
+ACCOUNT_FIELDS = {
+    'company_id': 'company__id',
+    'plan_code': 'company__subscription__plan_code',
+    'subscription_status': 'company__subscription__status',
+}
+
+COUNTERS = ('local_hits', 'shared_hits', 'misses')
+
+_local = OrderedDict()
+_counts = dict.fromkeys(COUNTERS, 0)
+_lock = threading.Lock()
+
+
+def get(user_id):
+    """The user with pk `user_id` (profile attached), or None if there is none."""
+    key = _key(user_id)
+    with _lock:
+        entry = _local.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            _local.move_to_end(key)
+            row = entry[1]
+            counter = 'local_hits'
+        else:
+            row = None
+    if row is None:
+        row = cache.get(key)
+        counter = 'shared_hits'
+        if row is None:
+            row = _load(user_id)
+            counter = 'misses'
+            if row is None:
+                _count(counter)
+                return None
+            cache.set(key, row, settings.CORE_USER_CACHE['timeout'])
+        _remember(key, row)
+    _count(counter)
+    return _build(row)
+
+
+def invalidate(user_id):
+    """Drops the user's entry now and again after the current transaction commits."""
+    _forget(_key(user_id))
+    # A request reading the old row before the commit may have cached it again
+    transaction.on_commit(lambda: _forget(_key(user_id)))
+
+
+def stats():
+    """Totals of all processes, including this one's unreported counts."""
+    flush()
+    totals = cache.get_many([_counter_key(name) for name in COUNTERS])
+    return {name: totals.get(_counter_key(name), 0) for name in COUNTERS}
+
+
+def reset_stats():
+    with _lock:
+        _counts.update(dict.fromkeys(COUNTERS, 0))
+    cache.delete_many([_counter_key(name) for name in COUNTERS])
+
+
+def flush():
+    """Adds this process's counts to the shared counters."""
+    with _lock:
+        counts = dict(_counts)
+        _counts.update(dict.fromkeys(COUNTERS, 0))
+    for name, count in counts.items():
+        if not count:
+            continue
+        key = _counter_key(name)
+        cache.add(key, 0, None)
+        try:
+            cache.incr(key, count)
+        except ValueError:
+            # Evicted between add and incr
+            cache.set(key, count, None)
+
+
+def clear_local():
+    with _lock:
+        _local.clear()
+
+
+def _load(user_id):
+    User = get_user_model()
+    fields = _user_names() + ['profile__' + name for name in _profile_names()] + list(ACCOUNT_FIELDS.values())
+    row = User.objects.filter(pk=user_id).values_list(*fields).first()
+    if row is None:
+        return None
+    split = len(_user_names())
+    account = len(row) - len(ACCOUNT_FIELDS)
+    return row[:split], (row[split:account] if row[split] is not None else None), row[account:]
+
+
+def _build(row):
+    User = get_user_model()
+    user_values, profile_values, account_values = row
+    user = User.from_db(User.objects.db, _user_names(), user_values)
+    if profile_values is not None:
+        profile = Profile.from_db(Profile.objects.db, _profile_names(), profile_values)
+        User.profile.related.set_cached_value(user, profile)
+        Profile.user.field.set_cached_value(profile, user)
+    user.cached_account = dict(zip(ACCOUNT_FIELDS, account_values))
+    return user
+
+
+def _user_names():
+    # Model.from_db expects the loaded fields in the model's field order
+    return [f.attname for f in get_user_model()._meta.concrete_fields if f.attname in USER_FIELDS]
+
+
+def _profile_names():
+    return [f.attname for f in Profile._meta.concrete_fields if f.attname in PROFILE_FIELDS]
+
+
+def _remember(key, row):
+    options = settings.CORE_USER_CACHE
+    with _lock:
+        _local[key] = (time.monotonic() + options['local_ttl'], row)
+        _local.move_to_end(key)
+        while len(_local) > options['local_size']:
+            _local.popitem(last=False)
+
+
+def _forget(key):
+    with _lock:
+        _local.pop(key, None)
+    cache.delete(key)
+
+
+def _count(name):
+    with _lock:
+        _counts[name] += 1
+        due = sum(_counts.values()) >= settings.CORE_USER_CACHE['report_every']
+    if due:
+        flush()
+
+
+def _key(user_id):
+    return f'core:user:{user_id}:account'
+
+
+def _counter_key(name):
+    return f'core:user-cache:{name}'
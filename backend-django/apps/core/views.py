@@ -1,3 +1,32 @@
-from django.shortcuts import render
+from rest_framework import status
+from rest_framework.parsers import MultiPartParser
+from rest_framework.permissions import IsAdminUser
+from rest_framework.response import Response
+from rest_framework.views import APIView
 
-# Create your views here.
+from . import onboarding
+
+
+class ClientImportView(APIView):
+    """
+    Staff-only bulk onboarding: POST a CSV or JSONL `file` of clients
+    (see apps.core.onboarding); `format` is taken from the file name unless
+    given. Emails that already have a user are skipped; a file that is not
+    UTF-8 or not valid CSV gives a 400 naming where it failed.
+    """
+    permission_classes = [IsAdminUser]
+    parser_classes = [MultiPartParser]
+
+    def post(self, request):
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'error': 'file is required'}, status=status.HTTP_400_BAD_REQUEST)
+        format = request.data.get('format') or onboarding.format_of(upload.name)
+        if format not in onboarding.FORMATS:
+            return Response({'error': 'format must be csv or jsonl'}, status=status.HTTP_400_BAD_REQUEST)
+        result = onboarding.onboard(onboarding.read(upload.file, format))
+        result['errors'] = [{'line': line, 'error': error} for line, error in result['errors']]
+        if 'file_error' in result:
+            # What was read before the failure is created: report it along with the error
+            return Response({'error': result.pop('file_error'), **result}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(result)
@@ -0,0 +1,12 @@
+"""
+CPU-bound work of the core app, run in the process pool of
+apps.cabinet.workers. Like the functions there, these take and return
+plain data and must not touch Django models or settings.
+"""
+from django.utils.module_loading import import_string
+
+
+def hash_passwords(hasher_path, passwords):
+    """Encoded hashes of `passwords` with the hasher class at `hasher_path`; None stays None."""
+    hasher = import_string(hasher_path)()
+    return [hasher.encode(password, hasher.salt()) if password is not None else None for password in passwords]
@@ -24,6 +24,7 @@ INSTALLED_APPS = [
     'rest_framework',
     'djoser',
     'corsheaders',
+    'channels',
 
     # Local apps
     'apps.core',
@@ -61,6 +62,7 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = 'baa_legal_backend.wsgi.application'
+ASGI_APPLICATION = 'baa_legal_backend.asgi.application'
 
 # Database
 DATABASES = {
@@ -70,6 +72,40 @@ DATABASES = {
     }
 }
 
+# Cache
+# Set REDIS_URL when running more than one worker so that all of them share
+# the cache (long-poll wake-ups, cached payloads).
+REDIS_URL = os.getenv('REDIS_URL')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Channels (WebSockets). In-memory layer only reaches sockets served by the
+# same process; set REDIS_URL to fan out across workers and nodes.
+if REDIS_URL:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {'hosts': [REDIS_URL]},
+        }
+    }
+else:
+    CHANNEL_LAYERS = {
+        'default': {
+            'BACKEND': 'channels.layers.InMemoryChannelLayer',
+        }
+    }
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     { 'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator', },
@@ -101,7 +137,7 @@ AUTH_USER_MODEL = 'core.User'
 # REST Framework
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'apps.core.authentication.ClaimsJWTAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
@@ -120,6 +156,30 @@ SIMPLE_JWT = {
     'ACCESS_TOKEN_LIFETIME': timedelta(minutes=60),
     'REFRESH_TOKEN_LIFETIME': timedelta(days=1),
     'AUTH_HEADER_TYPES': ('Bearer',),
+    # Access tokens carry role, company and plan claims (apps.core.authentication)
+    'TOKEN_OBTAIN_SERIALIZER': 'apps.core.authentication.TokenObtainPairSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'apps.core.authentication.TokenRefreshSerializer',
+}
+
+# Users for JWT authentication (apps.core.usercache): an LRU of `local_size`
+# entries kept `local_ttl` seconds in each process, in front of the shared
+# cache. `local_ttl` bounds how long other processes miss a change, such
+# as a user being deactivated. Without REDIS_URL the "shared" cache is per
+# process too, so its entries cannot outlive local_ttl either.
+CORE_USER_CACHE = {
+    'local_size': 1024,
+    'local_ttl': 10,
+    'timeout': 15 * 60 if REDIS_URL else 10,
+    'report_every': 100,
+}
+
+# Bulk client onboarding (apps.core.onboarding): clients per transaction,
+# rows per INSERT, passwords per process pool job, invalid rows reported
+CORE_ONBOARDING = {
+    'chunk_size': 500,
+    'batch_size': 250,
+    'hash_batch_size': 25,
+    'max_errors': 100,
 }
 
 # Djoser
@@ -133,6 +193,115 @@ DJOSER = {
     },
 }
 
+# Cabinet chat long-poll (seconds). Keep the maximum below the gunicorn
+# worker timeout and the nginx proxy_read_timeout.
+CABINET_LONG_POLL_TIMEOUT = 20
+CABINET_LONG_POLL_MAX_TIMEOUT = 25
+CABINET_LONG_POLL_RECHECK_INTERVAL = 1.0
+
+# Client dashboard payload cache (apps.cabinet.dashboard). Changes mark it
+# stale; stale payloads are served while a background thread rebuilds them.
+# Rebuilt anyway after `max_age` seconds for changes no signal reports.
+CABINET_DASHBOARD = {
+    'timeout': 24 * 60 * 60,
+    'max_age': 5 * 60,
+    'refresh_timeout': 30,
+    'refresh_threads': 2,
+}
+
+# Activity feed (apps.cabinet.activity): newest events kept per company,
+# and how often and in what batches older ones are deleted
+CABINET_ACTIVITY = {
+    'timeline_size': 200,
+    'trim_every': 50,
+    'trim_batch_size': 500,
+}
+
+# Direct uploads to an S3-compatible object store. With an endpoint set,
+# DocumentViewSet.direct_upload hands out presigned PUT URLs, so document
+# bytes skip Django both ways. The bucket needs a CORS rule allowing PUT and
+# GET from the frontend origin, and a lifecycle rule is not needed:
+# cleanup_upload_sessions deletes objects that were never finalized.
+# `manage.py run_s3double` serves a local stand-in for development.
+CABINET_OBJECT_STORE = {
+    'endpoint': os.getenv('CABINET_S3_ENDPOINT', ''),
+    'bucket': os.getenv('CABINET_S3_BUCKET', 'depalaw-documents'),
+    'region': os.getenv('CABINET_S3_REGION', 'us-east-1'),
+    'access_key': os.getenv('CABINET_S3_ACCESS_KEY', ''),
+    'secret_key': os.getenv('CABINET_S3_SECRET_KEY', ''),
+    'upload_expires': 15 * 60,
+    'download_expires': 5 * 60,
+    # Presigned GETs of pool jobs, which may wait in the queue
+    'worker_expires': 60 * 60,
+}
+
+# Storage backend for Document.file: content-addressed, deduplicated, plus
+# objects in the object store when direct uploads are enabled
+CABINET_DOCUMENT_STORAGE = (
+    'apps.cabinet.storage.ObjectStorage' if CABINET_OBJECT_STORE['endpoint']
+    else 'apps.cabinet.storage.ContentAddressedStorage'
+)
+
+# Compression at rest for new blobs: files already in a compressed format
+# are skipped, the rest only if a sample shrinks by at least min_saving.
+# zstd needs the zstandard package, gzip is used without it.
+CABINET_COMPRESSION = {
+    'enabled': True,
+    'codec': 'zstd',
+    'min_size': 4 * 1024,
+    'min_saving': 0.1,
+    'sample_size': 256 * 1024,
+}
+
+# Process pool for document previews and text extraction (apps.cabinet.jobs).
+# 0 workers runs jobs inline (tests, small installs). Each worker's address
+# space is capped so one huge file cannot take the server down. Every web
+# worker process has a pool of its own, so the default splits the CPUs
+# between the WEB_CONCURRENCY web workers (run_prod.sh sets it): in all
+# at most CABINET_WORKERS * WEB_CONCURRENCY children and 1 GiB each.
+WEB_CONCURRENCY = int(os.getenv('WEB_CONCURRENCY', 1))
+CABINET_WORKERS = int(os.getenv('CABINET_WORKERS', max(1, (os.cpu_count() or 1) // WEB_CONCURRENCY)))
+CABINET_WORKER_MEMORY_LIMIT = 1024 * 1024 * 1024
+
+# Document previews: width in pixels per size
+CABINET_PREVIEW_SIZES = {'thumbnail': 240, 'preview': 960}
+CABINET_PREVIEW_FORMAT = 'WEBP'
+
+# Document version history (apps.cabinet.versioning): a version is stored
+# as a zstd delta against the one before, with a whole snapshot at least
+# every `snapshot_interval` versions so rebuilding one applies at most that
+# many deltas. Files over `delta_max_size`, and deltas that save less than
+# `min_saving`, are stored whole. Rebuilt versions up to `cache_max_size`
+# stay in the cache for `cache_timeout` seconds.
+CABINET_VERSIONING = {
+    'snapshot_interval': 10,
+    'delta_max_size': 16 * 1024 * 1024,
+    'min_saving': 0.5,
+    'cache_max_size': 8 * 1024 * 1024,
+    'cache_timeout': 60 * 60,
+}
+
+# Extracted document text is cut at this many characters
+CABINET_DOCUMENT_TEXT_MAX_CHARS = 500_000
+
+# Avatar renditions (apps.core.avatars): square sizes in pixels
+AVATAR_RENDITION_SIZES = (32, 64, 256)
+
+# Protected downloads (documents, invoices). When set, Django only checks
+# access and nginx sends the file from this `internal` location aliased to
+# MEDIA_ROOT; when empty, Django streams it with Range/ETag support.
+CABINET_DOWNLOAD_ACCEL_PREFIX = os.getenv('CABINET_DOWNLOAD_ACCEL_PREFIX', '')
+
+# Resumable document uploads. Part files live outside MEDIA_ROOT so they are
+# never served; chunks must fit under nginx client_max_body_size.
+CABINET_UPLOAD_SESSION_DIR = BASE_DIR / 'upload_sessions'
+CABINET_UPLOAD_SESSION_TTL = timedelta(hours=24)
+CABINET_UPLOAD_MAX_CHUNK_SIZE = 8 * 1024 * 1024
+CABINET_UPLOAD_MAX_SIZE = 2 * 1024 * 1024 * 1024
+# Bytes of a multipart document upload that are not the file (boundaries,
+# part headers, the other fields), allowed for by the early quota check
+CABINET_UPLOAD_MULTIPART_SLACK = 16 * 1024
+
 # T-Bank Payments
 # T-Bank Payments
 # Production Credentials
@@ -8,13 +8,14 @@ python3 manage.py migrate
 # Collect static files (if needed)
 # python3 manage.py collectstatic --noinput
 
-# Start Gunicorn (or dev server if gunicorn not installed yet)
-# Using runserver 0.0.0.0:8000 for simplicity as per current setup, 
-# but recommending gunicorn for true prod.
+# Start Gunicorn with Uvicorn workers (ASGI: HTTP + WebSockets under /ws/).
+# With more than one worker set REDIS_URL so the channel layer and cache are shared.
+# Settings size each worker's process pool (CABINET_WORKERS) by WEB_CONCURRENCY.
+export WEB_CONCURRENCY=${WEB_CONCURRENCY:-3}
 if command -v gunicorn &> /dev/null; then
-    gunicorn baa_legal_backend.wsgi:application --bind 0.0.0.0:8000 --workers 3
+    gunicorn baa_legal_backend.asgi:application -k uvicorn.workers.UvicornWorker --bind 0.0.0.0:8000 --workers "$WEB_CONCURRENCY"
 else
     echo "Gunicorn not found, using install..."
     pip install gunicorn
-    gunicorn baa_legal_backend.wsgi:application --bind 0.0.0.0:8000 --workers 3
+    gunicorn baa_legal_backend.asgi:application -k uvicorn.workers.UvicornWorker --bind 0.0.0.0:8000 --workers "$WEB_CONCURRENCY"
 fi
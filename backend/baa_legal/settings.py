@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -104,6 +105,23 @@ DATABASES = {
 #     }
 # }
 
+# Set REDIS_URL when running more than one worker so that all of them share
+# the cache. Without it every process has a cache of its own.
+REDIS_URL = os.getenv('REDIS_URL')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/4.2/ref/settings/#auth-password-validators
@@ -165,7 +183,7 @@ REST_FRAMEWORK = {
         'rest_framework.permissions.AllowAny',  # Allow registration/login without auth
     ],
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'users.authentication.CachedJWTAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
 }
@@ -183,6 +201,18 @@ SIMPLE_JWT = {
     'USER_ID_CLAIM': 'user_id',
 }
 
+# Users for JWT authentication (users.usercache): an LRU of `local_size`
+# entries kept `local_ttl` seconds in each process, in front of the shared
+# cache. `local_ttl` bounds how long other processes miss a change, such
+# as a user being deactivated. Without REDIS_URL the "shared" cache is per
+# process too, so its entries cannot outlive local_ttl either.
+USER_CACHE = {
+    'local_size': 1024,
+    'local_ttl': 10,
+    'timeout': 15 * 60 if REDIS_URL else 10,
+    'report_every': 100,
+}
+
 # Djoser Settings
 DJOSER = {
     'USER_CREATE_PASSWORD_RETYPE': False,
@@ -198,7 +228,9 @@ DJOSER = {
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Avatar renditions (users.avatars): square sizes in pixels
+AVATAR_RENDITION_SIZES = (32, 64, 256)
+
 # Telegram Integration
-import os
 TELEGRAM_BOT_TOKEN = os.environ.get('TELEGRAM_BOT_TOKEN', 'your_bot_token')
 TELEGRAM_CHAT_ID = os.environ.get('TELEGRAM_CHAT_ID', 'your_chat_id')
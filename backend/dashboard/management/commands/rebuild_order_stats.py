@@ -0,0 +1,69 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from dashboard import stats
+from dashboard.models import OrderStats
+
+
+class Command(BaseCommand):
+    help = 'Recounts OrderStats from the orders and fixes the rows that are off, in batches of clients'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument(
+            '--check', action='store_true',
+            help='Only report rows that are off, and fail if there are any',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        check = options['check']
+        clients = get_user_model().objects.filter(role='client').order_by('pk')
+
+        checked = off = 0
+        batch = [None]
+        last_pk = 0
+        while batch:
+            with transaction.atomic():
+                # Locked so that changes made meanwhile are added to the
+                # recounted values instead of being overwritten by them
+                stored = {
+                    row.client_id: row
+                    for row in OrderStats.objects.select_for_update().filter(client_id__in=batch)
+                }
+                if None in batch:
+                    stored.update({row.client_id: row for row in OrderStats.objects.select_for_update().filter(client__isnull=True)})
+                off += self.reconcile(batch, stored, stats.compute(batch), check)
+            checked += len(batch)
+            batch = list(clients.filter(pk__gt=last_pk).values_list('pk', flat=True)[:batch_size])
+            if batch:
+                last_pk = batch[-1]
+
+        if check and off:
+            raise CommandError(f'{off} of {checked} rows are off.')
+        verb = 'are off' if check else 'fixed'
+        self.stdout.write(self.style.SUCCESS(f'Done: {checked} rows checked, {off} {verb}.'))
+
+    def reconcile(self, client_ids, stored, actual, check):
+        created, updated = [], []
+        for client_id in client_ids:
+            label = f'Client {client_id}' if client_id is not None else 'All orders'
+            counts = actual[client_id]
+            row = stored.get(client_id)
+            if row is None:
+                if any(counts.values()) or client_id is None:
+                    self.stdout.write(f'{label}: no stats')
+                    created.append(OrderStats(client_id=client_id, **counts))
+                continue
+            wrong = {status: n for status, n in counts.items() if getattr(row, status) != n}
+            if wrong:
+                self.stdout.write(f'{label}: ' + ', '.join(
+                    f'{status} {getattr(row, status)} -> {n}' for status, n in wrong.items()
+                ))
+                for status, n in wrong.items():
+                    setattr(row, status, n)
+                updated.append(row)
+        if not check:
+            OrderStats.objects.bulk_create(created)
+            OrderStats.objects.bulk_update(updated, stats.COUNTERS)
+        return len(created) + len(updated)
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.27 on 2026-10-18 16:29
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import django.db.models.functions.comparison
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderStats',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pending', models.IntegerField(default=0, verbose_name='Ожидает обработки')),
+                ('awaiting_payment', models.IntegerField(default=0, verbose_name='Ожидает оплаты')),
+                ('in_progress', models.IntegerField(default=0, verbose_name='В работе')),
+                ('completed', models.IntegerField(default=0, verbose_name='Завершен')),
+                ('client', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='order_stats', to=settings.AUTH_USER_MODEL, verbose_name='Клиент')),
+            ],
+            options={
+                'verbose_name': 'Статистика заказов',
+                'verbose_name_plural': 'Статистика заказов',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='orderstats',
+            constraint=models.UniqueConstraint(django.db.models.functions.comparison.Coalesce('client', 0), name='dashboard_unique_order_stats'),
+        ),
+    ]
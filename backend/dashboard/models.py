@@ -0,0 +1,38 @@
+from django.conf import settings
+from django.db import models
+from django.db.models.functions import Coalesce
+
+
+class OrderStats(models.Model):
+    """
+    Order counts per status read by DashboardStatsView as a single row: one
+    row per client, and the row without a client for all orders. Maintained
+    by dashboard.stats; rebuild_order_stats checks and repairs them.
+    """
+    client = models.OneToOneField(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='order_stats',
+        verbose_name='Клиент'
+    )
+    pending = models.IntegerField(default=0, verbose_name='Ожидает обработки')
+    awaiting_payment = models.IntegerField(default=0, verbose_name='Ожидает оплаты')
+    in_progress = models.IntegerField(default=0, verbose_name='В работе')
+    completed = models.IntegerField(default=0, verbose_name='Завершен')
+
+    class Meta:
+        verbose_name = 'Статистика заказов'
+        verbose_name_plural = 'Статистика заказов'
+        constraints = [
+            # A single row for all orders too, which a unique client alone would not ensure
+            models.UniqueConstraint(Coalesce('client', 0), name='dashboard_unique_order_stats'),
+        ]
+
+    @property
+    def total(self):
+        return self.pending + self.awaiting_payment + self.in_progress + self.completed
+
+    def __str__(self):
+        return f"Статистика заказов ({self.client_id or 'все'})"
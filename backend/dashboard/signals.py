@@ -0,0 +1,26 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+from orders.models import Order
+from . import stats
+
+
+@receiver(pre_save, sender=Order)
+def remember_counted(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and not {'client', 'status'} & set(update_fields):
+        instance._counted = (instance.client_id, instance.status)
+    elif instance.pk:
+        instance._counted = Order.objects.filter(pk=instance.pk).values_list('client_id', 'status').first()
+    else:
+        instance._counted = None
+
+
+@receiver(post_save, sender=Order)
+def count_saved(sender, instance, **kwargs):
+    counted = (instance.client_id, instance.status)
+    stats.change(getattr(instance, '_counted', None), counted)
+    instance._counted = counted
+
+
+@receiver(post_delete, sender=Order)
+def count_deleted(sender, instance, **kwargs):
+    stats.change((instance.client_id, instance.status), None)
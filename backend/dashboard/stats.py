@@ -0,0 +1,90 @@
+"""
+Upkeep of OrderStats.
+
+Every order counts in the row of its client and in the row for all
+orders. The signals pass change() what an order counted as before and
+after a save or delete; both rows then move in one UPDATE of F()
+expressions in the same transaction, so concurrent changes never lose an
+increment. Bulk queryset updates bypass the signals: run
+rebuild_order_stats after them.
+
+The price is contention: every order write, whoever the client, also
+updates the single row for all orders and holds its lock until the
+transaction commits, so order writes are serialized on that row. At the
+rate orders change here that costs nothing; summing the client rows on
+read instead would need a row for every client up front.
+"""
+from collections import Counter, defaultdict
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F
+
+from orders.models import Order
+from .models import OrderStats
+
+COUNTERS = [status for status, _ in Order.STATUS_CHOICES]
+
+
+def change(before, after):
+    """`before` and `after` are (client_id, status) of an order, None when it does not exist."""
+    if before == after:
+        return
+    deltas = defaultdict(Counter)
+    for state, step in ((before, -1), (after, 1)):
+        if state is not None and state[1] in COUNTERS:
+            client_id, status = state
+            deltas[client_id][status] += step
+            deltas[None][status] += step
+    for client_id, steps in deltas.items():
+        updates = {status: F(status) + step for status, step in steps.items() if step}
+        if updates:
+            # No row yet: get() counts everything when it is first read
+            _rows(client_id).update(**updates)
+
+
+def compute(client_ids):
+    """Counts per status of each client's orders, None for all: {client_id: {status: n}}."""
+    counts = {client_id: dict.fromkeys(COUNTERS, 0) for client_id in client_ids}
+    orders = Order.objects.order_by()
+    clients = [client_id for client_id in client_ids if client_id is not None]
+    if None in counts:
+        for status, n in orders.values_list('status').annotate(n=Count('pk')):
+            if status in COUNTERS:
+                counts[None][status] = n
+    if clients:
+        rows = orders.filter(client_id__in=clients).values_list('client_id', 'status').annotate(n=Count('pk'))
+        for client_id, status, n in rows:
+            if status in COUNTERS:
+                counts[client_id][status] = n
+    return counts
+
+
+def get(client_id):
+    """OrderStats of a client's orders, or of all orders for None."""
+    stats = _rows(client_id).first()
+    return stats if stats is not None else rebuild(client_id)
+
+
+def rebuild(client_id):
+    """Recounts a row and stores it; returns the OrderStats."""
+    with transaction.atomic():
+        # Changes made meanwhile wait on the row lock and are added after
+        stats = _rows(client_id).select_for_update().first()
+        counts = compute([client_id])[client_id]
+        if stats is None:
+            try:
+                with transaction.atomic():
+                    return OrderStats.objects.create(client_id=client_id, **counts)
+            except IntegrityError:
+                # Created concurrently, and counted by whoever did
+                return _rows(client_id).get()
+        for status, n in counts.items():
+            setattr(stats, status, n)
+        stats.save()
+        return stats
+
+
+def _rows(client_id):
+    if client_id is None:
+        return OrderStats.objects.filter(client__isnull=True)
+    return OrderStats.objects.filter(client_id=client_id)
@@ -0,0 +1,87 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import IntegrityError, transaction
+from django.test import TestCase
+
+from orders.models import Order
+from users.models import User
+from . import stats
+from .models import OrderStats
+
+
+class OrderStatsTest(TestCase):
+    def setUp(self):
+        self.client_user = User.objects.create_user(email='client@example.com', password='testpassword123')
+        self.other = User.objects.create_user(email='other@example.com', password='testpassword123')
+
+    def order(self, client, status='pending'):
+        return Order.objects.create(client=client, title='Contract', service_type='contract', description='', status=status)
+
+    def counts(self, client_id):
+        row = stats.get(client_id)
+        return {status: getattr(row, status) for status in stats.COUNTERS}
+
+    def test_get_counts_existing_orders_on_first_read(self):
+        self.order(self.client_user)
+        self.order(self.other, 'completed')
+        self.assertFalse(OrderStats.objects.exists())
+
+        self.assertEqual(self.counts(self.client_user.pk)['pending'], 1)
+        all_orders = stats.get(None)
+        self.assertEqual((all_orders.pending, all_orders.completed, all_orders.total), (1, 1, 2))
+        self.assertEqual(OrderStats.objects.count(), 2)
+
+    def test_signals_move_the_client_and_global_rows(self):
+        stats.get(self.client_user.pk)
+        stats.get(None)
+        order = self.order(self.client_user)
+        self.order(self.other)
+        self.assertEqual(self.counts(self.client_user.pk)['pending'], 1)
+        self.assertEqual(self.counts(None)['pending'], 2)
+
+        order.status = 'in_progress'
+        order.save()
+        self.assertEqual(self.counts(self.client_user.pk), dict(pending=0, awaiting_payment=0, in_progress=1, completed=0))
+        self.assertEqual(self.counts(None)['in_progress'], 1)
+
+        # Saving other fields changes nothing
+        order.title = 'Lease'
+        order.save(update_fields=['title'])
+        self.assertEqual(self.counts(self.client_user.pk)['in_progress'], 1)
+
+        order.client = self.other
+        order.save()
+        self.assertEqual(self.counts(self.client_user.pk)['in_progress'], 0)
+        self.assertEqual(self.counts(self.other.pk)['in_progress'], 1)
+
+        order.delete()
+        self.assertEqual(self.counts(self.other.pk)['in_progress'], 0)
+        self.assertEqual(self.counts(None), dict(pending=1, awaiting_payment=0, in_progress=0, completed=0))
+
+    def test_rebuild_order_stats_fixes_rows(self):
+        self.order(self.client_user)
+        self.order(self.other, 'awaiting_payment')
+        stats.get(self.client_user.pk)
+        stats.get(None)
+        # Bulk updates bypass the signals
+        Order.objects.update(status='completed')
+
+        with self.assertRaises(CommandError):
+            call_command('rebuild_order_stats', '--check', stdout=StringIO())
+        out = StringIO()
+        call_command('rebuild_order_stats', stdout=out)
+        self.assertIn('3 fixed', out.getvalue())
+        self.assertEqual(self.counts(self.client_user.pk)['completed'], 1)
+        self.assertEqual(self.counts(self.other.pk)['completed'], 1)
+        self.assertEqual(self.counts(None)['completed'], 2)
+        call_command('rebuild_order_stats', '--check', stdout=StringIO())
+
+    def test_single_row_for_all_orders(self):
+        stats.get(None)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            OrderStats.objects.create(client=None)
+        stats.get(self.client_user.pk)
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            OrderStats.objects.create(client=self.client_user)
@@ -2,6 +2,7 @@ from rest_framework import permissions
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from orders.models import Order
+from . import stats
 
 
 class DashboardStatsView(APIView):
@@ -13,16 +14,13 @@ class DashboardStatsView(APIView):
     def get(self, request):
         user = request.user
         
-        # Get order statistics
+        # Order statistics: one row maintained by dashboard.stats
         if user.role == 'client':
             orders = Order.objects.filter(client=user)
+            order_stats = stats.get(user.pk)
         else:
             orders = Order.objects.all()
-        
-        total_orders = orders.count()
-        pending_orders = orders.filter(status='pending').count()
-        in_progress_orders = orders.filter(status='in_progress').count()
-        completed_orders = orders.filter(status='completed').count()
+            order_stats = stats.get(None)
         
         # Get recent orders
         recent_orders = orders.order_by('-created_at')[:5].values(
@@ -31,10 +29,10 @@ class DashboardStatsView(APIView):
         
         return Response({
             'stats': {
-                'total_orders': total_orders,
-                'pending': pending_orders,
-                'in_progress': in_progress_orders,
-                'completed': completed_orders,
+                'total_orders': order_stats.total,
+                'pending': order_stats.pending,
+                'in_progress': order_stats.in_progress,
+                'completed': order_stats.completed,
             },
             'recent_orders': list(recent_orders),
             'subscription': {
@@ -57,8 +55,10 @@ class DashboardCasesView(APIView):
         
         if user.role == 'client':
             orders = Order.objects.filter(client=user)
+            order_stats = stats.get(user.pk)
         else:
             orders = Order.objects.all()
+            order_stats = stats.get(None)
         
         active_cases = orders.filter(
             status__in=['pending', 'in_progress', 'awaiting_payment']
@@ -77,7 +77,7 @@ class DashboardCasesView(APIView):
         
         return Response({
             'cases': cases_data,
-            'total_active': orders.exclude(status='completed').count()
+            'total_active': order_stats.total - order_stats.completed
         })
 
 
@@ -0,0 +1,113 @@
+"""
+Avatar renditions: small square copies of a user's photo, as WebP with a
+JPEG fallback. They are named after the hash of the original, so a name
+never changes its content and nginx serves them with a one-year immutable
+Cache-Control (see the /media/avatars/r/ location). Chat lists show 32 px
+avatars instead of the uploaded multi-megabyte photos.
+
+Port of backend-django's apps.core.avatars; here the photo is on User
+rather than on a Profile (see signals).
+"""
+import hashlib
+import io
+import logging
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+RENDITION_DIR = 'avatars/r'
+# Format name in the API -> (Pillow format, file extension, save options)
+FORMATS = {
+    'webp': ('WEBP', 'webp', {'quality': 80, 'method': 4}),
+    'jpeg': ('JPEG', 'jpg', {'quality': 82, 'optimize': True, 'progressive': True}),
+}
+READ_CHUNK_SIZE = 256 * 1024
+
+
+def content_hash(field_file):
+    digest = hashlib.sha256()
+    with field_file.open('rb') as f:
+        for chunk in iter(lambda: f.read(READ_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:32]
+
+
+def rendition_name(digest, size, fmt):
+    return f'{RENDITION_DIR}/{digest}-{size}.{FORMATS[fmt][1]}'
+
+
+def render(field_file, sizes):
+    """{(size, format): bytes} of the photo cropped to a square."""
+    with field_file.open('rb') as f:
+        image = Image.open(f)
+        # JPEG can decode at 1/2 .. 1/8 scale, which is most of the work saved
+        image.draft('RGB', (max(sizes) * 2, max(sizes) * 2))
+        image = ImageOps.exif_transpose(image)
+        image.load()
+
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'transparency' in image.info or image.mode in ('LA', 'PA') else 'RGB')
+    side = min(image.size)
+    image = ImageOps.fit(image, (side, side), Image.Resampling.LANCZOS) if image.width != image.height else image
+
+    renditions = {}
+    for size in sorted(sizes, reverse=True):
+        image = image.resize((size, size), Image.Resampling.LANCZOS) if image.width > size else image
+        flat = image
+        if image.mode == 'RGBA':
+            flat = Image.new('RGB', image.size, (255, 255, 255))
+            flat.paste(image, mask=image.getchannel('A'))
+        for fmt, (pillow_format, _, options) in FORMATS.items():
+            out = io.BytesIO()
+            (image if fmt == 'webp' else flat).save(out, pillow_format, **options)
+            renditions[size, fmt] = out.getvalue()
+    return renditions
+
+
+def generate(field_file, force=False):
+    """
+    Stores the renditions of an uploaded photo and returns their hash, or ''
+    if the file is not a readable image. Renditions of a photo that is
+    already known are not rendered again, unless `force` is set.
+    """
+    sizes = settings.AVATAR_RENDITION_SIZES
+    try:
+        digest = content_hash(field_file)
+        names = {(size, fmt): rendition_name(digest, size, fmt) for size in sizes for fmt in FORMATS}
+        if not force and all(default_storage.exists(name) for name in names.values()):
+            return digest
+        for key, data in render(field_file, sizes).items():
+            if force:
+                default_storage.delete(names[key])
+            if not default_storage.exists(names[key]):
+                default_storage.save(names[key], ContentFile(data))
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        logger.warning('Avatar renditions of %s failed: %s', field_file.name, e)
+        return ''
+    return digest
+
+
+def discard(digest):
+    for size in settings.AVATAR_RENDITION_SIZES:
+        for fmt in FORMATS:
+            default_storage.delete(rendition_name(digest, size, fmt))
+
+
+def urls(digest, request=None):
+    """
+    {'webp': {size: url}, 'jpeg': {size: url}, 'srcset': {'webp': ..., 'jpeg': ...}}
+    for an <img srcset> / <picture>, or None without renditions.
+    """
+    if not digest:
+        return None
+    data = {'webp': {}, 'jpeg': {}, 'srcset': {}}
+    for fmt in FORMATS:
+        for size in sorted(settings.AVATAR_RENDITION_SIZES):
+            url = default_storage.url(rendition_name(digest, size, fmt))
+            data[fmt][str(size)] = request.build_absolute_uri(url) if request else url
+        data['srcset'][fmt] = ', '.join(f'{url} {size}w' for size, url in data[fmt].items())
+    return data
@@ -59,6 +59,8 @@ class User(AbstractBaseUser, PermissionsMixin):
     
     # Profile photo
     avatar = models.ImageField(upload_to='avatars/', blank=True, null=True, verbose_name="Фото профиля")
+    # Names the resized copies of the photo (see users.avatars)
+    avatar_hash = models.CharField(max_length=32, blank=True, editable=False)
     
     # Company fields (for clients)
     company_name = models.CharField(max_length=255, blank=True, verbose_name="Название компании")
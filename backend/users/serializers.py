@@ -1,6 +1,7 @@
 from rest_framework import serializers
 from djoser.serializers import UserCreateSerializer as BaseUserCreateSerializer
 from .models import User
+from . import avatars
 
 
 class UserRegistrationSerializer(BaseUserCreateSerializer):
@@ -25,10 +26,11 @@ class UserRegistrationSerializer(BaseUserCreateSerializer):
 class UserSerializer(serializers.ModelSerializer):
     """Serializer for user data retrieval"""
     avatar_url = serializers.SerializerMethodField()
+    avatar_renditions = serializers.SerializerMethodField()
     
     class Meta:
         model = User
-        fields = ('id', 'email', 'first_name', 'last_name', 'phone', 'role', 'date_joined', 'avatar', 'avatar_url', 'company_name', 'inn', 'ogrn', 'kpp', 'legal_address')
+        fields = ('id', 'email', 'first_name', 'last_name', 'phone', 'role', 'date_joined', 'avatar', 'avatar_url', 'avatar_renditions', 'company_name', 'inn', 'ogrn', 'kpp', 'legal_address')
         read_only_fields = ('id', 'date_joined')
     
     def get_avatar_url(self, obj):
@@ -39,3 +41,6 @@ class UserSerializer(serializers.ModelSerializer):
             return obj.avatar.url
         return None
 
+    def get_avatar_renditions(self, obj):
+        """Small WebP/JPEG copies with srcset strings; None until rendered."""
+        return avatars.urls(obj.avatar_hash, self.context.get('request'))
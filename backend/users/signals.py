@@ -0,0 +1,34 @@
+from django.db.models.signals import post_delete, pre_save, post_save
+from django.dispatch import receiver
+from .models import User
+from . import avatars, usercache
+
+
+@receiver(pre_save, sender=User)
+def remember_avatar(sender, instance, update_fields=None, **kwargs):
+    instance._previous_avatar = None
+    if update_fields is not None and 'avatar' not in update_fields:
+        # Saving other fields only, e.g. last_login
+        instance._previous_avatar = (instance.avatar.name, instance.avatar_hash)
+    elif instance.pk:
+        instance._previous_avatar = User.objects.filter(pk=instance.pk).values_list('avatar', 'avatar_hash').first()
+
+
+@receiver(post_save, sender=User)
+def render_avatar(sender, instance, **kwargs):
+    """Resized copies for a new photo; the old ones go unless shared."""
+    previous_name, previous_hash = getattr(instance, '_previous_avatar', None) or ('', '')
+    name = instance.avatar.name if instance.avatar else ''
+    if name == (previous_name or ''):
+        return
+    instance.avatar_hash = avatars.generate(instance.avatar) if name else ''
+    User.objects.filter(pk=instance.pk).update(avatar_hash=instance.avatar_hash)
+    if previous_hash and previous_hash != instance.avatar_hash \
+            and not User.objects.filter(avatar_hash=previous_hash).exists():
+        avatars.discard(previous_hash)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def drop_cached_user(sender, instance, **kwargs):
+    usercache.invalidate(instance.pk)
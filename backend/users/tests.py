@@ -1,3 +1,77 @@
-from django.test import TestCase
+import os
+import shutil
+import tempfile
+from io import BytesIO
 
-# Create your tests here.
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.test import TestCase, override_settings
+from PIL import Image
+
+from . import avatars
+from .models import User
+
+
+def image_bytes(size=(1200, 800), fmt='JPEG', color=(200, 30, 30)):
+    out = BytesIO()
+    Image.new('RGB', size, color).save(out, fmt)
+    return out.getvalue()
+
+
+class AvatarRenditionsTest(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        settings_override = override_settings(MEDIA_ROOT=self.tmp, AVATAR_RENDITION_SIZES=(32, 64))
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.user = User.objects.create_user(email='avatar@example.com', password='testpassword123')
+
+    def set_avatar(self, user, data, name='photo.jpg'):
+        user.avatar.save(name, ContentFile(data))
+        user.refresh_from_db()
+        return user
+
+    def exists(self, digest):
+        return default_storage.exists(avatars.rendition_name(digest, 32, 'webp'))
+
+    def test_saving_a_photo_renders_it(self):
+        user = self.set_avatar(self.user, image_bytes())
+        self.assertEqual(len(user.avatar_hash), 32)
+        for size in (32, 64):
+            with default_storage.open(avatars.rendition_name(user.avatar_hash, size, 'jpeg')) as f, Image.open(f) as image:
+                self.assertEqual(image.size, (size, size))
+
+        # Saving other fields does not render again
+        name = avatars.rendition_name(user.avatar_hash, 32, 'webp')
+        mtime = os.path.getmtime(default_storage.path(name))
+        user.first_name = 'Anna'
+        user.save()
+        user.save(update_fields=['last_login'])
+        self.assertEqual(os.path.getmtime(default_storage.path(name)), mtime)
+
+    def test_replaced_photo_is_discarded_unless_shared(self):
+        first = self.set_avatar(self.user, image_bytes()).avatar_hash
+        other = User.objects.create_user(email='other@example.com', password='testpassword123')
+        second = self.set_avatar(other, image_bytes(color=(0, 0, 255))).avatar_hash
+
+        self.set_avatar(other, image_bytes(color=(0, 255, 0)))
+        self.assertFalse(self.exists(second))
+
+        # Still used by the other user
+        self.set_avatar(other, image_bytes())
+        self.set_avatar(self.user, image_bytes(color=(9, 9, 9)))
+        self.assertTrue(self.exists(first))
+
+        third = self.user.avatar_hash
+        self.user.avatar = None
+        self.user.save()
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.avatar_hash, '')
+        self.assertFalse(self.exists(third))
+
+    def test_unreadable_image_has_no_renditions(self):
+        with self.assertLogs('users.avatars', level='WARNING'):
+            user = self.set_avatar(self.user, b'not an image')
+        self.assertEqual(user.avatar_hash, '')
@@ -0,0 +1,128 @@
+"""
+Users for JWT authentication, read through a per-process LRU and the
+shared cache instead of the database on every request.
+
+A port of backend-django's apps.core.usercache, which documents how the
+two tiers, invalidation and the hit counters work. The difference: the
+legacy User has no profile or company claims, so only the User row is
+cached (FIELDS), and only saving or deleting a User drops it (see
+signals). Other processes see a change within USER_CACHE['local_ttl']
+seconds: without REDIS_URL their "shared" cache is their own, and
+settings cap its timeout at local_ttl too.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .models import User
+
+FIELDS = ('id', 'email', 'first_name', 'last_name', 'role', 'is_active', 'is_staff', 'is_superuser')
+
+COUNTERS = ('local_hits', 'shared_hits', 'misses')
+
+_local = OrderedDict()
+_counts = dict.fromkeys(COUNTERS, 0)
+_lock = threading.Lock()
+
+
+def get(user_id):
+    """The user with pk `user_id`, or None if there is none."""
+    key = _key(user_id)
+    with _lock:
+        entry = _local.get(key)
+        if entry is not None and entry[0] > time.monotonic():
+            _local.move_to_end(key)
+            row = entry[1]
+            counter = 'local_hits'
+        else:
+            row = None
+    if row is None:
+        row = cache.get(key)
+        counter = 'shared_hits'
+        if row is None:
+            row = User.objects.filter(pk=user_id).values_list(*_names()).first()
+            counter = 'misses'
+            if row is None:
+                _count(counter)
+                return None
+            cache.set(key, row, settings.USER_CACHE['timeout'])
+        _remember(key, row)
+    _count(counter)
+    return User.from_db(User.objects.db, _names(), row)
+
+
+def invalidate(user_id):
+    """Drops the user's entry now and again after the current transaction commits."""
+    _forget(_key(user_id))
+    # A request reading the old row before the commit may have cached it again
+    transaction.on_commit(lambda: _forget(_key(user_id)))
+
+
+def stats():
+    """Totals of all processes, including this one's unreported counts."""
+    flush()
+    totals = cache.get_many([_counter_key(name) for name in COUNTERS])
+    return {name: totals.get(_counter_key(name), 0) for name in COUNTERS}
+
+
+def reset_stats():
+    with _lock:
+        _counts.update(dict.fromkeys(COUNTERS, 0))
+    cache.delete_many([_counter_key(name) for name in COUNTERS])
+
+
+def flush():
+    """Adds this process's counts to the shared counters."""
+    with _lock:
+        counts = dict(_counts)
+        _counts.update(dict.fromkeys(COUNTERS, 0))
+    for name, count in counts.items():
+        if not count:
+            continue
+        key = _counter_key(name)
+        cache.add(key, 0, None)
+        try:
+            cache.incr(key, count)
+        except ValueError:
+            # Evicted between add and incr
+            cache.set(key, count, None)
+
+
+def _names():
+    # Model.from_db expects the loaded fields in the model's field order
+    return [f.attname for f in User._meta.concrete_fields if f.attname in FIELDS]
+
+
+def _remember(key, row):
+    options = settings.USER_CACHE
+    with _lock:
+        _local[key] = (time.monotonic() + options['local_ttl'], row)
+        _local.move_to_end(key)
+        while len(_local) > options['local_size']:
+            _local.popitem(last=False)
+
+
+def _forget(key):
+    with _lock:
+        _local.pop(key, None)
+    cache.delete(key)
+
+
+def _count(name):
+    with _lock:
+        _counts[name] += 1
+        due = sum(_counts.values()) >= settings.USER_CACHE['report_every']
+    if due:
+        flush()
+
+
+def _key(user_id):
+    return f'users:user:{user_id}'
+
+
+def _counter_key(name):
+    return f'users:user-cache:{name}'
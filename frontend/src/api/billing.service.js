@@ -6,21 +6,20 @@ const BillingService = {
         return response.data;
     },
 
+    downloadInvoice: async (id) => {
+        const response = await axios.get(`/cabinet/invoices/${id}/download/`, { responseType: 'blob' });
+        return response.data;
+    },
+
     getTransactions: async () => {
-        // Assuming we have an endpoint for transactions
-        // If not, we might need to rely on invoice history or create the endpoint
-        // For now, let's try a standard endpoint pattern
         const response = await axios.get('/cabinet/transactions/');
         return response.data;
     },
 
-    getBalance: async () => {
-        // This might come from profile/company
-        // Or a dedicated balance endpoint
-        // Let's assume user profile or company has balance
-        const response = await axios.get('/cabinet/billing/balance/');
+    // { balance } now, or as of `at` (YYYY-MM-DD: the end of that day)
+    getBalance: async (at = null) => {
+        const response = await axios.get('/cabinet/transactions/balance/', { params: at ? { at } : {} });
         return response.data;
-        // If 404, we'll handle gracefully
     }
 };
 
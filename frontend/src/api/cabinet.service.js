@@ -4,6 +4,14 @@ const CabinetService = {
     async getDashboardStats() {
         const response = await axiosInstance.get('/cabinet/dashboard/');
         return response.data;
+    },
+
+    // Activity feed, newest first; pass the previous page's `next` URL to continue
+    async getActivity(next = null, params = {}) {
+        const response = next
+            ? await axiosInstance.get(next)
+            : await axiosInstance.get('/cabinet/activity/', { params });
+        return response.data;
     }
 };
 
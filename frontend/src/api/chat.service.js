@@ -19,11 +19,40 @@ const ChatService = {
         return response.data;
     },
 
-    async getMessages(threadId) {
-        const response = await axiosInstance.get(`/cabinet/threads/${threadId}/messages/`);
+    async getMessages(threadId, params = {}) {
+        // params: { before, after, page_size } - cursors come from `previous` / `next`
+        const response = await axiosInstance.get(`/cabinet/threads/${threadId}/messages/`, { params });
         return response.data;
     },
 
+    // Long-poll: resolves with messages newer than `sinceId`, or [] after the server timeout
+    async pollMessages(threadId, sinceId, timeout) {
+        const params = { since: sinceId };
+        if (timeout !== undefined) params.timeout = timeout;
+        const response = await axiosInstance.get(`/cabinet/threads/${threadId}/poll/`, { params });
+        return response.status === 204 ? [] : response.data.results;
+    },
+
+    // WebSocket feed of a thread: { type: 'message.new' | 'thread.read' | 'thread.status', data }
+    subscribe(threadId, onEvent) {
+        const scheme = window.location.protocol === 'https:' ? 'wss' : 'ws';
+        const token = localStorage.getItem('access_token');
+        const socket = new WebSocket(`${scheme}://${window.location.host}/ws/cabinet/threads/${threadId}/?token=${token}`);
+        socket.onmessage = (event) => onEvent(JSON.parse(event.data));
+        return () => socket.close();
+    },
+
+    async markRead(threadId, messageId) {
+        const payload = messageId ? { message: messageId } : {};
+        const response = await axiosInstance.post(`/cabinet/threads/${threadId}/mark_read/`, payload);
+        return response.data;
+    },
+
+    async getUnreadTotal() {
+        const response = await axiosInstance.get('/cabinet/threads/unread/');
+        return response.data.total;
+    },
+
     async sendMessage(threadId, text, files = []) {
         // TODO: Handle file attachments for messages if backend supports it
         const response = await axiosInstance.post(`/cabinet/threads/${threadId}/add_message/`, { text });
@@ -6,6 +6,12 @@ const DocsService = {
         return response.data;
     },
 
+    // Ranked search over the text of the company's documents
+    async search(q, params = {}) {
+        const response = await axiosInstance.get('/cabinet/documents/search/', { params: { q, ...params } });
+        return response.data;
+    },
+
     async upload(file, category, title) {
         const formData = new FormData();
         formData.append('file', file);
@@ -20,6 +26,71 @@ const DocsService = {
         return response.data;
     },
 
+    // Resumable upload in chunks; safe to call again with the same session after a network error
+    async uploadResumable(file, category, title, { chunkSize = 4 * 1024 * 1024, session = null, onProgress } = {}) {
+        if (!session) {
+            const response = await axiosInstance.post('/cabinet/document-uploads/', {
+                filename: file.name, size: file.size, category, title: title || '',
+            });
+            session = response.data;
+        }
+        let offset = session.offset;
+        while (offset < file.size) {
+            const response = await axiosInstance.put(
+                `/cabinet/document-uploads/${session.id}/`,
+                file.slice(offset, offset + chunkSize),
+                {
+                    headers: { 'Content-Type': 'application/octet-stream', 'Upload-Offset': offset },
+                    validateStatus: (status) => status === 200 || status === 409,
+                },
+            );
+            offset = response.data.offset;
+            if (onProgress) onProgress(offset / file.size);
+        }
+        const response = await axiosInstance.post(`/cabinet/document-uploads/${session.id}/complete/`);
+        return response.data;
+    },
+
+    // Upload straight to object storage with a presigned URL (when the backend has it enabled)
+    async uploadDirect(file, category, title) {
+        const { data: session } = await axiosInstance.post('/cabinet/documents/direct-upload/', {
+            filename: file.name, size: file.size, category, title: title || '',
+        });
+        // The browser sets the signed Content-Length itself; no Authorization header here
+        const { method, url } = session.upload;
+        const response = await fetch(url, { method, body: file });
+        if (!response.ok) throw new Error(`Upload failed: ${response.status}`);
+        const { data } = await axiosInstance.post(`/cabinet/documents/direct-upload/${session.id}/finalize/`);
+        return data;
+    },
+
+    // Authenticated download; returns a Blob (use URL.createObjectURL to open it)
+    async download(id) {
+        const response = await axiosInstance.get(`/cabinet/documents/${id}/download/`, {
+            responseType: 'blob',
+        });
+        return response.data;
+    },
+
+    // Versions of a document's file, newest first
+    async versions(id) {
+        const response = await axiosInstance.get(`/cabinet/documents/${id}/versions/`);
+        return response.data;
+    },
+
+    async downloadVersion(id, number) {
+        const response = await axiosInstance.get(`/cabinet/documents/${id}/versions/${number}/download/`, {
+            responseType: 'blob',
+        });
+        return response.data;
+    },
+
+    // ZIP of the company's documents and invoices; params: category, date_from, date_to, invoices
+    async exportZip(params = {}) {
+        const response = await axiosInstance.get('/cabinet/documents/export/', { params, responseType: 'blob' });
+        return response.data;
+    },
+
     async delete(id) {
         await axiosInstance.delete(`/cabinet/documents/${id}/`);
     }
@@ -121,11 +121,18 @@ const ProfileTab = ({ user, formData, setFormData, onSave, isSaving, onFileSelec
             <div className="flex items-center gap-6">
                 <div className="relative">
                     {user?.avatar_url ? (
-                        <img
-                            src={user.avatar_url}
-                            alt="Avatar"
-                            className="w-24 h-24 rounded-2xl object-cover"
-                        />
+                        <picture>
+                            {user.avatar_renditions && (
+                                <source type="image/webp" srcSet={user.avatar_renditions.srcset.webp} sizes="96px" />
+                            )}
+                            <img
+                                src={user.avatar_renditions?.jpeg['256'] || user.avatar_url}
+                                srcSet={user.avatar_renditions?.srcset.jpeg}
+                                sizes="96px"
+                                alt="Avatar"
+                                className="w-24 h-24 rounded-2xl object-cover"
+                            />
+                        </picture>
                     ) : (
                         <div className="w-24 h-24 rounded-2xl bg-gradient-to-br from-blue-500 to-blue-600 flex items-center justify-center text-white text-3xl font-bold">
                             {getInitials()}